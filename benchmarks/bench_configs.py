@@ -0,0 +1,101 @@
+"""
+Time of filling in defaults, validating and updating deep configs of nested Configurables.
+
+Usage: python benchmarks/bench_configs.py [--depth 10] [--calls 1000]
+"""
+
+import argparse
+from abc import abstractmethod
+from typing import *
+from hyperspace_explorer.configurables import (
+    Configurable,
+    RegisteredAbstractMeta,
+    fill_in_defaults,
+    update_config,
+    merge_config,
+    validate_config,
+)
+from common import timed
+
+WIDTH = 20  # params of each block
+
+
+class Block(Configurable, metaclass=RegisteredAbstractMeta, is_registry=True):
+    @abstractmethod
+    def size(self) -> int:
+        pass
+
+
+class Stack(Block):
+    """A block containing another one - configs of any depth"""
+
+    def __init__(self, Block: Dict, **params):
+        self.block = Block
+        self.params = params
+
+    @classmethod
+    def get_default_config(cls) -> Dict:
+        return {f"param_{i}": i for i in range(WIDTH)}
+
+    def size(self) -> int:
+        return 1
+
+
+class Leaf(Block):
+    def __init__(self, **params):
+        self.params = params
+
+    @classmethod
+    def get_default_config(cls) -> Dict:
+        return {f"param_{i}": [i, i] for i in range(WIDTH)}
+
+    def size(self) -> int:
+        return 0
+
+
+def deep_config(depth: int) -> Dict:
+    """Full config with `depth` nested blocks, only className given in each"""
+    block = {"className": "Leaf"}
+    for _ in range(depth):
+        block = {"className": "Stack", "Block": block}
+    return {"Block": block, "seed": 0}
+
+
+def deep_update(depth: int) -> Dict:
+    """Update of one param at the bottom of a config of `depth` nested blocks"""
+    block = {"param_0": -1}
+    for _ in range(depth):
+        block = {"Block": block}
+    return {"Block": block}
+
+
+def benchmarks(depth: int = 10, calls: int = 1000) -> Iterator[Tuple[str, float]]:
+    config = deep_config(depth)
+    full = fill_in_defaults(config)
+    update = deep_update(depth)
+    size = f"depth={depth},calls={calls}"
+    yield f"configs.fill_in_defaults[{size}]", timed(
+        lambda: [fill_in_defaults(config) for _ in range(calls)]
+    )
+    yield f"configs.validate_config[{size}]", timed(
+        lambda: [validate_config(full) for _ in range(calls)]
+    )
+    yield f"configs.update_config[{size}]", timed(
+        lambda: [update_config(full, update) for _ in range(calls)]
+    )
+    yield f"configs.merge_config[{size}]", timed(
+        lambda: [merge_config(full, update) for _ in range(calls)]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+    for name, seconds in benchmarks(args.depth, args.calls):
+        print(f"{name:<60} {seconds:>8.3f}s {seconds / args.calls * 1e6:>10.1f}us/call")
+
+
+if __name__ == "__main__":
+    main()
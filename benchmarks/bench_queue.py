@@ -0,0 +1,134 @@
+"""
+Throughput of submitting runs to the queue, and of claiming them by many worker processes at once.
+
+Without `--queue-uri`, uses a SQLite queue in a temporary directory - no server needed.
+
+Usage: python benchmarks/bench_queue.py [--runs 2000] [--workers 1 4 8] [--queue-uri mongodb://localhost:27017]
+"""
+
+import argparse
+import multiprocessing
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import *
+from hyperspace_explorer.connections import get_client
+from hyperspace_explorer.queue import RunQueue
+from hyperspace_explorer.queue_backends import SQLITE_URI_PREFIX
+from common import timed
+
+TASK_NAME = "bench_task"
+
+
+def make_queue(tmp_dir: Path, queue_uri: Optional[str]) -> RunQueue:
+    """A new, empty queue - in a new SQLite file, or a new MongoDB database"""
+    tasks_dir = tmp_dir / "tasks"
+    tasks_dir.mkdir(exist_ok=True)
+    (tasks_dir / f"{TASK_NAME}.json").write_text("{}")
+    name = f"bench_{uuid.uuid4().hex[:8]}"
+    if queue_uri is None:
+        queue_uri = f"{SQLITE_URI_PREFIX}{tmp_dir / name}.db"
+    return RunQueue(queue_uri, name, tasks_dir)
+
+
+def drop_queue(q: RunQueue):
+    if not q.mongo_uri.startswith(SQLITE_URI_PREFIX):
+        get_client(q.mongo_uri).drop_database(q.db_name)
+
+
+def configs(n: int) -> Iterator[Dict]:
+    for i in range(n):
+        yield {"model": {"lr": 1e-3 * (i % 10), "layers": [64, 32]}, "seed": i}
+
+
+def _claim_all(uri: str, db_name: str, tasks_dir: Path, start, results):
+    q = RunQueue(uri, db_name, tasks_dir)
+    q.get_available_tasks = lambda: [TASK_NAME]  # not measuring directory listing
+    start.wait()
+    claimed = 0
+    while True:
+        run = q.fetch_one()
+        if run is None:
+            break
+        q.remove(run)
+        claimed += 1
+    results.put(claimed)
+
+
+def claim_time(q: RunQueue, workers: int) -> float:
+    """Time for `workers` processes to claim and remove all runs of the queue"""
+    ctx = multiprocessing.get_context("spawn")
+    start, results = ctx.Event(), ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_claim_all,
+            args=(q.mongo_uri, q.db_name, q.tasks_dir, start, results),
+        )
+        for _ in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    time.sleep(1)  # let the workers import everything
+    begin = time.perf_counter()
+    start.set()
+    claimed = sum(results.get(timeout=600) for _ in processes)
+    elapsed = time.perf_counter() - begin
+    for p in processes:
+        p.join()
+    assert claimed > 0
+    return elapsed
+
+
+def benchmarks(
+    runs: int = 2000,
+    workers: Sequence[int] = (1, 4, 8),
+    queue_uri: Optional[str] = None,
+    claim_repeat: int = 3,
+) -> Iterator[Tuple[str, float]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        queues = []
+
+        def new_queue() -> RunQueue:
+            queues.append(make_queue(tmp_dir, queue_uri))
+            return queues[-1]
+
+        def filled_queue() -> RunQueue:
+            q = new_queue()
+            q.submit_grid(TASK_NAME, configs(runs))
+            return q
+
+        # each submission into a new, empty queue, as the time depends on its size
+        try:
+            yield f"queue.submit_grid[runs={runs}]", timed(
+                lambda q: q.submit_grid(TASK_NAME, configs(runs)), setup=new_queue
+            )
+            yield f"queue.submit[runs={runs // 10}]", timed(
+                lambda q: [q.submit(TASK_NAME, c) for c in configs(runs // 10)],
+                setup=new_queue,
+            )
+            for n in workers:
+                yield f"queue.claim[runs={runs},workers={n}]", min(
+                    claim_time(filled_queue(), n) for _ in range(claim_repeat)
+                )
+        finally:
+            for q in queues:
+                drop_queue(q)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument(
+        "--queue-uri", help="MongoDB URI, SQLite in a temporary directory by default"
+    )
+    args = parser.parse_args()
+    for name, seconds in benchmarks(args.runs, args.workers, args.queue_uri):
+        runs = args.runs // 10 if name.startswith("queue.submit[") else args.runs
+        print(f"{name:<45} {seconds:>8.3f}s {runs / seconds:>10.0f} runs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Scaling of building the results comparison table, with the number of runs and config keys.
+
+With `--mongo-uri`, also of fetching the results from MongoDB (from a temporary database).
+
+Usage: python benchmarks/bench_results_comparison.py [--runs 1000 10000] [--keys 100 1000] [--mongo-uri URI]
+"""
+
+import argparse
+import random
+import uuid
+from typing import *
+from hyperspace_explorer.connections import get_client
+from hyperspace_explorer.results import Task, RUNS_COLLECTION
+from hyperspace_explorer.utils import flatten, unique_suffixes
+from common import timed
+
+TASK_NAME = "bench_task"
+
+
+def make_results(n_runs: int, n_keys: int, seed: int = 0):
+    rng = random.Random(seed)
+    groups = [f"group_{g}" for g in range(max(1, n_keys // 20))]
+    keys = [(rng.choice(groups), f"sub_{k % 7}", f"param_{k}") for k in range(n_keys)]
+    results = []
+    for i in range(n_runs):
+        config = {}
+        for k, (group, sub, name) in enumerate(keys):
+            if k % 10 == 0:
+                value = [1, rng.randint(0, 3)]
+            elif k % 3 == 0:
+                value = "constant"
+            else:
+                value = rng.random()
+            config.setdefault(group, {}).setdefault(sub, {})[name] = value
+        results.append({"_id": i, "result": rng.random(), "config": config})
+    return results
+
+
+def column_names(n_keys: int) -> List[str]:
+    """Columns passed to `unique_suffixes()` by `Task.results_comparison()` of `make_results()`"""
+    [run] = make_results(1, n_keys)
+    return [k for k in flatten(run) if k != "_id"]
+
+
+def fetch_time(results: List[Dict], mongo_uri: str) -> float:
+    """Time of `Task.fetch_results()` of the given results, stored in a temporary database"""
+    db_name = f"bench_{uuid.uuid4().hex[:8]}"
+    client = get_client(mongo_uri)
+    runs = [
+        {**r, "experiment": {"name": TASK_NAME}, "status": "COMPLETED"} for r in results
+    ]
+    client[db_name][RUNS_COLLECTION].insert_many(runs)
+    try:
+        return timed(Task(TASK_NAME, db_name, mongo_uri).fetch_results)
+    finally:
+        client.drop_database(db_name)
+
+
+def benchmarks(
+    runs: Sequence[int] = (1000, 10000),
+    keys: Sequence[int] = (100, 1000),
+    mongo_uri: Optional[str] = None,
+) -> Iterator[Tuple[str, float]]:
+    for n_keys in keys:
+        names = column_names(n_keys)
+        yield f"utils.unique_suffixes[keys={len(names)}]", timed(unique_suffixes, names)
+        for n_runs in runs:
+            results = make_results(n_runs, n_keys)
+            size = f"runs={n_runs},keys={n_keys}"
+            yield f"utils.flatten[{size}]", timed(lambda: [flatten(r) for r in results])
+            yield f"results.results_comparison[{size}]", timed(
+                Task.results_comparison, results, min_repeat=3
+            )
+            if mongo_uri is not None:
+                yield f"results.fetch_results[{size}]", fetch_time(results, mongo_uri)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--keys", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--mongo-uri", help="MongoDB URI, to also measure fetching")
+    args = parser.parse_args()
+    for name, seconds in benchmarks(args.runs, args.keys, args.mongo_uri):
+        print(f"{name:<60} {seconds:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
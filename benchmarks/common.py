@@ -0,0 +1,100 @@
+"""
+Helpers shared by the benchmarks: timing, and storing / comparing results as JSON.
+"""
+
+import datetime
+import gc
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+from typing import *
+
+
+def timed(
+    func: Callable,
+    *args,
+    setup: Optional[Callable[[], Any]] = None,
+    min_time: float = 0.2,
+    min_repeat: int = 5,
+) -> float:
+    """
+    Time of one call of `func(*args)`, in seconds - the best of many calls, with garbage collection off.
+
+    It is called at least `min_repeat` times, and until the calls took `min_time` seconds in total - so
+    that short calls are measured many times, and the result does not depend on a single noisy one.
+
+    :param setup: called before each call, not timed - its result is then passed to `func` as the first
+        argument, e.g. a new, empty queue
+    """
+    times = []
+    gc_enabled = gc.isenabled()
+    try:
+        while len(times) < min_repeat or sum(times) < min_time:
+            call_args = args if setup is None else (setup(), *args)
+            gc.disable()
+            start = time.perf_counter()
+            func(*call_args)
+            times.append(time.perf_counter() - start)
+            if gc_enabled:
+                gc.enable()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return min(times)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        )
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def save_results(results: Dict[str, float], path: Path):
+    data = {
+        "time": datetime.datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "results": results,
+    }
+    path.write_text(json.dumps(data, indent=2) + "\n")
+
+
+def load_results(path: Path) -> Dict[str, float]:
+    return json.loads(path.read_text())["results"]
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], tolerance: float
+) -> List[str]:
+    """
+    Prints times relative to the baseline.
+
+    :param tolerance: allowed slowdown, e.g. 0.25 - up to 25% slower than the baseline
+    :return: names of benchmarks slower than allowed
+    """
+    regressions = []
+    print(f"{'benchmark':<50} {'baseline [s]':>13} {'now [s]':>10} {'ratio':>7}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<50} {'-':>13} {seconds:>10.4f} {'new':>7}")
+            continue
+        ratio = seconds / base if base > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<50} {base:>13.4f} {seconds:>10.4f} {ratio:>7.2f}{flag}")
+    for name in baseline.keys() - results.keys():
+        print(f"{name:<50} {baseline[name]:>13.4f} {'-':>10} {'gone':>7}")
+    return regressions
@@ -0,0 +1,101 @@
+"""
+Runs all benchmarks, optionally saving the results as a baseline, or comparing them with one.
+
+Runs without a network by default: the queue is benchmarked with SQLite, fetching results is skipped.
+Give `--mongo-uri` of a local mongod to benchmark both against MongoDB (in temporary databases).
+
+Usage:
+    python benchmarks/run_all.py --save baseline.json
+    # ... change the library ...
+    python benchmarks/run_all.py --compare baseline.json [--tolerance 0.25]
+Exits with status 1 if any benchmark is slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import *
+import bench_configs
+import bench_queue
+import bench_results_comparison
+from common import save_results, load_results, compare
+
+# (full, quick) arguments of each benchmark module
+SIZES = {
+    "configs": ({"depth": 10, "calls": 1000}, {"depth": 5, "calls": 100}),
+    "results": (
+        {"runs": [1000, 10000], "keys": [100, 1000]},
+        {"runs": [200], "keys": [100]},
+    ),
+    "queue": ({"runs": 2000, "workers": [1, 4, 8]}, {"runs": 200, "workers": [1, 2]}),
+}
+
+
+def run_all(
+    quick: bool = False, mongo_uri: Optional[str] = None, rounds: int = 3
+) -> Dict[str, float]:
+    """
+    Best times of each benchmark over `rounds` runs of the whole suite - spread in time, so that a busy
+    moment of the machine does not slow down all measurements of a benchmark
+    """
+    sizes = {name: s[quick] for name, s in SIZES.items()}
+    results = {}
+    for i in range(rounds):
+        print(f"Round {i + 1}/{rounds}")
+        suites = [
+            bench_configs.benchmarks(**sizes["configs"]),
+            bench_results_comparison.benchmarks(
+                **sizes["results"], mongo_uri=mongo_uri
+            ),
+            bench_queue.benchmarks(**sizes["queue"], queue_uri=mongo_uri),
+        ]
+        for suite in suites:
+            for name, seconds in suite:
+                print(f"{name:<60} {seconds:>8.4f}s", flush=True)
+                results[name] = min(seconds, results.get(name, seconds))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0],
+        epilog="Timings are comparable only between runs on the same machine, with the same options",
+    )
+    parser.add_argument("--save", help="Save results to this JSON file", type=Path)
+    parser.add_argument(
+        "--compare", help="Compare results with a baseline JSON file", type=Path
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="Allowed slowdown relative to the baseline, e.g. 0.25 - 25%%",
+        type=float,
+        default=0.25,
+    )
+    parser.add_argument(
+        "--quick",
+        help="Smaller workloads, e.g. to check the suite runs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--mongo-uri", help="Benchmark the queue and fetching results with this MongoDB"
+    )
+    parser.add_argument(
+        "--rounds",
+        help="Run the suite this many times, keeping the best time of each benchmark",
+        type=int,
+        default=3,
+    )
+    args = parser.parse_args()
+    results = run_all(args.quick, args.mongo_uri, args.rounds)
+    if args.save is not None:
+        save_results(results, args.save)
+    if args.compare is not None:
+        print()
+        regressions = compare(results, load_results(args.compare), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmarks slower than the baseline")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,14 @@ from abc import ABCMeta, abstractmethod, ABC
 from typing import *
 from copy import copy, deepcopy
 import dataclasses
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
 
 factories = {}
 CLASS_NAME_FIELD = "className"
+IMMUTABLE_TYPES = (int, float, str, bool, bytes, type(None))
 
 
 class RegisteredAbstractMeta(ABCMeta):
@@ -58,47 +63,211 @@ class Configurable(ABC):
 
     @classmethod
     def from_config(cls, params) -> "Configurable":
-        params = deepcopy(params)
+        """
+        Creates an instance of the subclass named in `params`, with defaults filled in.
+        Values from `params` are passed as they are, not copied - the constructor must not modify them.
+        """
         cname = params[CLASS_NAME_FIELD]
-        del params[CLASS_NAME_FIELD]
-
-        full = cls.subclass_registry[cname].get_default_config()
+        full = cls.subclass_registry[cname].config_schema().defaults()
         full.update(params)
+        del full[CLASS_NAME_FIELD]
         return cls.factory(cname, full)
 
+    @classmethod
+    def config_schema(cls) -> "ConfigSchema":
+        """Schema of the config of this class - built on first use, then cached"""
+        # looking only at this class, not inherited schemas
+        schema = cls.__dict__.get("_config_schema")
+        if schema is None:
+            schema = ConfigSchema(cls)
+            cls._config_schema = schema
+        return schema
+
 
 @dataclasses.dataclass
 class ConfigurableDataclass(Configurable):
     @classmethod
     def get_default_config(cls) -> Dict:
-        res = {}
-        for f in dataclasses.fields(cls):
-            if not isinstance(f.default, dataclasses._MISSING_TYPE):
-                res[f.name] = f.default
-            if not isinstance(f.default_factory, dataclasses._MISSING_TYPE):
-                res[f.name] = f.default_factory()
+        return cls.config_schema().defaults()
+
+
+class ConfigSchema:
+    """
+    What a Configurable class expects in its config: default values, allowed keys and their types.
+    Params named like a factory (e.g. `Engine`) are configs of other Configurables, or lists of them.
+    """
+
+    def __init__(self, cls: Type[Configurable]):
+        self.cls = cls
+        self._defaults: Dict[str, Any] = {}
+        self._default_factories: Dict[str, Callable[[], Any]] = {}
+        if dataclasses.is_dataclass(cls) and issubclass(cls, ConfigurableDataclass):
+            fields = dataclasses.fields(cls)
+            self.types = {f.name: f.type for f in fields}
+            for f in fields:
+                if f.default is not dataclasses.MISSING:
+                    self._defaults[f.name] = f.default
+                if f.default_factory is not dataclasses.MISSING:
+                    self._default_factories[f.name] = f.default_factory
+            self.accepts_any_key = False
+            optional = set()
+        else:
+            self._defaults = cls.get_default_config()
+            self.types, optional, self.accepts_any_key = _init_params(cls)
+        self.required = (
+            set(self.types)
+            - set(self._defaults)
+            - set(self._default_factories)
+            - optional
+        )
+        # mutable default values are copied for each config
+        self._to_copy = {
+            k for k, v in self._defaults.items() if not isinstance(v, IMMUTABLE_TYPES)
+        }
+
+    def defaults(self) -> Dict:
+        """A new dict of default values"""
+        res = dict(self._defaults)
+        for k in self._to_copy:
+            res[k] = deepcopy(res[k])
+        for k, factory in self._default_factories.items():
+            res[k] = factory()
         return res
 
+    def fill(self, params: Dict) -> Dict:
+        """A copy of `params` with missing values set to defaults, recursively for nested Configurables"""
+        res = self.defaults()
+        if logger.isEnabledFor(logging.DEBUG):
+            for k in res.keys() - params.keys():
+                logger.debug(f"{self.cls.__name__}: setting {k}={res[k]}")
+        res.update(params)
+        return _fill_nested(res)
+
+    def validate(self, params: Dict, path: str = "") -> List[str]:
+        """
+        Checks a config of this class (with or without defaults filled in), recursively.
+
+        :return: descriptions of problems found: unknown keys, values of wrong types, missing values
+        """
+        errors = []
+        given = set(params) - {CLASS_NAME_FIELD}
+        if not self.accepts_any_key:
+            for k in sorted(given - set(self.types)):
+                errors.append(f"{path}{k}: unknown key for {self.cls.__name__}")
+        for k in sorted(self.required - given):
+            errors.append(f"{path}{k}: missing value for {self.cls.__name__}")
+        for k in sorted(given):
+            v = params[k]
+            if k in factories and _is_configurable_config(v):
+                errors.extend(_validate_nested(k, v, f"{path}{k}"))
+            elif k in self.types and not _matches_type(v, self.types[k]):
+                errors.append(
+                    f"{path}{k}: expected {_type_name(self.types[k])}, got {type(v).__name__}"
+                )
+        return errors
+
+
+def _init_params(cls: type) -> Tuple[Dict[str, Any], Set[str], bool]:
+    """Types of params of the constructor, names of those with default values, and whether it takes **kwargs"""
+    signature = inspect.signature(cls.__init__)
+    types, optional = {}, set()
+    accepts_any_key = False
+    for name, param in list(signature.parameters.items())[1:]:  # skipping `self`
+        if param.kind == param.VAR_KEYWORD:
+            accepts_any_key = True
+        elif param.kind != param.VAR_POSITIONAL:
+            types[name] = param.annotation
+            if param.default is not param.empty:
+                optional.add(name)
+    return types, optional, accepts_any_key
+
+
+def _matches_type(value: Any, annotation: Any) -> bool:
+    """Checks simple annotations: classes, Optional/Union, List/Dict/Tuple. Others always match"""
+    if annotation in (inspect.Parameter.empty, Any) or isinstance(annotation, str):
+        return True
+    origin = getattr(annotation, "__origin__", None)
+    if origin is Union:
+        return any(_matches_type(value, a) for a in annotation.__args__)
+    if origin is not None:
+        annotation = origin
+    if not isinstance(annotation, type):
+        return True
+    if annotation is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if annotation in (list, tuple):  # json has no tuples
+        return isinstance(value, (list, tuple))
+    return isinstance(value, annotation)
+
+
+def _type_name(annotation: Any) -> str:
+    return getattr(annotation, "__name__", None) or str(annotation)
+
+
+def _is_configurable_config(value: Any) -> bool:
+    if isinstance(value, list):
+        return len(value) > 0 and all(_is_configurable_config(v) for v in value)
+    return isinstance(value, dict) and CLASS_NAME_FIELD in value
+
+
+def _subclass_schema(factory_name: str, config: Dict) -> ConfigSchema:
+    return (
+        factories[factory_name]
+        .subclass_registry[config[CLASS_NAME_FIELD]]
+        .config_schema()
+    )
+
+
+def _fill_nested(params: Dict) -> Dict:
+    for k in params.keys() & factories.keys():
+        v = params[k]
+        if not _is_configurable_config(v):
+            continue
+        if isinstance(v, list):
+            params[k] = [_subclass_schema(k, c).fill(c) for c in v]
+        else:
+            params[k] = _subclass_schema(k, v).fill(v)
+    return params
+
+
+def _validate_nested(factory_name: str, value: Any, path: str) -> List[str]:
+    if isinstance(value, list):
+        errors = []
+        for i, config in enumerate(value):
+            errors.extend(_validate_nested(factory_name, config, f"{path}[{i}]"))
+        return errors
+    cname = value[CLASS_NAME_FIELD]
+    if cname not in factories[factory_name].subclass_registry:
+        return [f"{path}: unknown {factory_name} class {cname}"]
+    return _subclass_schema(factory_name, value).validate(value, f"{path}.")
+
 
 def fill_in_defaults(params: Dict, factory_name: Optional[str] = None) -> Dict:
     """
     Given a config dictionary, return a copy with filled in defaults.
-    Recursive; if passing a full config (without `className` at top level,
+    Recursive, also for lists of Configurables; if passing a full config (without `className` at top level,
     do not pass `factory_name`.
     """
-    params = params.copy()
     if CLASS_NAME_FIELD in params.keys():
-        cn = params[CLASS_NAME_FIELD]
-        defaults = factories[factory_name].subclass_registry[cn].get_default_config()
-        for k, v in defaults.items():
-            if k not in params.keys():
-                params[k] = v
-                print(f"Setting {k}={v}")
+        return _subclass_schema(factory_name, params).fill(params)
+    return _fill_nested(params.copy())
+
+
+def validate_config(params: Dict, factory_name: Optional[str] = None) -> List[str]:
+    """
+    Checks a config: unknown keys, values of wrong types, missing values. Recursive, like `fill_in_defaults`.
+
+    :return: descriptions of problems found, empty if the config is valid
+    """
+    if CLASS_NAME_FIELD in params.keys():
+        if params[CLASS_NAME_FIELD] not in factories[factory_name].subclass_registry:
+            return [f"unknown {factory_name} class {params[CLASS_NAME_FIELD]}"]
+        return _subclass_schema(factory_name, params).validate(params)
+    errors = []
     for k, v in params.items():
-        if isinstance(v, Dict) and CLASS_NAME_FIELD in v.keys():
-            params[k] = fill_in_defaults(v, k)
-        # TODO: should we handle lists of Configurables? for now ignoring lists altogether
-    return params
+        if k in factories and _is_configurable_config(v):
+            errors.extend(_validate_nested(k, v, k))
+    return errors
 
 
 def update_config(c1: Dict, c2: Dict) -> Dict:
@@ -114,19 +283,29 @@ def update_config(c1: Dict, c2: Dict) -> Dict:
     :param c2: updates to the config
     :return: Dict, modified copy of c1
     """
-    c1 = deepcopy(c1)
+    return merge_config(deepcopy(c1), c2)
+
+
+def merge_config(c1: Dict, c2: Dict) -> Dict:
+    """
+    Like `update_config()`, but without copying `c1` - only dicts on paths changed by `c2` are new,
+    all other values are shared with `c1` (and `c2`). Cheap, even for large configs - but the result
+    must not be modified in place.
+
+    :param c1: source config
+    :param c2: updates to the config
+    :return: Dict, updated config sharing structure with c1
+    """
+    merged = dict(c1)
     for k, v in c2.items():
-        if isinstance(v, Dict):  # another Configurable config
-            if k not in c1.keys():
-                c1[k] = v
-            else:
-                if (
-                    CLASS_NAME_FIELD not in v.keys()
-                    or c1[k][CLASS_NAME_FIELD] == v[CLASS_NAME_FIELD]
-                ):
-                    c1[k] = update_config(c1[k], v)
-                else:  # c2 sets a different subclass - replacing the config completely
-                    c1[k] = v
-        else:  # normal value
-            c1[k] = v
-    return c1
+        old = c1.get(k)
+        if (
+            isinstance(v, dict)
+            and isinstance(old, dict)
+            and v.get(CLASS_NAME_FIELD, old.get(CLASS_NAME_FIELD))
+            == old.get(CLASS_NAME_FIELD)
+        ):
+            merged[k] = merge_config(old, v)
+        else:  # a normal value, a new component, or c2 sets a different subclass - replacing completely
+            merged[k] = v
+    return merged
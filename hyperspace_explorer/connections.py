@@ -0,0 +1,61 @@
+import os
+import threading
+from typing import *
+from pymongo import MongoClient
+
+# applied to clients created after they are changed, see `configure()`
+POOL_OPTIONS = {
+    "maxPoolSize": 10,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 5 * 60 * 1000,
+}
+
+_clients: Dict[Tuple[str, FrozenSet], MongoClient] = {}
+_lock = threading.Lock()
+
+
+def get_client(mongo_uri: str, **options) -> MongoClient:
+    """
+    Returns the process-wide MongoClient for a URI (and options), creating it on first use.
+
+    Clients connect lazily, on the first operation. After `fork()`, the child process gets new clients -
+    pymongo clients must not be shared between processes.
+
+    :param mongo_uri: MongoDB URI
+    :param options: extra MongoClient options, overriding `POOL_OPTIONS`
+    """
+    key = (mongo_uri, frozenset(options.items()))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = MongoClient(
+                mongo_uri, connect=False, **{**POOL_OPTIONS, **options}
+            )
+            _clients[key] = client
+    return client
+
+
+def configure(**pool_options):
+    """Changes MongoClient options (e.g. maxPoolSize) used by clients created from now on"""
+    POOL_OPTIONS.update(pool_options)
+
+
+def close_all():
+    """Closes all clients of this process. They are recreated by later `get_client()` calls"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+def _forget_after_fork():
+    # sockets of the parent's clients must not be used, nor closed, in the child
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+# not available on Windows, which cannot fork anyway
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_after_fork)
@@ -0,0 +1,145 @@
+import abc
+import collections
+from typing import *
+from pymongo import ASCENDING
+from .connections import get_client
+from .schema import IndexSpec, ensure_schema
+
+EARLY_STOPPING_FIELD = "EarlyStopping"
+RUNGS_COLLECTION = "rungs"
+
+
+class RungStore(abc.ABC):
+    """Values of a metric reached by runs of a task at each rung (step)"""
+
+    @abc.abstractmethod
+    def record(
+        self, task_name: str, rung: int, run_id: Any, value: float
+    ) -> List[float]:
+        """Records the value of a run at a rung. Returns values of all runs recorded at that rung so far"""
+        pass
+
+
+class MemoryRungStore(RungStore):
+    """Rungs kept in memory - only shared by runs in one process"""
+
+    def __init__(self):
+        self.values = collections.defaultdict(dict)
+
+    def record(
+        self, task_name: str, rung: int, run_id: Any, value: float
+    ) -> List[float]:
+        at_rung = self.values[(task_name, rung)]
+        at_rung[run_id] = value
+        return list(at_rung.values())
+
+
+class MongoRungStore(RungStore):
+    """Rungs stored in MongoDB, shared by all workers of a study"""
+
+    schema_version = 1
+    indexes = [
+        IndexSpec(
+            RUNGS_COLLECTION,
+            [("task_name", ASCENDING), ("rung", ASCENDING), ("run_id", ASCENDING)],
+            {"unique": True},
+        )
+    ]
+
+    def __init__(self, mongo_uri: str, db_name: str):
+        db = get_client(mongo_uri)[db_name]
+        self.c = db[RUNGS_COLLECTION]
+        ensure_schema(db, RUNGS_COLLECTION, self.schema_version, self.indexes)
+
+    def record(
+        self, task_name: str, rung: int, run_id: Any, value: float
+    ) -> List[float]:
+        key = {"task_name": task_name, "rung": rung}
+        self.c.update_one(
+            {**key, "run_id": run_id}, {"$set": {"value": value}}, upsert=True
+        )
+        return [d["value"] for d in self.c.find(key, {"value": 1, "_id": 0})]
+
+
+class ASHAPruner:
+    """
+    Asynchronous successive halving (Li et al. 2018) for one run: decides whether to stop it early,
+    based on values of a metric it logged.
+
+    Rungs are at steps `min_step * eta ** k`. When the run reaches a rung, its last value of `metric`
+    is recorded there, and compared with values of other runs of the task at the same rung. The run
+    continues only if it is among the best `1 / eta` of them. Runs are never stopped at a rung with
+    fewer than `min_peers` values recorded.
+    """
+
+    def __init__(
+        self,
+        store: RungStore,
+        task_name: str,
+        run_id: Any,
+        metric: str,
+        mode: str = "max",
+        min_step: int = 1,
+        eta: float = 3,
+        max_step: Optional[int] = None,
+        min_peers: Optional[int] = None,
+    ):
+        """
+        :param store: where rungs are stored, shared by runs of the task
+        :param task_name: name of the task
+        :param run_id: id of the run
+        :param metric: name of the metric logged by the scenario with `log_scalar()`
+        :param mode: 'max' if higher values are better, 'min' otherwise
+        :param min_step: step of the first rung
+        :param eta: reduction factor - only 1 in `eta` runs continues past each rung
+        :param max_step: no rungs at or after this step, if given
+        :param min_peers: minimum number of values at a rung to stop a run there, `eta` by default
+        """
+        if mode not in ("max", "min"):
+            raise ValueError(f"mode should be 'max' or 'min', got: {mode}")
+        if eta <= 1 or min_step < 1:
+            raise ValueError(
+                f"eta should be above 1 and min_step at least 1, got: {eta}, {min_step}"
+            )
+        self.store = store
+        self.task_name = task_name
+        self.run_id = run_id
+        self.metric = metric
+        self.mode = mode
+        self.eta = eta
+        self.min_step = min_step
+        self.max_step = max_step
+        self.min_peers = min_peers if min_peers is not None else int(eta)
+        self.next_rung = 0
+
+    @classmethod
+    def from_config(
+        cls, config: Dict, store: RungStore, task_name: str, run_id: Any
+    ) -> "ASHAPruner":
+        """Creates a pruner from the `EarlyStopping` section of a task json file - keyword arguments"""
+        return cls(store, task_name, run_id, **config)
+
+    def report(self, step: int, value: float) -> bool:
+        """
+        Takes a value of the metric, returns True if the run should stop.
+        """
+        stop = False
+        rung = self.rung_step(self.next_rung)
+        while step >= rung and (self.max_step is None or rung < self.max_step):
+            values = self.store.record(self.task_name, rung, self.run_id, value)
+            stop = stop or self._should_stop(value, values)
+            self.next_rung += 1
+            rung = self.rung_step(self.next_rung)
+        return stop
+
+    def rung_step(self, k: int) -> int:
+        return int(round(self.min_step * self.eta**k))
+
+    def _should_stop(self, value: float, values: List[float]) -> bool:
+        if len(values) < self.min_peers:
+            return False
+        if self.mode == "max":
+            better = sum(v > value for v in values)
+        else:
+            better = sum(v < value for v in values)
+        return better >= max(1, int(len(values) / self.eta))
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import math
+from typing import *
+from .configurables import fill_in_defaults
+
+FINGERPRINT_FIELD = "fingerprint"
+CODE_VERSION_FIELD = "code_version"
+
+# what to do when submitting a run identical to one queued, in progress or completed:
+# submit it anyway, skip it, or skip it and return the id of the existing one
+DUPLICATE_POLICIES = ("allow", "skip", "attach")
+
+
+def canonical(value: Any) -> Any:
+    """
+    JSON-compatible form of a config value, the same for equivalent values: tuples become lists,
+    integral floats - ints, numpy scalars and arrays - Python numbers and lists.
+    """
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if hasattr(value, "tolist"):  # numpy
+        return canonical(value.tolist())
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return repr(value)
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def config_fingerprint(task_name: str, params: Dict, fill_defaults: bool = True) -> str:
+    """
+    Hash identifying a run: the same for configs of a task differing only in key order, number types
+    (`2` vs `2.0`), lists vs tuples, or in default values being given explicitly.
+
+    Defaults are only filled in for Configurable classes imported in this process - configs should be
+    submitted with the same classes imported as in workers (e.g. the `scenarios` module), for fingerprints
+    of queued runs to match those of completed ones.
+
+    :param task_name: name of the task
+    :param params: config of the run
+    :param fill_defaults: whether to fill in defaults - not needed if `params` already have them
+    """
+    if fill_defaults:
+        params = fill_in_defaults(params)
+    payload = json.dumps(
+        [task_name, canonical(params)],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
@@ -1,59 +1,361 @@
 #!/usr/bin/env python
 from pathlib import Path
+import os
 import traceback
-import time
 import argparse
 import sys
 import copy
 import json
+import collections
+import datetime
+import functools
+from typing import *
 from sacred import observers, Experiment, settings
-from hyperspace_explorer.queue import RunQueue, QueuedRun
+from hyperspace_explorer.queue import RunQueue, QueuedRun, LeaseHeartbeat, Resources
 from hyperspace_explorer.configurables import fill_in_defaults
+from hyperspace_explorer.worker_pool import (
+    WorkerPool,
+    IsolatedRunner,
+    RunLimits,
+    set_thread_count,
+)
+from hyperspace_explorer.results import RUNS_COLLECTION, Study
+from hyperspace_explorer.connections import get_client
+from hyperspace_explorer.fingerprint import (
+    config_fingerprint,
+    FINGERPRINT_FIELD,
+    CODE_VERSION_FIELD,
+)
+from hyperspace_explorer.sacred_sources import (
+    SourceDiscovery,
+    SourceCachingMongoObserver,
+)
+from hyperspace_explorer.timing import (
+    PhaseTimer,
+    TimingSink,
+    JsonlSink,
+    MongoSink,
+    KIND_LOOP,
+    IDLE_PHASE,
+)
+from hyperspace_explorer.early_stopping import (
+    ASHAPruner,
+    RungStore,
+    MongoRungStore,
+    EARLY_STOPPING_FIELD,
+)
 
-# because of the way things get imported, the default discovery strategies do not work
-settings.SETTINGS.DISCOVER_SOURCES = "sys"
-settings.SETTINGS.DISCOVER_DEPENDENCIES = "sys"
+# because of the way things get imported, the default discovery strategies do not work - sources and
+# dependencies are found by `SourceDiscovery` instead, once per process, with the 'sys' strategies
+settings.SETTINGS.DISCOVER_SOURCES = "none"
+settings.SETTINGS.DISCOVER_DEPENDENCIES = "none"
+source_discovery = SourceDiscovery("sys", "sys")
 
 
-def process_queue(tasks_dir: Path, db_name: str, mongo_uri: str, sleep_time: int):
-    observer = observers.MongoObserver(mongo_uri, db_name=db_name)
-    q = RunQueue(mongo_uri, db_name, tasks_dir)
+def process_queue(
+    tasks_dir: Path,
+    db_name: str,
+    mongo_uri: str,
+    sleep_time: int,
+    lease_duration: float,
+    max_attempts: Optional[int],
+    wait_mode: str,
+    warm_size: int,
+    queue_uri: Optional[str] = None,
+    slots: int = 1,
+    cpu_affinity: bool = False,
+    capacity: Optional[Resources] = None,
+    limits: Optional[RunLimits] = None,
+    code_version: Optional[str] = None,
+    skip_completed: bool = False,
+    timing_sinks: Sequence[TimingSink] = (),
+    timing_flush_interval: float = 60,
+):
+    """
+    Processes runs from the queue, forever.
+
+    :param timing_sinks: where to write timing records of phases of runs and, with one slot,
+        of the worker loop (see `timing`) - not measured if empty
+    :param timing_flush_interval: how often to write records of the loop while idle, in seconds
+    """
+    Study(db_name, mongo_uri).ensure_indexes()
+    prime_sources(mongo_uri, db_name)
+    q = RunQueue(
+        queue_uri or mongo_uri,
+        db_name,
+        tasks_dir,
+        lease_duration,
+        max_attempts,
+        change_streams=wait_mode == "push",
+    )
+    q.backoff.maximum = sleep_time
+    runner_factory = functools.partial(
+        make_runner,
+        mongo_uri,
+        db_name,
+        warm_size,
+        code_version=code_version,
+        skip_completed=skip_completed,
+        timing_sinks=timing_sinks,
+    )
+    if limits is not None:
+        on_killed = functools.partial(mark_killed_run, mongo_uri, db_name)
+        runner_factory = functools.partial(
+            IsolatedRunner, runner_factory, limits, on_killed
+        )
+    if slots > 1:
+        WorkerPool(q, runner_factory, slots, cpu_affinity, sleep_time, capacity).run()
+        return
+    run = runner_factory()
+    timer = PhaseTimer(timing_sinks, kind=KIND_LOOP)
+    waiting = False
     while True:
-        t = q.fetch_one()
+        q.reclaim_expired()
+        t = q.fetch_one(capacity)
+        timer.lap("fetch")
         if t is None:
-            print("No available tasks in the queue. Sleeping.")
-            time.sleep(sleep_time)
+            if not waiting:
+                print("No available tasks in the queue. Waiting.")
+                waiting = True
+            q.wait_for_ready(sleep_time, capacity)
+            timer.lap(IDLE_PHASE)
+            if timer.total >= timing_flush_interval:
+                timer.emit(task_name=None)
             continue
+        waiting = False
         try:
-            single_run(t, observer)
+            if isinstance(run, IsolatedRunner):
+                # renewed while polling the run process - no thread may run when it is forked
+                run(t, LeaseHeartbeat(q, t))
+            else:
+                with LeaseHeartbeat(q, t):
+                    run(t)
         except Exception as ex:
             traceback.print_exception(type(ex), ex, ex.__traceback__)
         finally:
-            q.remove(t)
+            timer.lap("run")
+            if not q.remove(t):
+                print(f"Run {t.id} lost its lease and was left in the queue")
+            timer.lap("remove")
+            timer.emit(task_name=t.task_name, queue_id=t.id)
+
+
+def prime_sources(mongo_uri: str, db_name: str):
+    """
+    Discovers sources of runs, and stores them in the database, once - before processes executing runs
+    are forked (with multiple slots, or isolated runs), so that all of them reuse both
+    """
+    base_dir = sources_base_dir()
+    _, sources, _ = source_discovery.discover(__file__, base_dir)
+    observer = SourceCachingMongoObserver(client=get_client(mongo_uri), db_name=db_name)
+    observer.save_sources(
+        {
+            "base_dir": base_dir,
+            "sources": [s.to_json(base_dir) for s in sorted(sources)],
+        }
+    )
+
+
+def sources_base_dir() -> str:
+    """Sources of runs are the modules in the directory of the `scenarios` module"""
+    return os.path.abspath(Path(scenarios.__file__).parent)
+
+
+def make_runner(
+    mongo_uri: str,
+    db_name: str,
+    warm_size: int,
+    on_start: Optional[Callable[[int], Any]] = None,
+    code_version: Optional[str] = None,
+    skip_completed: bool = False,
+    timing_sinks: Sequence[TimingSink] = (),
+) -> Callable[[QueuedRun], Any]:
+    """Returns a function executing runs - with its own observer and, in warm mode, cache of scenarios"""
+    observer = SourceCachingMongoObserver(client=get_client(mongo_uri), db_name=db_name)
+    scenario_cache = ScenarioCache(warm_size) if warm_size > 0 else None
+    return functools.partial(
+        single_run,
+        observer=observer,
+        scenario_cache=scenario_cache,
+        on_start=on_start,
+        rung_store=MongoRungStore(mongo_uri, db_name),
+        code_version=code_version,
+        completed_in=Study(db_name, mongo_uri) if skip_completed else None,
+        timer=PhaseTimer(timing_sinks),
+    )
+
+
+def mark_killed_run(
+    mongo_uri: str,
+    db_name: str,
+    task: QueuedRun,
+    run_id: Optional[int],
+    status: str,
+    message: str,
+):
+    """Records the status of a run killed by the worker, which could not do it itself"""
+    if run_id is None:
+        return  # killed before it was even stored in the DB
+    get_client(mongo_uri)[db_name][RUNS_COLLECTION].update_one(
+        {"_id": run_id},
+        {
+            "$set": {
+                "status": status,
+                "stop_time": datetime.datetime.utcnow(),
+                "fail_trace": [message],
+            }
+        },
+    )
+
+
+class ScenarioCache:
+    """
+    LRU cache of set up, reusable Scenario instances, one per task description file.
+    Entries are invalidated when the file changes (its modification time or size).
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()  # path -> (fingerprint, scenario)
+
+    @staticmethod
+    def fingerprint(task_file: Path) -> Tuple:
+        stat = task_file.stat()
+        return stat.st_mtime_ns, stat.st_size
 
+    def get(self, task_file: Path, task: Dict) -> "scenarios.Scenario":
+        fingerprint = self.fingerprint(task_file)
+        entry = self._entries.get(task_file)
+        if entry is not None and entry[0] == fingerprint:
+            self._entries.move_to_end(task_file)
+            scenario = entry[1]
+            scenario.reset_run_state()
+            return scenario
+        self._entries.pop(task_file, None)
+        scenario = build_scenario(task)
+        if scenario.reusable:
+            self._entries[task_file] = (fingerprint, scenario)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return scenario
 
-def single_run(to_run: QueuedRun, observer: observers.RunObserver):
+
+def build_scenario(task: Dict) -> "scenarios.Scenario":
+    scenario = scenarios.Scenario.from_config(task["Scenario"])
+    scenario.setup()
+    return scenario
+
+
+def single_run(
+    to_run: QueuedRun,
+    observer: observers.RunObserver,
+    scenario_cache: Optional[ScenarioCache] = None,
+    on_start: Optional[Callable[[int], Any]] = None,
+    rung_store: Optional[RungStore] = None,
+    code_version: Optional[str] = None,
+    completed_in: Optional[Study] = None,
+    timer: Optional[PhaseTimer] = None,
+):
+    """
+    Executes a queued run, recording its config fingerprint (and `code_version`, if given) in its info.
+
+    :param completed_in: if given, the run is skipped if the study already has a completed run
+        with the same fingerprint (and code version)
+    :param timer: measures phases of the run, emitting a record when it ends
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    timer.start()
+    run_res = None
+    try:
+        run_res = _execute(
+            to_run,
+            observer,
+            scenario_cache,
+            on_start,
+            rung_store,
+            code_version,
+            completed_in,
+            timer,
+        )
+        return run_res
+    finally:
+        timer.emit(
+            task_name=to_run.task_name,
+            queue_id=to_run.id,
+            run_id=getattr(run_res, "_id", None),
+        )
+
+
+def _execute(
+    to_run: QueuedRun,
+    observer: observers.RunObserver,
+    scenario_cache: Optional[ScenarioCache],
+    on_start: Optional[Callable[[int], Any]],
+    rung_store: Optional[RungStore],
+    code_version: Optional[str],
+    completed_in: Optional[Study],
+    timer: PhaseTimer,
+):
     params = fill_in_defaults(to_run.params)
-    base_dir = Path(scenarios.__file__).parent
-    ex = Experiment(to_run.task_name, base_dir=base_dir)
+    fingerprint = config_fingerprint(to_run.task_name, params, fill_defaults=False)
+    timer.lap("fill_defaults")
+    if completed_in is not None:
+        completed = completed_in.find_completed([fingerprint], code_version)
+        timer.lap("check_completed")
+        if fingerprint in completed:
+            print(
+                f"Skipping run {to_run.id}, the same config was completed in run {completed[fingerprint]}"
+            )
+            return None
+    with to_run.task_description_file.open() as f:
+        task = json.load(f)
+    ex = Experiment(to_run.task_name, base_dir=sources_base_dir(), save_git_info=False)
+    source_discovery.apply(ex, __file__)
     ex.observers.append(observer)
     ex.add_config(params)
-    task_rnd_seed = json.load(to_run.task_description_file.open()).get("seed", None)
+    task_rnd_seed = task.get("seed", None)
     if task_rnd_seed is not None:
         # needs to be set before run to make sense with sacred
         ex.add_config({"seed": task_rnd_seed})
 
     @ex.main
     def ex_main(_config, _run):
+        # includes source discovery, and the observer storing the started run
+        timer.lap("experiment_setup")
+        if on_start is not None:
+            on_start(_run._id)
+        _run.info[FINGERPRINT_FIELD] = fingerprint
+        if code_version is not None:
+            _run.info[CODE_VERSION_FIELD] = code_version
         #  task desc should always stay effectively the same, but logging as resource just in case
-        task = json.load(ex.open_resource(to_run.task_description_file, "r"))
-        scenario = scenarios.Scenario.from_config(task["Scenario"])
+        _run.add_resource(str(to_run.task_description_file))
+        if scenario_cache is not None:
+            scenario = scenario_cache.get(to_run.task_description_file, task)
+        else:
+            scenario = build_scenario(task)
         scenario.setup_sacred(_run)
-        res = scenario.single_run(_config)
+        early_stopping = task.get(EARLY_STOPPING_FIELD)
+        if early_stopping is not None and rung_store is not None:
+            scenario.set_pruner(
+                ASHAPruner.from_config(
+                    early_stopping, rung_store, to_run.task_name, _run._id
+                )
+            )
+        timer.lap("scenario_setup")
+        try:
+            res = scenario.single_run(_config)
+        finally:
+            timer.lap("run")
+            scenario.flush_metrics()
+            timer.lap("flush_metrics")
         return res[0]
 
-    run_res = ex.run()
-    return run_res
+    try:
+        return ex.run()
+    finally:
+        # the observer storing the result, or the failure
+        timer.lap("observer_completion")
 
 
 def main():
@@ -74,12 +376,157 @@ def main():
         help="URI of the MongoDB server instance",
         default="localhost:27017",
     )
-    parser.add_argument("--sleep-time", type=int, default=30)
+    parser.add_argument(
+        "--queue-uri",
+        help="URI of the queue, if not stored in the same MongoDB instance as results. "
+        "Use `sqlite://<path>` for a local SQLite queue",
+        default=None,
+    )
+    parser.add_argument(
+        "--sleep-time",
+        help="Max. time to wait for new runs before checking the queue again",
+        type=int,
+        default=30,
+    )
+    parser.add_argument(
+        "--wait-mode",
+        help="How to wait for new runs: `push` - get notified by MongoDB (if it runs as a replica set, "
+        "otherwise falls back to `poll`), `poll` - query periodically, with increasing intervals",
+        choices=["push", "poll"],
+        default="push",
+    )
+    parser.add_argument(
+        "--lease-duration",
+        help="Seconds after which a run taken by an unresponsive worker is put back in the queue",
+        type=float,
+        default=300,
+    )
+    parser.add_argument(
+        "--max-attempts",
+        help="How many times a run can be taken before it is marked as failed, 0 - no limit",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--warm",
+        help="Warm mode: keep up to N set up scenarios between runs, to skip their setup in subsequent "
+        "runs of the same task. Only applies to scenarios marked as `reusable`",
+        type=int,
+        default=0,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--slots",
+        help="How many runs to process at once, each in a separate process",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--cpu-affinity",
+        help="Pin each slot to a separate, equal subset of CPUs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--threads-per-slot",
+        help="Limit threads used by numerical libraries (OpenMP, MKL, OpenBLAS, ...) in each run",
+        type=int,
+        default=None,
+    )
+    machine = Resources.of_this_machine()
+    parser.add_argument(
+        "--cores",
+        help="Cores available for runs - only runs requiring at most that many are processed. "
+        "Default: all available to the worker",
+        type=float,
+        default=machine.cores,
+    )
+    parser.add_argument(
+        "--memory-gb",
+        help="Memory available for runs, in GB - similar to `--cores`. Default: all of this machine",
+        type=float,
+        default=machine.memory_gb,
+    )
+    parser.add_argument(
+        "--tags",
+        help="Capabilities of the worker, e.g. `gpu`. Runs requiring tags are only processed if the worker "
+        "has all of them",
+        nargs="*",
+        default=[],
+    )
+    parser.add_argument(
+        "--isolate",
+        help="Execute each run in a new process, to free all memory it used when it ends",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        help="Kill runs using more memory (including processes they start). Implies --isolate",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--run-timeout",
+        help="Kill runs taking longer, in seconds. Implies --isolate",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--code-version",
+        help="Version of the code (e.g. a git commit), recorded with runs. Runs of other versions "
+        "are not considered duplicates, see `--skip-completed`",
+        default=None,
+    )
+    parser.add_argument(
+        "--skip-completed",
+        help="Do not execute runs whose config (with defaults filled in) already has a completed run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--timings-file",
+        help="Append timing records of phases of runs (and of the worker loop, with one slot) to this "
+        "JSONL file. Summarize with `python -m hyperspace_explorer.timing FILE`",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--timings-mongo",
+        help="Store timing records in the `timings` collection of the database",
+        action="store_true",
+    )
     args = parser.parse_args()
-    process_queue(args.tasks_dir, args.db_name, args.mongo_uri, args.sleep_time)
+    timing_sinks = []
+    if args.timings_file is not None:
+        timing_sinks.append(JsonlSink(args.timings_file.resolve()))
+    if args.timings_mongo:
+        timing_sinks.append(MongoSink(args.mongo_uri, args.db_name))
+    limits = None
+    if args.isolate or args.max_rss_mb is not None or args.run_timeout is not None:
+        limits = RunLimits(args.max_rss_mb, args.run_timeout)
+    if args.threads_per_slot is not None:
+        set_thread_count(args.threads_per_slot)
+    import_scenarios()
+    process_queue(
+        args.tasks_dir,
+        args.db_name,
+        args.mongo_uri,
+        args.sleep_time,
+        args.lease_duration,
+        args.max_attempts or None,
+        args.wait_mode,
+        args.warm,
+        args.queue_uri,
+        args.slots,
+        args.cpu_affinity,
+        Resources(args.cores, args.memory_gb, args.tags),
+        limits,
+        args.code_version,
+        args.skip_completed,
+        timing_sinks,
+    )
 
 
-if __name__ == "__main__":
+def import_scenarios():
+    global scenarios
     orig_path = copy.copy(sys.path)
     sys.path.insert(0, str(Path.cwd()))
     try:
@@ -91,4 +538,7 @@ if __name__ == "__main__":
         print(e)
         exit(1)
     sys.path = orig_path
+
+
+if __name__ == "__main__":
     main()
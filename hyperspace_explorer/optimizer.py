@@ -0,0 +1,258 @@
+import argparse
+import json
+import math
+import time
+from pathlib import Path
+from typing import *
+from .queue import RunQueue
+from .results import Task, RESULT_FIELD, MONGO_URI_DEFAULT
+from .space import Space  # raises a clear error without NumPy
+import numpy as np
+
+SEARCH_SPACE_FIELD = "SearchSpace"
+
+
+class TPE:
+    """
+    Tree-structured Parzen Estimator (Bergstra et al. 2011), with each dimension modeled independently.
+
+    Observed configs are split into the best `gamma` fraction and the rest, each modeled with a kernel
+    density estimate: Gaussian kernels for numeric dimensions, smoothed frequencies for categorical ones.
+    Suggestions maximize the ratio of both densities, among candidates drawn from the "good" one.
+    Batches are suggested with the constant liar strategy - pending configs (e.g. queued runs, and
+    earlier suggestions of the batch) are treated as observed, with the worst result so far.
+    """
+
+    def __init__(
+        self,
+        space: Space,
+        gamma: float = 0.25,
+        n_candidates: int = 64,
+        n_startup: int = 10,
+        prior_weight: float = 1.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param space: searched space
+        :param gamma: fraction of observations considered good
+        :param n_candidates: candidates scored for each suggestion
+        :param n_startup: below this many observations, configs are sampled at random
+        :param prior_weight: weight of the uniform prior, mixed into both densities
+        :param seed: random seed
+        """
+        self.space = space
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.n_startup = n_startup
+        self.prior_weight = prior_weight
+        self.rng = np.random.default_rng(seed)
+
+    def suggest(
+        self,
+        X: "np.ndarray",
+        y: "np.ndarray",
+        n: int,
+        pending: Optional["np.ndarray"] = None,
+    ) -> "np.ndarray":
+        """
+        Suggests `n` configs to evaluate, higher `y` being better.
+
+        :param X: encoded observed configs, shape (n_observed, n_dimensions)
+        :param y: their results
+        :param n: how many configs to suggest
+        :param pending: encoded configs being evaluated, treated as observed with the worst result
+        :return: encoded configs, shape (n, n_dimensions)
+        """
+        if pending is None:
+            pending = np.empty((0, len(self.space.keys)))
+        if len(y) < max(self.n_startup, 1):
+            return self.space.sample(self.rng, n)
+        lie = np.min(y)
+        suggestions = []
+        for _ in range(n):
+            X_all = np.concatenate([X, pending, *[s[None] for s in suggestions]])
+            y_all = np.concatenate([y, np.full(len(X_all) - len(y), lie)])
+            order = np.argsort(-y_all, kind="stable")
+            n_good = max(1, math.ceil(self.gamma * len(y_all)))
+            good, bad = X_all[order[:n_good]], X_all[order[n_good:]]
+            candidates = self._sample_around(good, self.n_candidates)
+            score = self._log_density(candidates, good) - self._log_density(
+                candidates, bad
+            )
+            suggestions.append(candidates[np.argmax(score)])
+        return np.stack(suggestions)
+
+    def _bandwidths(self, points: "np.ndarray") -> "np.ndarray":
+        # Scott's rule, clipped to keep the estimate neither too peaked, nor flat
+        n = max(len(points), 1)
+        std = points.std(axis=0) if len(points) > 1 else np.ones(points.shape[1])
+        return np.clip(1.06 * std * n ** (-1 / 5), 0.05, 1.0)
+
+    def _sample_around(self, points: "np.ndarray", n: int) -> "np.ndarray":
+        centers = points[self.rng.integers(len(points), size=n)]
+        noise = self.rng.normal(size=centers.shape) * self._bandwidths(points)
+        numeric = np.clip(centers + noise, 0, 1)
+        # categorical values: kept from the center, or drawn uniformly, like from the prior
+        uniform = self.space.sample(self.rng, n)
+        from_prior = self.rng.random(centers.shape) < self.prior_weight / (
+            len(points) + self.prior_weight
+        )
+        categorical = np.where(from_prior, uniform, centers)
+        return np.where(self.space.categorical, categorical, numeric)
+
+    def _log_density(self, x: "np.ndarray", points: "np.ndarray") -> "np.ndarray":
+        """Log density at each row of `x` of a KDE of `points`, mixed with the uniform prior"""
+        total = len(points) + self.prior_weight
+        if len(points) == 0:
+            return np.zeros(len(x))
+        diff = x[:, None, :] - points[None, :, :]  # (n_x, n_points, n_dims)
+        bw = self._bandwidths(points)
+        kernels = np.exp(-0.5 * (diff / bw) ** 2) / (bw * math.sqrt(2 * math.pi))
+        numeric = (kernels.sum(axis=1) + self.prior_weight) / total
+        sizes = np.array(
+            [
+                len(d.choices) if d.categorical else 1
+                for d in self.space.dimensions.values()
+            ]
+        )
+        same = (diff == 0).sum(axis=1)
+        categorical = (same + self.prior_weight / sizes) / total
+        density = np.where(self.space.categorical, categorical, numeric)
+        return np.log(density).sum(axis=1)
+
+
+class Optimizer:
+    """
+    Keeps the queue of a task topped up with configs suggested by a TPE, fitted to all results so far.
+
+    Suggested params are submitted to the queue as run configs - with only the searched params,
+    other params come from defaults, as with any other submitted run.
+    """
+
+    def __init__(
+        self,
+        task: Task,
+        queue: RunQueue,
+        space: Space,
+        queue_depth: int = 4,
+        sampler: Optional[TPE] = None,
+        maximize: bool = True,
+        priority: int = 0,
+    ):
+        """
+        :param task: task to optimize
+        :param queue: queue to submit runs to
+        :param space: searched space
+        :param queue_depth: how many runs of the task should be pending (queued or in progress) at all times
+        :param sampler: sampler to use, TPE with default settings if not given
+        :param maximize: whether higher results are better
+        :param priority: priority of submitted runs
+        """
+        self.task = task
+        self.queue = queue
+        self.space = space
+        self.queue_depth = queue_depth
+        self.sampler = sampler if sampler is not None else TPE(space)
+        self.maximize = maximize
+        self.priority = priority
+
+    def observations(self) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Encoded configs of completed runs inside the space, and their results"""
+        configs, results = [], []
+        for r in self.task.iter_results(config_keys=self.space.keys):
+            result = r.get(RESULT_FIELD)
+            if isinstance(result, (int, float)) and not math.isnan(result):
+                configs.append(r.get("config", {}))
+                results.append(result)
+        X = self.space.encode(configs)
+        y = np.array(results, dtype=float)
+        inside = ~np.isnan(X).any(axis=1)
+        return X[inside], (y if self.maximize else -y)[inside]
+
+    def step(self) -> int:
+        """
+        Submits runs, if there are fewer than `queue_depth` pending.
+
+        :return: number of submitted runs
+        """
+        pending = self.queue.pending(self.task.name)
+        missing = self.queue_depth - len(pending)
+        if missing <= 0:
+            return 0
+        X, y = self.observations()
+        X_pending = self.space.encode(pending)
+        X_pending = X_pending[~np.isnan(X_pending).any(axis=1)]
+        suggested = self.sampler.suggest(X, y, missing, X_pending)
+        configs = self.space.decode(suggested)
+        summary = self.queue.submit_grid(
+            self.task.name, configs, priority=self.priority
+        )
+        return summary.count
+
+    def run(self, interval: float = 30, max_runs: Optional[int] = None):
+        """
+        Keeps the queue topped up, checking it every `interval` seconds.
+
+        :param max_runs: stop after submitting this many runs
+        """
+        submitted = 0
+        while max_runs is None or submitted < max_runs:
+            submitted += self.step()
+            time.sleep(interval)
+
+
+def main():
+    desc = (
+        "Keep the queue of a task topped up with runs suggested by an optimizer (TPE), based on "
+        f"all results so far. The searched space is defined under the `{SEARCH_SPACE_FIELD}` key "
+        "of the task json file"
+    )
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "tasks_dir",
+        help="Path to a folder storing task json files, absolute or relative",
+        type=lambda s: Path(s).resolve(),
+    )
+    parser.add_argument("db_name", help="MongoDB database name")
+    parser.add_argument("task_name", help="Name of the task to optimize")
+    parser.add_argument(
+        "--mongo-uri",
+        help="URI of the MongoDB server instance",
+        default=MONGO_URI_DEFAULT,
+    )
+    parser.add_argument(
+        "--queue-uri",
+        help="URI of the queue, if not stored in the same MongoDB instance as results. "
+        "Use `sqlite://<path>` for a local SQLite queue",
+        default=None,
+    )
+    parser.add_argument(
+        "--depth",
+        help="How many runs of the task to keep queued or in progress",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--interval",
+        help="How often to check the queue, in seconds",
+        type=float,
+        default=30,
+    )
+    parser.add_argument(
+        "--minimize", help="Lower results are better", action="store_true"
+    )
+    parser.add_argument(
+        "--max-runs", help="Stop after submitting this many runs", type=int
+    )
+    args = parser.parse_args()
+
+    with (args.tasks_dir / f"{args.task_name}.json").open() as f:
+        space = Space.from_config(json.load(f)[SEARCH_SPACE_FIELD])
+    task = Task(args.task_name, args.db_name, args.mongo_uri)
+    q = RunQueue(args.queue_uri or args.mongo_uri, args.db_name, args.tasks_dir)
+    optimizer = Optimizer(task, q, space, args.depth, maximize=not args.minimize)
+    optimizer.run(args.interval, args.max_runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
-from pymongo import MongoClient
-from bson.objectid import ObjectId
 from typing import *
+import collections
 import datetime
-from dataclasses import dataclass
+import itertools
+import random
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field, asdict
 from pathlib import Path
-
-RunId = ObjectId
+from .fingerprint import config_fingerprint, DUPLICATE_POLICIES
+from .queue_backends import (
+    QueueBackend,
+    Resources,
+    RunId,
+    backend_from_uri,
+    SQLITE_URI_PREFIX,
+)
+from .results import Study
 
 
 @dataclass
@@ -14,30 +25,78 @@ class QueuedRun:
     task_name: str
     params: Dict
     task_description_file: Path
+    lease_token: Optional[str] = None
+    attempts: int = 0
+    requirements: Resources = field(default_factory=Resources)
+
+
+@dataclass
+class SubmitSummary:
+    ids: List[RunId]
+    per_task: Dict[str, int]
+    skipped: int = 0
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
 
 
 class RunQueue:
     """
     Representation of the task queue, returning only the tasks defined in the local tasks_dir
+
+    The queue is stored in MongoDB, or in a local SQLite database if `mongo_uri` has the form
+    `sqlite://<path>` - see `queue_backends`.
+
+    Fetched runs are leased for `lease_duration` seconds. The worker processing a run should
+    renew the lease with `heartbeat()` (see `LeaseHeartbeat`), otherwise the run is considered
+    orphaned and `reclaim_expired()` puts it back in the queue - at most `max_attempts` times
+    in total, after that the run is marked as failed.
+
+    Runs are fetched in order of descending `priority`, then in order of submission. Runs can be
+    submitted with resource requirements - then workers only fetch runs fitting their capacity, preferring
+    the most demanding ones.
+
+    When the queue is empty, `wait_for_ready()` blocks until new runs are submitted - using a MongoDB
+    change stream if possible (requires a replica set), or polling with an increasing interval otherwise.
+
+    Runs submitted with duplicates skipped (see `submit()`) store fingerprints of their configs
+    (see `fingerprint.config_fingerprint()`), so later ones can be compared with runs already queued, in progress
+    or completed. Completed runs are looked up in the MongoDB database of results, `results_uri`.
     """
 
-    collection = "queue"
-    id_field = "_id"
-    taskname_field = "task_name"
-    params_field = "params"
-    status_field = "status"
-    status_taken = "TAKEN"
-    status_ready = "READY"
-    status_paused = "PAUSED"
-    time_inserted_field = "time_inserted"
-    time_taken_field = "time_taken"
-
-    def __init__(self, mongo_uri: str, db_name: str, tasks_dir: Union[str, Path]):
+    def __init__(
+        self,
+        mongo_uri: str,
+        db_name: str,
+        tasks_dir: Union[str, Path],
+        lease_duration: float = 300,
+        max_attempts: Optional[int] = 3,
+        change_streams: bool = True,
+        backend: Optional[QueueBackend] = None,
+        code_version: Optional[str] = None,
+        results_uri: Optional[str] = None,
+    ):
+        """
+        :param code_version: version of the code runs are submitted for, e.g. a git commit. If given,
+            it is stored with queued runs, and only runs of the same version are considered duplicates
+        :param results_uri: MongoDB URI of results, to find completed duplicates. By default `mongo_uri`,
+            unless it is the URI of a SQLite queue - then completed runs are not checked
+        """
         self.mongo_uri = mongo_uri
         self.db_name = db_name
         self.tasks_dir = Path(tasks_dir)
-        self.client = MongoClient(mongo_uri)
-        self.queue = self.client[self.db_name][self.collection]
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self.change_streams = change_streams
+        self.backoff = Backoff()
+        if backend is None:
+            backend = backend_from_uri(mongo_uri, db_name)
+        self.backend = backend
+        self.code_version = code_version
+        if results_uri is None and not mongo_uri.startswith(SQLITE_URI_PREFIX):
+            results_uri = mongo_uri
+        self.results = Study(db_name, results_uri) if results_uri else None
 
     def get_available_tasks(self) -> List[str]:
         return [
@@ -49,58 +108,357 @@ class RunQueue:
     def get_task_path(self, task_name: str) -> Path:
         return self.tasks_dir / f"{task_name}.json"
 
-    def fetch_one(self) -> Optional[QueuedRun]:
-        """Returns a task to compute, marking it as taken, but not fully removing from the queue"""
-        available_tasks = self.get_available_tasks()
-        query = {
-            self.taskname_field: {"$in": available_tasks},
-            self.status_field: {"$eq": self.status_ready},
-        }
-        update = {
-            "$set": {
-                self.status_field: self.status_taken,
-                self.time_taken_field: datetime.datetime.utcnow(),
-            }
-        }
-        t = self.queue.find_one_and_update(query, update)
+    def fetch_one(self, capacity: Optional[Resources] = None) -> Optional[QueuedRun]:
+        """
+        Returns a task to compute, marking it as taken, but not fully removing from the queue
+
+        :param capacity: resources available for the run; if given, only runs requiring at most
+            that much are considered - and the most demanding ones are fetched first
+        """
+        b = self.backend
+        t = b.claim(self.get_available_tasks(), self.lease_duration, capacity)
         if t is None:
             return None
+        self.backoff.reset()
         task = QueuedRun(
-            id=t[self.id_field],
-            task_name=t[self.taskname_field],
-            params=t[self.params_field],
-            task_description_file=self.get_task_path(t[self.taskname_field]),
+            id=t[b.id_field],
+            task_name=t[b.taskname_field],
+            params=t[b.params_field],
+            task_description_file=self.get_task_path(t[b.taskname_field]),
+            lease_token=t[b.lease_token_field],
+            attempts=t[b.attempts_field],
+            requirements=Resources(**t.get(b.requirements_field, {})),
         )
         return task
 
+    def wait_for_ready(
+        self, timeout: float, capacity: Optional[Resources] = None
+    ) -> None:
+        """
+        Blocks until a run of one of the available tasks might be ready, but for at most `timeout` seconds.
+
+        Without change streams, sleeps for a jittered, exponentially growing time instead - until
+        `fetch_one` succeeds again.
+
+        :param capacity: resources available for runs, as passed to `fetch_one` - ready runs not fitting
+            them do not end the wait
+        """
+        if self.change_streams and self.backend.wait_for_ready(
+            self.get_available_tasks(), timeout, capacity
+        ):
+            return
+        time.sleep(min(self.backoff.next(), timeout))
+
+    def heartbeat(self, task: QueuedRun) -> bool:
+        """
+        Extends the lease of a taken task.
+
+        :return: False if the lease was lost in the meantime (e.g. reclaimed after expiring)
+        """
+        return self.backend.renew_lease(task.id, task.lease_token, self.lease_duration)
+
+    def reclaim_expired(self) -> int:
+        """
+        Puts taken tasks with expired leases back in the queue, or marks them as failed if they
+        were already attempted `max_attempts` times.
+
+        :return: number of tasks made ready again
+        """
+        return self.backend.reclaim_expired(self.max_attempts)
+
+    def release(self, task: QueuedRun) -> bool:
+        """
+        Gives up a taken task without finishing it, putting it back in the queue - unless it was
+        already attempted `max_attempts` times, then it is marked as failed.
+
+        :return: True if the task was made ready again
+        """
+        return self.backend.release(task.id, task.lease_token, self.max_attempts)
+
     def remove(self, task: QueuedRun) -> int:
-        """Permanently removes the given task from the queue"""
-        res = self.queue.delete_one({self.id_field: task.id})
-        return res.deleted_count
-
-    def submit(self, task_name: str, params: Dict) -> RunId:
-        res = self.queue.insert_one(
-            {
-                self.taskname_field: task_name,
-                self.params_field: params,
-                self.time_inserted_field: datetime.datetime.utcnow(),
-                self.status_field: self.status_ready,
-            }
+        """
+        Permanently removes the given task from the queue - if it was fetched, only while it is still leased
+        by this fetch. If the lease was lost (e.g. the task was reclaimed and taken by another worker),
+        the task is left in the queue.
+
+        :return: number of removed tasks, 0 or 1
+        """
+        return self.backend.delete(task.id, task.lease_token)
+
+    def submit(
+        self,
+        task_name: str,
+        params: Dict,
+        priority: int = 0,
+        requirements: Optional[Resources] = None,
+        on_duplicate: str = "allow",
+    ) -> Optional[RunId]:
+        """
+        Adds a run to the queue
+
+        :param task_name: name of the task, has to match a json file in `tasks_dir` of workers
+        :param params: config of the run
+        :param priority: runs with higher priority are fetched first, default 0
+        :param requirements: resources needed by the run, e.g. `Resources(cores=4, memory_gb=16, tags=['gpu'])`
+        :param on_duplicate: what to do if the same run (with the same config fingerprint) is already queued,
+            in progress or completed: 'allow' - submit it anyway, 'skip' - do not submit it,
+            'attach' - do not submit it, return the id of the existing one (a run id, if completed).
+            Only runs submitted with 'skip' or 'attach' are fingerprinted in the queue - and so found as queued
+            duplicates; all completed runs are fingerprinted by workers
+        :return: id of the queued run, None if skipped
+        """
+        _check_duplicate_policy(on_duplicate)
+        entry = self._new_entry(
+            task_name,
+            params,
+            priority,
+            requirements,
+            fingerprint=on_duplicate != "allow",
+        )
+        if on_duplicate != "allow":
+            fingerprint = entry[self.backend.fingerprint_field]
+            existing = self._find_existing([fingerprint])
+            if fingerprint in existing:
+                return existing[fingerprint] if on_duplicate == "attach" else None
+        return self.backend.insert([entry])[0]
+
+    def submit_many(
+        self,
+        runs: Iterable[Tuple[str, Dict]],
+        priority: int = 0,
+        chunk_size: int = 1000,
+        requirements: Optional[Resources] = None,
+        on_duplicate: str = "allow",
+    ) -> SubmitSummary:
+        """
+        Adds many runs to the queue, inserting them in chunks. `runs` can be a generator, only one
+        chunk is kept in memory at a time.
+
+        Task names are checked against tasks available in `tasks_dir`. If an unknown one is found,
+        ValueError is raised before inserting its chunk - runs from previous chunks stay in the queue.
+
+        :param runs: pairs of (task_name, params)
+        :param priority: priority of all the runs, see `submit()`
+        :param chunk_size: how many runs to insert in one request
+        :param requirements: resources needed by each of the runs, see `submit()`
+        :param on_duplicate: what to do with duplicates of existing runs, or of other `runs`, see `submit()`.
+            With 'attach', `ids` of the summary are given for all `runs`, including existing ones
+        :return: ids of the queued runs, their counts per task, and the number of skipped duplicates
+        """
+        _check_duplicate_policy(on_duplicate)
+        fingerprint_field = self.backend.fingerprint_field
+        available_tasks = set(self.get_available_tasks())
+        summary = SubmitSummary(ids=[], per_task=collections.Counter())
+        runs = iter(runs)
+        while True:
+            chunk = list(itertools.islice(runs, chunk_size))
+            if not chunk:
+                break
+            unknown = {task_name for task_name, _ in chunk} - available_tasks
+            if unknown:
+                raise ValueError(
+                    f"Tasks {sorted(unknown)} not found in {self.tasks_dir}, "
+                    f"{summary.count} runs submitted so far"
+                )
+            now = datetime.datetime.utcnow()
+            entries = [
+                self._new_entry(
+                    t, p, priority, requirements, now, on_duplicate != "allow"
+                )
+                for t, p in chunk
+            ]
+            if on_duplicate == "allow":
+                summary.ids.extend(self.backend.insert(entries))
+                summary.per_task.update(task_name for task_name, _ in chunk)
+                continue
+            # earlier chunks are already in the queue, so their duplicates are found there
+            fingerprints = [e[fingerprint_field] for e in entries]
+            existing = self._find_existing(list(set(fingerprints)))
+            new = {}
+            for fingerprint, entry in zip(fingerprints, entries):
+                if fingerprint not in existing:
+                    new.setdefault(fingerprint, entry)
+            inserted = self.backend.insert(list(new.values())) if new else []
+            summary.per_task.update(
+                e[self.backend.taskname_field] for e in new.values()
+            )
+            summary.skipped += len(entries) - len(new)
+            if on_duplicate == "attach":
+                existing.update(zip(new, inserted))
+                summary.ids.extend(existing[f] for f in fingerprints)
+            else:
+                summary.ids.extend(inserted)
+        summary.per_task = dict(summary.per_task)
+        return summary
+
+    def submit_grid(
+        self,
+        task_name: str,
+        configs: Iterable[Dict],
+        priority: int = 0,
+        chunk_size: int = 1000,
+        requirements: Optional[Resources] = None,
+        on_duplicate: str = "allow",
+    ) -> SubmitSummary:
+        """Adds runs of one task, one for each of `configs`, to the queue. See `submit_many()`"""
+        return self.submit_many(
+            ((task_name, c) for c in configs),
+            priority,
+            chunk_size,
+            requirements,
+            on_duplicate,
+        )
+
+    def _find_existing(self, fingerprints: List[str]) -> Dict[str, RunId]:
+        """Ids of runs with the given fingerprints - completed, or still in the queue"""
+        b = self.backend
+        existing = {}
+        if self.results is not None:
+            existing.update(
+                self.results.find_completed(fingerprints, self.code_version)
+            )
+        existing.update(
+            b.find_fingerprints(
+                fingerprints,
+                [b.status_ready, b.status_paused, b.status_taken],
+                self.code_version,
+            )
+        )
+        return existing
+
+    def _new_entry(
+        self,
+        task_name: str,
+        params: Dict,
+        priority: int,
+        requirements: Optional[Resources] = None,
+        time_inserted: Optional[datetime.datetime] = None,
+        fingerprint: bool = False,
+    ) -> Dict:
+        if time_inserted is None:
+            time_inserted = datetime.datetime.utcnow()
+        b = self.backend
+        entry = {
+            b.taskname_field: task_name,
+            b.params_field: params,
+            b.time_inserted_field: time_inserted,
+            b.status_field: b.status_ready,
+            b.priority_field: priority,
+        }
+        if fingerprint:
+            entry[b.fingerprint_field] = _fingerprint(task_name, params)
+        if self.code_version is not None:
+            entry[b.code_version_field] = self.code_version
+        if requirements is not None:
+            entry[b.requirements_field] = asdict(requirements)
+        return entry
+
+    def set_priority(self, ids: Iterable[RunId], priority: int) -> int:
+        """Changes priority of the given runs, if they are still in the queue"""
+        return self.backend.set_priority(list(ids), priority)
+
+    def pending(self, task_name: str) -> List[Dict]:
+        """Params of runs of a task which are not finished yet - ready, paused or in progress"""
+        b = self.backend
+        return b.find_params(
+            task_name, [b.status_ready, b.status_paused, b.status_taken]
         )
-        return res.inserted_id
 
     def pause_all(self) -> int:
         """Marks all 'ready' tasks in the queue as paused"""
-        res = self.queue.update_many(
-            {self.status_field: self.status_ready},
-            {"$set": {self.status_field: self.status_paused}},
-        )
-        return res.modified_count
+        b = self.backend
+        return b.change_status(b.status_ready, b.status_paused)
 
     def resume_all(self) -> int:
         """Marks all 'paused' tasks in the queue as ready"""
-        res = self.queue.update_many(
-            {self.status_field: self.status_paused},
-            {"$set": {self.status_field: self.status_ready}},
+        b = self.backend
+        return b.change_status(b.status_paused, b.status_ready)
+
+
+def _fingerprint(task_name: str, params: Dict) -> str:
+    try:
+        return config_fingerprint(task_name, params)
+    except KeyError as ex:
+        raise ValueError(
+            f"Cannot fill in defaults of a config of task {task_name}, to find its duplicates: class {ex} "
+            "is not imported. Import the module defining it (e.g. `scenarios`), or submit with on_duplicate='allow'"
+        ) from ex
+
+
+def _check_duplicate_policy(on_duplicate: str):
+    if on_duplicate not in DUPLICATE_POLICIES:
+        raise ValueError(
+            f"on_duplicate should be one of {DUPLICATE_POLICIES}, got: {on_duplicate}"
         )
-        return res.modified_count
+
+
+class Backoff:
+    """
+    Jittered exponential backoff - each call to `next()` returns a delay about `factor` times longer
+    than the previous one, up to `maximum`
+    """
+
+    def __init__(self, initial: float = 0.5, maximum: float = 30, factor: float = 2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempt = 0
+
+    def next(self) -> float:
+        delay = min(self.maximum, self.initial * self.factor**self.attempt)
+        self.attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class LeaseHeartbeat:
+    """
+    Renews the lease of a run while it is being processed. Used as a context manager, renews it in a
+    background thread.
+
+    Processes forking children while runs are in progress should not run the thread - a child could inherit
+    a lock held by it. They call `renew_if_due()` from their loop instead, see `worker_pool`.
+    """
+
+    def __init__(
+        self, queue: RunQueue, task: QueuedRun, interval: Optional[float] = None
+    ):
+        self.queue = queue
+        self.task = task
+        self.interval = interval if interval is not None else queue.lease_duration / 3
+        self.lost = False
+        self._last_renewal = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def renew(self) -> bool:
+        """Renews the lease now. Returns False if it was lost"""
+        self._last_renewal = time.monotonic()
+        # a transient DB error should not stop the heartbeat
+        try:
+            if not self.queue.heartbeat(self.task):
+                self.lost = True
+                print(f"Lease of run {self.task.id} lost, it might be processed twice")
+        except Exception as ex:
+            traceback.print_exception(type(ex), ex, ex.__traceback__)
+        return not self.lost
+
+    def renew_if_due(self):
+        """Renews the lease if `interval` passed since the last renewal"""
+        if not self.lost and time.monotonic() - self._last_renewal >= self.interval:
+            self.renew()
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            if not self.renew():
+                return
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
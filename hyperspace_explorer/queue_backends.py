@@ -0,0 +1,777 @@
+import abc
+import datetime
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import *
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from .connections import get_client
+from .schema import IndexSpec, ensure_schema
+
+RunId = ObjectId
+
+SQLITE_URI_PREFIX = "sqlite://"
+
+
+@dataclass
+class Resources:
+    """
+    Resources required by a run, or available to a worker. A run fits a worker if it requires
+    at most as many cores and as much memory as available, and all its tags are among the worker's tags.
+    """
+
+    cores: float = 0
+    memory_gb: float = 0
+    tags: List[str] = field(default_factory=list)
+
+    def fits(self, capacity: "Resources") -> bool:
+        return (
+            self.cores <= capacity.cores
+            and self.memory_gb <= capacity.memory_gb
+            and set(self.tags) <= set(capacity.tags)
+        )
+
+    def __sub__(self, other: "Resources") -> "Resources":
+        """Capacity remaining after `other` is taken. Tags are kept"""
+        return Resources(
+            self.cores - other.cores, self.memory_gb - other.memory_gb, self.tags
+        )
+
+    @classmethod
+    def of_this_machine(cls, tags: Optional[List[str]] = None) -> "Resources":
+        """
+        CPUs available to this process, and physical memory. Where the platform does not tell, all CPUs
+        of the machine are counted, and memory is unlimited
+        """
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:  # not available on macOS and Windows
+            cores = os.cpu_count() or 1
+        try:
+            memory_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30
+        except (AttributeError, ValueError, OSError):
+            memory_gb = math.inf
+        return cls(cores, memory_gb, tags or [])
+
+
+class QueueBackend(abc.ABC):
+    """
+    Storage of the run queue, used by `RunQueue`. Entries are dicts with keys named by the
+    `*_field` attributes. All operations changing the status of an entry have to be atomic,
+    also between processes.
+    """
+
+    id_field = "_id"
+    taskname_field = "task_name"
+    params_field = "params"
+    status_field = "status"
+    status_taken = "TAKEN"
+    status_ready = "READY"
+    status_paused = "PAUSED"
+    status_failed = "FAILED"
+    time_inserted_field = "time_inserted"
+    time_taken_field = "time_taken"
+    lease_expires_field = "lease_expires"
+    lease_token_field = "lease_token"
+    attempts_field = "attempts"
+    priority_field = "priority"
+    requirements_field = "requirements"
+    fingerprint_field = "fingerprint"
+    code_version_field = "code_version"
+
+    @abc.abstractmethod
+    def claim(
+        self,
+        task_names: List[str],
+        lease_duration: float,
+        capacity: Optional[Resources] = None,
+    ) -> Optional[Dict]:
+        """
+        Marks the first ready entry of one of the given tasks as taken, leasing it for `lease_duration`
+        seconds. Entries are ordered by descending priority, then by insertion time.
+
+        If `capacity` is given, only entries with requirements fitting it are considered. Among entries
+        of equal priority, the ones with the highest requirements (the best fit) are taken first.
+
+        :return: the updated entry, None if there are no ready entries
+        """
+        pass
+
+    @abc.abstractmethod
+    def renew_lease(
+        self, run_id: RunId, lease_token: str, lease_duration: float
+    ) -> bool:
+        """:return: False if the entry is not taken with the given lease token anymore"""
+        pass
+
+    @abc.abstractmethod
+    def reclaim_expired(self, max_attempts: Optional[int]) -> int:
+        """
+        Marks taken entries with expired leases as ready, or as failed if they were already attempted
+        `max_attempts` times. Returns the number of entries made ready.
+        """
+        pass
+
+    @abc.abstractmethod
+    def release(
+        self, run_id: RunId, lease_token: str, max_attempts: Optional[int]
+    ) -> bool:
+        """
+        Marks a taken entry as ready again (or failed, after `max_attempts`), if it is still leased
+        with the given token. Returns True if it was made ready.
+        """
+        pass
+
+    @abc.abstractmethod
+    def insert(self, entries: List[Dict]) -> List[RunId]:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, run_id: RunId, lease_token: Optional[str] = None) -> int:
+        """Deletes an entry - if `lease_token` is given, only if it is still taken with that token"""
+        pass
+
+    @abc.abstractmethod
+    def set_priority(self, ids: List[RunId], priority: int) -> int:
+        pass
+
+    @abc.abstractmethod
+    def change_status(self, old_status: str, new_status: str) -> int:
+        """Changes the status of all entries having `old_status`"""
+        pass
+
+    @abc.abstractmethod
+    def has_ready(
+        self, task_names: List[str], capacity: Optional[Resources] = None
+    ) -> bool:
+        """Is there a ready entry of one of the tasks - fitting `capacity`, if given, as in `claim()`"""
+        pass
+
+    @abc.abstractmethod
+    def find_params(self, task_name: str, statuses: List[str]) -> List[Dict]:
+        """Params of all entries of a task having one of `statuses`"""
+        pass
+
+    @abc.abstractmethod
+    def find_fingerprints(
+        self,
+        fingerprints: List[str],
+        statuses: List[str],
+        code_version: Optional[str] = None,
+    ) -> Dict[str, RunId]:
+        """
+        Ids of entries having one of `fingerprints` and `statuses` (and `code_version`, if given),
+        by fingerprint
+        """
+        pass
+
+    def wait_for_ready(
+        self,
+        task_names: List[str],
+        timeout: float,
+        capacity: Optional[Resources] = None,
+    ) -> bool:
+        """
+        Blocks until an entry (fitting `capacity`, if given) might have become ready, for at most `timeout` seconds.
+
+        :return: False right away if the backend does not support notifications about new entries
+        """
+        return False
+
+
+class MongoQueueBackend(QueueBackend):
+    """Queue stored in a MongoDB collection. Notifies about new entries using change streams, if possible"""
+
+    collection = "queue"
+    fetch_order = [
+        (QueueBackend.priority_field, DESCENDING),
+        (QueueBackend.time_inserted_field, ASCENDING),
+    ]
+    best_fit_order = [
+        (QueueBackend.priority_field, DESCENDING),
+        (f"{QueueBackend.requirements_field}.cores", DESCENDING),
+        (f"{QueueBackend.requirements_field}.memory_gb", DESCENDING),
+        (QueueBackend.time_inserted_field, ASCENDING),
+    ]
+
+    schema_version = 2
+    indexes = [
+        # supporting `claim`, without and with capacity
+        IndexSpec(
+            collection,
+            [
+                (QueueBackend.status_field, ASCENDING),
+                (QueueBackend.taskname_field, ASCENDING),
+                *fetch_order,
+            ],
+        ),
+        IndexSpec(
+            collection,
+            [
+                (QueueBackend.status_field, ASCENDING),
+                (QueueBackend.taskname_field, ASCENDING),
+                *best_fit_order,
+            ],
+        ),
+        # supporting `reclaim_expired`
+        IndexSpec(
+            collection,
+            [
+                (QueueBackend.status_field, ASCENDING),
+                (QueueBackend.lease_expires_field, ASCENDING),
+            ],
+        ),
+        # supporting `find_fingerprints`
+        IndexSpec(collection, [(QueueBackend.fingerprint_field, ASCENDING)]),
+    ]
+
+    def __init__(self, mongo_uri: str, db_name: str):
+        self.client = get_client(mongo_uri)
+        self.queue = self.client[db_name][self.collection]
+        self.change_streams = True
+        self.ensure_indexes()
+
+    def ensure_indexes(self, force: bool = False) -> bool:
+        """Creates indexes of the queue, if the database does not have their current version yet"""
+        return ensure_schema(
+            self.queue.database,
+            self.collection,
+            self.schema_version,
+            self.indexes,
+            force,
+        )
+
+    @classmethod
+    def _ready_query(
+        cls, task_names: List[str], capacity: Optional[Resources] = None
+    ) -> Dict:
+        query = {
+            cls.taskname_field: {"$in": task_names},
+            cls.status_field: {"$eq": cls.status_ready},
+        }
+        if capacity is not None:
+            req = cls.requirements_field
+            # missing requirements always fit
+            query[f"{req}.cores"] = {"$not": {"$gt": capacity.cores}}
+            query[f"{req}.memory_gb"] = {"$not": {"$gt": capacity.memory_gb}}
+            query[f"{req}.tags"] = {"$not": {"$elemMatch": {"$nin": capacity.tags}}}
+        return query
+
+    def claim(
+        self,
+        task_names: List[str],
+        lease_duration: float,
+        capacity: Optional[Resources] = None,
+    ) -> Optional[Dict]:
+        query = self._ready_query(task_names, capacity)
+        order = self.fetch_order if capacity is None else self.best_fit_order
+        now = datetime.datetime.utcnow()
+        update = {
+            "$set": {
+                self.status_field: self.status_taken,
+                self.time_taken_field: now,
+                self.lease_expires_field: now
+                + datetime.timedelta(seconds=lease_duration),
+                self.lease_token_field: uuid.uuid4().hex,
+            },
+            "$inc": {self.attempts_field: 1},
+        }
+        return self.queue.find_one_and_update(
+            query, update, sort=order, return_document=ReturnDocument.AFTER
+        )
+
+    def renew_lease(
+        self, run_id: RunId, lease_token: str, lease_duration: float
+    ) -> bool:
+        deadline = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=lease_duration
+        )
+        res = self.queue.update_one(
+            {
+                self.id_field: run_id,
+                self.status_field: self.status_taken,
+                self.lease_token_field: lease_token,
+            },
+            {"$set": {self.lease_expires_field: deadline}},
+        )
+        return res.matched_count == 1
+
+    def reclaim_expired(self, max_attempts: Optional[int]) -> int:
+        expired = {
+            self.status_field: self.status_taken,
+            self.lease_expires_field: {"$lt": datetime.datetime.utcnow()},
+        }
+        unset_lease = {self.lease_expires_field: "", self.lease_token_field: ""}
+        if max_attempts is not None:
+            self.queue.update_many(
+                {**expired, self.attempts_field: {"$gte": max_attempts}},
+                {
+                    "$set": {self.status_field: self.status_failed},
+                    "$unset": unset_lease,
+                },
+            )
+        res = self.queue.update_many(
+            expired,
+            {"$set": {self.status_field: self.status_ready}, "$unset": unset_lease},
+        )
+        return res.modified_count
+
+    def release(
+        self, run_id: RunId, lease_token: str, max_attempts: Optional[int]
+    ) -> bool:
+        query = {
+            self.id_field: run_id,
+            self.status_field: self.status_taken,
+            self.lease_token_field: lease_token,
+        }
+        new_status = self.status_ready
+        if max_attempts is not None:
+            taken = self.queue.find_one(query, {self.attempts_field: 1})
+            if taken is not None and taken[self.attempts_field] >= max_attempts:
+                new_status = self.status_failed
+        res = self.queue.update_one(
+            query,
+            {
+                "$set": {self.status_field: new_status},
+                "$unset": {self.lease_expires_field: "", self.lease_token_field: ""},
+            },
+        )
+        return res.modified_count == 1 and new_status == self.status_ready
+
+    def insert(self, entries: List[Dict]) -> List[RunId]:
+        if len(entries) == 1:
+            return [self.queue.insert_one(entries[0]).inserted_id]
+        return self.queue.insert_many(entries, ordered=False).inserted_ids
+
+    def delete(self, run_id: RunId, lease_token: Optional[str] = None) -> int:
+        query = {self.id_field: run_id}
+        if lease_token is not None:
+            query[self.status_field] = self.status_taken
+            query[self.lease_token_field] = lease_token
+        return self.queue.delete_one(query).deleted_count
+
+    def set_priority(self, ids: List[RunId], priority: int) -> int:
+        res = self.queue.update_many(
+            {self.id_field: {"$in": ids}},
+            {"$set": {self.priority_field: priority}},
+        )
+        return res.modified_count
+
+    def change_status(self, old_status: str, new_status: str) -> int:
+        res = self.queue.update_many(
+            {self.status_field: old_status},
+            {"$set": {self.status_field: new_status}},
+        )
+        return res.modified_count
+
+    def has_ready(
+        self, task_names: List[str], capacity: Optional[Resources] = None
+    ) -> bool:
+        query = self._ready_query(task_names, capacity)
+        return self.queue.find_one(query, {self.id_field: 1}) is not None
+
+    def find_params(self, task_name: str, statuses: List[str]) -> List[Dict]:
+        entries = self.queue.find(
+            {self.taskname_field: task_name, self.status_field: {"$in": statuses}},
+            {self.params_field: 1},
+        )
+        return [e[self.params_field] for e in entries]
+
+    def find_fingerprints(
+        self,
+        fingerprints: List[str],
+        statuses: List[str],
+        code_version: Optional[str] = None,
+    ) -> Dict[str, RunId]:
+        query = {
+            self.fingerprint_field: {"$in": fingerprints},
+            self.status_field: {"$in": statuses},
+        }
+        if code_version is not None:
+            query[self.code_version_field] = code_version
+        entries = self.queue.find(query, {self.fingerprint_field: 1})
+        return {e[self.fingerprint_field]: e[self.id_field] for e in entries}
+
+    def wait_for_ready(
+        self,
+        task_names: List[str],
+        timeout: float,
+        capacity: Optional[Resources] = None,
+    ) -> bool:
+        if not self.change_streams:
+            return False
+        try:
+            self._watch_ready(task_names, timeout, capacity)
+            return True
+        except OperationFailure as ex:
+            print(f"Change streams not available ({ex}), polling the queue instead")
+            self.change_streams = False
+            return False
+
+    def _watch_ready(
+        self, task_names: List[str], timeout: float, capacity: Optional[Resources]
+    ):
+        pipeline = [
+            {
+                "$match": {
+                    "$or": [
+                        {
+                            "operationType": "insert",
+                            f"fullDocument.{self.status_field}": self.status_ready,
+                        },
+                        {
+                            "operationType": "update",
+                            f"updateDescription.updatedFields.{self.status_field}": self.status_ready,
+                        },
+                    ]
+                }
+            }
+        ]
+        deadline = time.monotonic() + timeout
+        with self.queue.watch(
+            pipeline, max_await_time_ms=int(timeout * 1000)
+        ) as stream:
+            # runs could have been submitted after the last fetch, but before opening the stream
+            if self.has_ready(task_names, capacity):
+                return
+            while stream.alive and time.monotonic() < deadline:
+                if stream.try_next() is not None:
+                    return
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """
+    Queue stored in a local SQLite database (in WAL mode), for single-node deployments and tests.
+    Can be shared by multiple processes on the same machine. Times are stored as UNIX timestamps,
+    params - as JSON.
+    """
+
+    def __init__(self, path: Union[str, Path], table: str = "queue"):
+        self.path = str(path)
+        self.table = table
+        self._local = threading.local()
+        with self._transaction() as con:
+            con.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" ({self.id_field} TEXT PRIMARY KEY)'
+            )
+            existing = {row[1] for row in con.execute(f'PRAGMA table_info("{table}")')}
+            for column, definition in self._columns().items():
+                if column not in existing:
+                    con.execute(
+                        f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'
+                    )
+            con.execute(f"""CREATE INDEX IF NOT EXISTS "{table}_fetch" ON "{table}" (
+                    {self.status_field}, {self.taskname_field},
+                    {self.priority_field} DESC, {self.time_inserted_field}
+                )""")
+            con.execute(f"""CREATE INDEX IF NOT EXISTS "{table}_lease" ON "{table}" (
+                    {self.status_field}, {self.lease_expires_field}
+                )""")
+            con.execute(
+                f"""CREATE INDEX IF NOT EXISTS "{table}_fingerprint" ON "{table}" (
+                    {self.fingerprint_field}
+                )"""
+            )
+
+    def _columns(self) -> Dict[str, str]:
+        """Columns other than the id, with definitions. Missing ones are added to existing tables"""
+        return {
+            self.taskname_field: "TEXT NOT NULL DEFAULT ''",
+            self.params_field: "TEXT NOT NULL DEFAULT '{}'",
+            self.status_field: "TEXT NOT NULL DEFAULT ''",
+            self.priority_field: "INTEGER NOT NULL DEFAULT 0",
+            self.time_inserted_field: "REAL NOT NULL DEFAULT 0",
+            self.time_taken_field: "REAL",
+            self.lease_expires_field: "REAL",
+            self.lease_token_field: "TEXT",
+            self.attempts_field: "INTEGER NOT NULL DEFAULT 0",
+            "req_cores": "REAL NOT NULL DEFAULT 0",
+            "req_memory_gb": "REAL NOT NULL DEFAULT 0",
+            "req_tags": "TEXT NOT NULL DEFAULT '[]'",
+            self.fingerprint_field: "TEXT",
+            self.code_version_field: "TEXT",
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, and a new one after fork
+        con = getattr(self._local, "connection", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = con
+            self._local.pid = os.getpid()
+        return con
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction - taking the database lock right away, to make read-then-update atomic"""
+        con = self._connection()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def _to_entry(self, row: sqlite3.Row) -> Dict:
+        entry = dict(row)
+        entry[self.id_field] = ObjectId(entry[self.id_field])
+        entry[self.params_field] = json.loads(entry[self.params_field])
+        entry[self.requirements_field] = {
+            "cores": entry.pop("req_cores"),
+            "memory_gb": entry.pop("req_memory_gb"),
+            "tags": json.loads(entry.pop("req_tags")),
+        }
+        return entry
+
+    @staticmethod
+    def _placeholders(n: int) -> str:
+        return ", ".join(["?"] * n)
+
+    def _ready_condition(
+        self, task_names: List[str], capacity: Optional[Resources]
+    ) -> Tuple[str, List]:
+        """WHERE clause selecting ready entries of the tasks, fitting `capacity` if given, and its arguments"""
+        conditions = [
+            f"{self.status_field} = ?",
+            f"{self.taskname_field} IN ({self._placeholders(len(task_names))})",
+        ]
+        args = [self.status_ready, *task_names]
+        if capacity is not None:
+            conditions += [
+                "req_cores <= ?",
+                "req_memory_gb <= ?",
+                f"""NOT EXISTS (SELECT 1 FROM json_each(req_tags)
+                WHERE value NOT IN ({self._placeholders(len(capacity.tags))}))""",
+            ]
+            args += [capacity.cores, capacity.memory_gb, *capacity.tags]
+        return " AND ".join(conditions), args
+
+    def claim(
+        self,
+        task_names: List[str],
+        lease_duration: float,
+        capacity: Optional[Resources] = None,
+    ) -> Optional[Dict]:
+        if not task_names:
+            return None
+        condition, args = self._ready_condition(task_names, capacity)
+        order = f"{self.priority_field} DESC, {self.time_inserted_field}"
+        if capacity is not None:
+            order = f"{self.priority_field} DESC, req_cores DESC, req_memory_gb DESC, {self.time_inserted_field}"
+        now = time.time()
+        with self._transaction() as con:
+            row = con.execute(
+                f"""SELECT {self.id_field} FROM "{self.table}"
+                WHERE {condition} ORDER BY {order} LIMIT 1""",
+                args,
+            ).fetchone()
+            if row is None:
+                return None
+            run_id = row[0]
+            con.execute(
+                f"""UPDATE "{self.table}" SET {self.status_field} = ?,
+                {self.time_taken_field} = ?, {self.lease_expires_field} = ?,
+                {self.lease_token_field} = ?, {self.attempts_field} = {self.attempts_field} + 1
+                WHERE {self.id_field} = ?""",
+                [
+                    self.status_taken,
+                    now,
+                    now + lease_duration,
+                    uuid.uuid4().hex,
+                    run_id,
+                ],
+            )
+            row = con.execute(
+                f'SELECT * FROM "{self.table}" WHERE {self.id_field} = ?', [run_id]
+            ).fetchone()
+        return self._to_entry(row)
+
+    def renew_lease(
+        self, run_id: RunId, lease_token: str, lease_duration: float
+    ) -> bool:
+        with self._transaction() as con:
+            cur = con.execute(
+                f"""UPDATE "{self.table}" SET {self.lease_expires_field} = ?
+                WHERE {self.id_field} = ? AND {self.status_field} = ? AND {self.lease_token_field} = ?""",
+                [
+                    time.time() + lease_duration,
+                    str(run_id),
+                    self.status_taken,
+                    lease_token,
+                ],
+            )
+        return cur.rowcount == 1
+
+    def reclaim_expired(self, max_attempts: Optional[int]) -> int:
+        expired = (
+            f'UPDATE "{self.table}" SET {self.status_field} = ?, '
+            f"{self.lease_expires_field} = NULL, {self.lease_token_field} = NULL "
+            f"WHERE {self.status_field} = ? AND {self.lease_expires_field} < ?"
+        )
+        now = time.time()
+        with self._transaction() as con:
+            if max_attempts is not None:
+                con.execute(
+                    expired + f" AND {self.attempts_field} >= ?",
+                    [self.status_failed, self.status_taken, now, max_attempts],
+                )
+            cur = con.execute(expired, [self.status_ready, self.status_taken, now])
+        return cur.rowcount
+
+    def release(
+        self, run_id: RunId, lease_token: str, max_attempts: Optional[int]
+    ) -> bool:
+        with self._transaction() as con:
+            row = con.execute(
+                f"""SELECT {self.attempts_field} FROM "{self.table}"
+                WHERE {self.id_field} = ? AND {self.status_field} = ? AND {self.lease_token_field} = ?""",
+                [str(run_id), self.status_taken, lease_token],
+            ).fetchone()
+            if row is None:
+                return False
+            new_status = self.status_ready
+            if max_attempts is not None and row[0] >= max_attempts:
+                new_status = self.status_failed
+            con.execute(
+                f"""UPDATE "{self.table}" SET {self.status_field} = ?,
+                {self.lease_expires_field} = NULL, {self.lease_token_field} = NULL
+                WHERE {self.id_field} = ?""",
+                [new_status, str(run_id)],
+            )
+        return new_status == self.status_ready
+
+    def insert(self, entries: List[Dict]) -> List[RunId]:
+        ids = [ObjectId() for _ in entries]
+        rows = [
+            (
+                str(run_id),
+                e[self.taskname_field],
+                json.dumps(e[self.params_field]),
+                e[self.status_field],
+                e[self.priority_field],
+                *self._requirements_row(e.get(self.requirements_field)),
+                e[self.time_inserted_field]
+                .replace(tzinfo=datetime.timezone.utc)
+                .timestamp(),
+                e.get(self.fingerprint_field),
+                e.get(self.code_version_field),
+            )
+            for run_id, e in zip(ids, entries)
+        ]
+        with self._transaction() as con:
+            con.executemany(
+                f"""INSERT INTO "{self.table}" ({self.id_field}, {self.taskname_field},
+                {self.params_field}, {self.status_field}, {self.priority_field},
+                req_cores, req_memory_gb, req_tags, {self.time_inserted_field},
+                {self.fingerprint_field}, {self.code_version_field})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+        return ids
+
+    @staticmethod
+    def _requirements_row(requirements: Optional[Dict]) -> Tuple:
+        if requirements is None:
+            requirements = {}
+        return (
+            requirements.get("cores", 0),
+            requirements.get("memory_gb", 0),
+            json.dumps(requirements.get("tags", [])),
+        )
+
+    def delete(self, run_id: RunId, lease_token: Optional[str] = None) -> int:
+        condition = f"{self.id_field} = ?"
+        args = [str(run_id)]
+        if lease_token is not None:
+            condition += (
+                f" AND {self.status_field} = ? AND {self.lease_token_field} = ?"
+            )
+            args += [self.status_taken, lease_token]
+        with self._transaction() as con:
+            cur = con.execute(f'DELETE FROM "{self.table}" WHERE {condition}', args)
+        return cur.rowcount
+
+    def set_priority(self, ids: List[RunId], priority: int) -> int:
+        with self._transaction() as con:
+            cur = con.execute(
+                f"""UPDATE "{self.table}" SET {self.priority_field} = ?
+                WHERE {self.id_field} IN ({self._placeholders(len(ids))})""",
+                [priority, *map(str, ids)],
+            )
+        return cur.rowcount
+
+    def change_status(self, old_status: str, new_status: str) -> int:
+        with self._transaction() as con:
+            cur = con.execute(
+                f'UPDATE "{self.table}" SET {self.status_field} = ? WHERE {self.status_field} = ?',
+                [new_status, old_status],
+            )
+        return cur.rowcount
+
+    def has_ready(
+        self, task_names: List[str], capacity: Optional[Resources] = None
+    ) -> bool:
+        condition, args = self._ready_condition(task_names, capacity)
+        row = (
+            self._connection()
+            .execute(f'SELECT 1 FROM "{self.table}" WHERE {condition} LIMIT 1', args)
+            .fetchone()
+        )
+        return row is not None
+
+    def find_params(self, task_name: str, statuses: List[str]) -> List[Dict]:
+        rows = self._connection().execute(
+            f"""SELECT {self.params_field} FROM "{self.table}" WHERE {self.taskname_field} = ?
+            AND {self.status_field} IN ({self._placeholders(len(statuses))})""",
+            [task_name, *statuses],
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def find_fingerprints(
+        self,
+        fingerprints: List[str],
+        statuses: List[str],
+        code_version: Optional[str] = None,
+    ) -> Dict[str, RunId]:
+        if not fingerprints:
+            return {}
+        conditions = [
+            f"{self.fingerprint_field} IN ({self._placeholders(len(fingerprints))})",
+            f"{self.status_field} IN ({self._placeholders(len(statuses))})",
+        ]
+        args = [*fingerprints, *statuses]
+        if code_version is not None:
+            conditions.append(f"{self.code_version_field} = ?")
+            args.append(code_version)
+        rows = self._connection().execute(
+            f"""SELECT {self.fingerprint_field}, {self.id_field} FROM "{self.table}"
+            WHERE {" AND ".join(conditions)}""",
+            args,
+        )
+        return {row[0]: ObjectId(row[1]) for row in rows}
+
+
+def backend_from_uri(uri: str, db_name: str) -> QueueBackend:
+    """
+    Creates a queue backend. `sqlite://<path>` URIs (e.g. `sqlite:///tmp/queue.db`) select a
+    SQLite database at the given path, with one table per `db_name`. Otherwise, `uri` is treated
+    as a MongoDB URI.
+    """
+    if uri.startswith(SQLITE_URI_PREFIX):
+        return SQLiteQueueBackend(
+            uri[len(SQLITE_URI_PREFIX) :], table=f"{db_name}_queue"
+        )
+    return MongoQueueBackend(uri, db_name)
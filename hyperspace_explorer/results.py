@@ -1,13 +1,20 @@
 import copy
+import itertools
 from typing import *
 import pymongo
+from .connections import get_client
+from .fingerprint import FINGERPRINT_FIELD, CODE_VERSION_FIELD
+from .queue_backends import MongoQueueBackend
+from .schema import IndexSpec, ensure_schema, explain_stats
 from .utils import (
     flatten,
     unique_suffixes,
     drop_constant_columns,
     lists_to_tuples,
     requires_analysis_extra,
+    check_analysis_extra,
     pd,
+    np,
 )
 
 RUNS_COLLECTION = "runs"
@@ -20,12 +27,43 @@ RESULT_FIELD = "result"
 PROJECTION_RESULTS = {"config": 1, RESULT_FIELD: 1}
 ORDER_RESULT_DESCENDING = [(RESULT_FIELD, pymongo.DESCENDING)]
 
+# accumulators of `Task.aggregate_results()`, given a field path
+AGGREGATION_STATS = {
+    "mean": lambda path: {"$avg": path},
+    "std": lambda path: {"$stdDevSamp": path},
+    "count": lambda path: {
+        "$sum": {"$cond": [{"$eq": [{"$ifNull": [path, None]}, None]}, 0, 1]}
+    },
+    "min": lambda path: {"$min": path},
+    "max": lambda path: {"$max": path},
+    "sum": lambda path: {"$sum": path},
+}
+
+RESULTS_SCHEMA_VERSION = 2
+RESULTS_INDEXES = [
+    IndexSpec(RUNS_COLLECTION, ORDER_RESULT_DESCENDING),
+    # `find_runs()` of a task, in default order
+    IndexSpec(
+        RUNS_COLLECTION,
+        [
+            ("experiment.name", pymongo.ASCENDING),
+            ("status", pymongo.ASCENDING),
+            *ORDER_RESULT_DESCENDING,
+        ],
+    ),
+    IndexSpec(
+        METRICS_COLLECTION, [("run_id", pymongo.ASCENDING), ("name", pymongo.ASCENDING)]
+    ),
+    # `Study.find_completed()`
+    IndexSpec(RUNS_COLLECTION, [(f"info.{FINGERPRINT_FIELD}", pymongo.ASCENDING)]),
+]
+
 
 class Study:
     def __init__(self, db_name: str, mongo_uri: str = MONGO_URI_DEFAULT):
         self.db_name = db_name
         self.mongo_uri = mongo_uri
-        self._client = pymongo.MongoClient(mongo_uri)
+        self._client = get_client(mongo_uri)
         self.c = self._client[db_name][RUNS_COLLECTION]
 
     def get_task_names(self) -> List[str]:
@@ -34,17 +72,84 @@ class Study:
     def get_task(self, name: str) -> "Task":
         return Task(name, self.db_name, self.mongo_uri)
 
+    def ensure_indexes(self, force: bool = False) -> bool:
+        """
+        Creates indexes supporting the standard queries on runs, metrics and the run queue.
+        Skipped if the database already has their current version (recorded in the database).
+
+        :param force: create indexes even if their version is current
+        :return: whether any indexes were created
+        """
+        db = self._client[self.db_name]
+        created_results = ensure_schema(
+            db, "results", RESULTS_SCHEMA_VERSION, RESULTS_INDEXES, force
+        )
+        created_queue = ensure_schema(
+            db,
+            MongoQueueBackend.collection,
+            MongoQueueBackend.schema_version,
+            MongoQueueBackend.indexes,
+            force,
+        )
+        return created_results or created_queue
+
+    def find_completed(
+        self, fingerprints: Iterable[str], code_version: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        Ids of completed runs with the given config fingerprints (see `fingerprint.config_fingerprint()`),
+        by fingerprint. Only runs recorded with fingerprints by the worker are found.
+
+        :param code_version: if given, only runs recorded with this code version
+        """
+        query = {
+            f"info.{FINGERPRINT_FIELD}": {"$in": list(fingerprints)},
+            "status": STATUS_COMPLETED,
+        }
+        if code_version is not None:
+            query[f"info.{CODE_VERSION_FIELD}"] = code_version
+        runs = self.c.find(query, {f"info.{FINGERPRINT_FIELD}": 1})
+        return {r["info"][FINGERPRINT_FIELD]: r["_id"] for r in runs}
+
+    def explain_queries(self, task_name: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        Checks how the database executes the standard queries, e.g. if they use indexes.
+
+        :param task_name: task to run the queries for, by default any task in the study - which must have runs then
+        :return: stats of each query, see `schema.explain_stats()`
+        """
+        if task_name is None:
+            any_run = self.c.find_one({}, {"experiment.name": 1})
+            if any_run is None:
+                raise ValueError(
+                    f"No runs in study {self.db_name} - pass `task_name` to explain queries anyway"
+                )
+            task_name = any_run["experiment"]["name"]
+        task = self.get_task(task_name)
+        db = self._client[self.db_name]
+        # an id of a run of the task, if it has any - the query is explained either way
+        some_run = self.c.find_one({"experiment.name": task_name}, {"_id": 1}) or {}
+        # not through `MongoQueueBackend()`, which would create indexes of the queue
+        queue = db[MongoQueueBackend.collection]
+        cursors = {
+            "fetch_results": task.iter_results(),
+            "metrics_for_run": db[METRICS_COLLECTION].find(
+                {"run_id": some_run.get("_id"), "name": {"$in": [RESULT_FIELD]}}
+            ),
+            "queue_claim": queue.find(MongoQueueBackend._ready_query([task_name]))
+            .sort(MongoQueueBackend.fetch_order)
+            .limit(1),
+        }
+        return {name: explain_stats(c.explain()) for name, c in cursors.items()}
+
 
 class Task:
     def __init__(self, name: str, db_name: str, mongo_uri: str = MONGO_URI_DEFAULT):
         self.name = name
         self.db_name = db_name
         self.mongo_uri = mongo_uri
-        self._client = pymongo.MongoClient(mongo_uri)
+        self._client = get_client(mongo_uri)
         self.c = self._client[db_name][RUNS_COLLECTION]
-        self.c.create_index(
-            ORDER_RESULT_DESCENDING
-        )  # ensure quick retrieval in default order
 
     def get_run(self, run_id: int) -> Dict:
         run = self.c.find_one(run_id)
@@ -66,6 +171,7 @@ class Task:
         projection_extra: Optional[Dict] = None,
         order: Optional[List[Tuple]] = None,
         limit: int = 0,
+        config_keys: Optional[List[str]] = None,
     ) -> List[Dict]:
         """
         Fetches results of completed runs.
@@ -74,20 +180,79 @@ class Task:
         :param projection_extra: MongoDB-style dict of {'feat_name': 1} or similar
         :param order: each tuple is e.g. ('feat_name', pymongo.ASCENDING)
         :param limit: how many to fetch, 0 - fetch all
+        :param config_keys: flattened config keys to fetch, e.g. ['model.lr'] - the whole config if not given
         :return: list of dicts, each dict representing a run
         """
+        return list(
+            self.iter_results(query, projection_extra, order, limit, config_keys)
+        )
+
+    def iter_results(
+        self,
+        query: Optional[Dict] = None,
+        projection_extra: Optional[Dict] = None,
+        order: Optional[List[Tuple]] = None,
+        limit: int = 0,
+        config_keys: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Dict]:
+        """
+        Like `fetch_results()`, but yields runs one by one, fetching them from the database in batches.
+
+        :param batch_size: how many runs to fetch from the database at once
+        """
         if query is None:
             query = {}
-        projection = copy.copy(PROJECTION_RESULTS)
+        if config_keys is None:
+            projection = copy.copy(PROJECTION_RESULTS)
+        else:
+            projection = {RESULT_FIELD: 1}
+            projection.update({f"config.{k}": 1 for k in config_keys})
         if projection_extra:
             projection.update(projection_extra)
         if order is None:
             order = ORDER_RESULT_DESCENDING
 
-        runs = self.find_runs(
-            query, completed_only=True, sort=order, projection=projection, limit=limit
+        return self.iter_runs(
+            query,
+            completed_only=True,
+            batch_size=batch_size,
+            sort=order,
+            projection=projection,
+            limit=limit,
+        )
+
+    @requires_analysis_extra
+    def results_frame(
+        self,
+        query: Optional[Dict] = None,
+        config_keys: Optional[List[str]] = None,
+        hide_const_cols: bool = True,
+        batch_size: int = 1000,
+        **kwargs,
+    ) -> "pd.DataFrame":
+        """
+        Equivalent to `results_comparison(fetch_results(...))`, but never holds all raw documents in memory:
+        runs are fetched and flattened into a DataFrame batch by batch.
+
+        Requires Pandas.
+
+        :param query: MongoDB-style dict of conditions, e.g. {'key.nestedKey': 'val'}
+        :param config_keys: flattened config keys to fetch, e.g. ['model.lr'] - the whole config if not given
+        :param hide_const_cols: hide all columns with only 1 unique value?
+        :param batch_size: how many runs to fetch and convert at once
+        :param kwargs: passed to `iter_results()`
+        :return: a DataFrame indexed with run ids, comparing config params and results
+        """
+        runs = self.iter_results(
+            query, config_keys=config_keys, batch_size=batch_size, **kwargs
         )
-        return runs
+        chunks = [
+            pd.DataFrame([flatten(r) for r in batch])
+            for batch in iter(lambda: list(itertools.islice(runs, batch_size)), [])
+        ]
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        return Task._comparison_frame(df, hide_const_cols)
 
     @staticmethod
     @requires_analysis_extra
@@ -104,6 +269,10 @@ class Task:
         :return: a DataFrame indexed with run ids, comparing config params and results
         """
         df = pd.DataFrame([flatten(r) for r in results])
+        return Task._comparison_frame(df, hide_const_cols)
+
+    @staticmethod
+    def _comparison_frame(df: "pd.DataFrame", hide_const_cols: bool) -> "pd.DataFrame":
         df = df.set_index("_id")
         df.index.name = "id"
         df = df.rename(columns=unique_suffixes(df.columns))
@@ -116,12 +285,86 @@ class Task:
         self, query: Dict, completed_only: bool = True, **kwargs
     ) -> List[Dict]:
         """Like MongoDBClient.find, but only retrieves entries related to this task"""
+        return list(self.iter_runs(query, completed_only, **kwargs))
+
+    def iter_runs(
+        self,
+        query: Dict,
+        completed_only: bool = True,
+        batch_size: int = 1000,
+        **kwargs,
+    ) -> Iterator[Dict]:
+        """Like `find_runs()`, but returns the cursor, fetching `batch_size` runs from the database at once"""
+        query_full = self._task_query(query, completed_only)
+        return self.c.find(query_full, **kwargs).batch_size(batch_size)
+
+    def _task_query(self, query: Dict, completed_only: bool) -> Dict:
         conditions = [{"experiment.name": self.name}, query]
         if completed_only:
             conditions.append({"status": STATUS_COMPLETED})
-        query_full = {"$and": conditions}
-        runs = list(self.c.find(query_full, **kwargs))
-        return runs
+        return {"$and": conditions}
+
+    @requires_analysis_extra
+    def aggregate_results(
+        self,
+        group_by: List[str],
+        metrics: Optional[List[str]] = None,
+        stats: Sequence[str] = ("mean", "std", "count", "min", "max"),
+        query: Optional[Dict] = None,
+        completed_only: bool = True,
+    ) -> "pd.DataFrame":
+        """
+        Summarizes results of runs grouped by config params, e.g. over different seeds. Computed by the database.
+
+        Requires Pandas.
+
+        :param group_by: flattened config keys, e.g. ['model.lr', 'optimizer.name']. If empty, all runs
+            are summarized together, in a single row
+        :param metrics: fields of runs to summarize, e.g. ['result', 'info.val_loss'], by default ['result']
+        :param stats: any of: mean, std (sample), count (of non-null values), min, max, sum
+        :param query: MongoDB-style dict of conditions, e.g. {'key.nestedKey': 'val'}
+        :param completed_only: only include completed runs
+        :return: a DataFrame indexed with `group_by` params, with (metric, stat) columns
+        """
+        if metrics is None:
+            metrics = [RESULT_FIELD]
+        unknown = set(stats) - set(AGGREGATION_STATS)
+        if unknown:
+            raise ValueError(
+                f"Unknown stats: {sorted(unknown)}, supported: {list(AGGREGATION_STATS)}"
+            )
+        # field names in $group must not contain dots
+        group = {"_id": {f"g{i}": f"$config.{k}" for i, k in enumerate(group_by)}}
+        if not group_by:
+            group["_id"] = None
+        for i, metric in enumerate(metrics):
+            for stat in stats:
+                group[f"m{i}_{stat}"] = AGGREGATION_STATS[stat](f"${metric}")
+        pipeline = [
+            {"$match": self._task_query(query or {}, completed_only)},
+            {"$group": group},
+        ]
+        if group_by:
+            pipeline.append(
+                {
+                    "$sort": {
+                        f"_id.g{i}": pymongo.ASCENDING for i in range(len(group_by))
+                    }
+                }
+            )
+        rows = []
+        for doc in self.c.aggregate(pipeline):
+            row = {k: doc["_id"].get(f"g{i}") for i, k in enumerate(group_by)}
+            for i, metric in enumerate(metrics):
+                for stat in stats:
+                    row[(metric, stat)] = doc[f"m{i}_{stat}"]
+            rows.append(row)
+        columns = [*group_by, *((m, s) for m in metrics for s in stats)]
+        df = lists_to_tuples(pd.DataFrame(rows, columns=columns))
+        if group_by:
+            df = df.set_index(group_by)
+        df.columns = pd.MultiIndex.from_tuples(df.columns)
+        return df
 
     def get_all_ids(self) -> List[int]:
         runs = self.find_runs({}, projection={"_id": 1})
@@ -146,3 +389,115 @@ class Task:
             query["name"] = {"$in": names}
         cur = collection.find(query)
         return list(cur)
+
+    def metrics_for_runs(
+        self,
+        runs: Union[List[int], Dict, None] = None,
+        names: Optional[List[str]] = None,
+        max_points: Optional[int] = None,
+        last_only: bool = False,
+        as_frame: bool = True,
+    ) -> Union["pd.DataFrame", Dict[str, "np.ndarray"]]:
+        """
+        Fetches metrics of many runs at once, in long format - one row per (run, metric, step).
+
+        Requires Pandas, or only NumPy if `as_frame` is False.
+
+        :param runs: list of run ids, or a MongoDB-style query selecting runs of this task (any status).
+            All runs of the task if not specified
+        :param names: list of metrics to fetch, fetch all if not specified
+        :param max_points: if given, longer series are downsampled on the server to at most that many
+            evenly spaced points - always including the first and the last one
+        :param last_only: only fetch the last value of each metric
+        :param as_frame: return a DataFrame, or a dict of aligned arrays
+        :return: columns: run_id, name, step, value. Steps and values are integer or float arrays,
+            or object ones if some of them are not numbers
+        """
+        if as_frame:
+            check_analysis_extra()
+        elif np is None:
+            raise ModuleNotFoundError(
+                "NumPy module missing, needed to return metrics as arrays. "
+                "Install it, or install hyperspace_explorer[analysis] extra dependency"
+            )
+        if runs is None or isinstance(runs, dict):
+            runs = [
+                r["_id"]
+                for r in self.find_runs(
+                    runs or {}, completed_only=False, projection={"_id": 1}
+                )
+            ]
+        match = {"run_id": {"$in": list(runs)}}
+        if names:
+            match["name"] = {"$in": names}
+        pipeline = [{"$match": match}]
+        if last_only or max_points == 1:
+            pipeline.append(_project_metric_arrays(lambda arr: {"$slice": [arr, -1]}))
+        elif max_points:
+            size = {"$size": "$steps"}
+            last = {"$subtract": [size, 1]}
+            # at most `max_points` indices 0, stride, 2 * stride... - and the last one, if not among them
+            stride = {"$toInt": {"$ceil": {"$divide": [last, max_points - 1]}}}
+            every_nth = {"$range": [0, size, "$stride"]}
+            indices = {
+                "$cond": [
+                    {"$eq": [{"$mod": [last, "$stride"]}, 0]},
+                    every_nth,
+                    {"$concatArrays": [every_nth, {"$range": [last, size]}]},
+                ]
+            }
+            pipeline += [
+                {"$addFields": {"stride": {"$max": [1, stride]}}},
+                _project_metric_arrays(
+                    lambda arr: {
+                        "$map": {
+                            "input": indices,
+                            "as": "i",
+                            "in": {"$arrayElemAt": [arr, "$$i"]},
+                        }
+                    }
+                ),
+            ]
+        else:
+            pipeline.append(_project_metric_arrays(lambda arr: 1))
+        collection = self._client[self.db_name][METRICS_COLLECTION]
+        run_ids, metric_names, steps, values = [], [], [], []
+        for m in collection.aggregate(pipeline):
+            n = len(m["steps"])
+            run_ids.append(np.full(n, m["run_id"]))
+            metric_names.append(np.full(n, m["name"], dtype=object))
+            steps.append(_metric_array(m["steps"]))
+            values.append(_metric_array(m["values"]))
+        columns = {
+            "run_id": _concatenate(run_ids, np.int64),
+            "name": _concatenate(metric_names, object),
+            "step": _concatenate(steps, np.int64),
+            "value": _concatenate(values, np.float64),
+        }
+        if as_frame:
+            return pd.DataFrame(columns)
+        return columns
+
+
+def _project_metric_arrays(transform: Callable[[str], Any]) -> Dict:
+    """Aggregation stage projecting `steps` and `values` of metrics documents, transformed the same way"""
+    return {
+        "$project": {
+            "run_id": 1,
+            "name": 1,
+            "steps": transform("$steps"),
+            "values": transform("$values"),
+        }
+    }
+
+
+def _metric_array(items: List) -> "np.ndarray":
+    """Steps or values of a metric, in an array of the dtype inferred by NumPy - unless they are not numbers"""
+    converted = np.array(items)
+    if converted.dtype.kind in "biuf":
+        return converted
+    return np.array(items, dtype=object)  # not converted to strings
+
+
+def _concatenate(arrays: List["np.ndarray"], dtype) -> "np.ndarray":
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import *
+from .results import Task, RESULT_FIELD, STATUS_COMPLETED
+from .utils import flatten, requires_analysis_extra, pd
+
+CACHE_DIR_DEFAULT = Path.home() / ".cache" / "hyperspace_explorer"
+MMAP_SIZE_DEFAULT = 1 << 30
+# runs in these states may still change - all others are final
+UNFINISHED_STATUSES = ["QUEUED", "RUNNING"]
+PROJECTION_CACHED = {"config": 1, RESULT_FIELD: 1, "status": 1}
+
+
+def default_path(db_name: str, mongo_uri: str) -> Path:
+    """
+    Cache file of a database, named after it and its server - databases on different servers may share names.
+    The server is represented by a hash of the URI, which might contain credentials.
+    """
+    server = hashlib.sha256(mongo_uri.encode()).hexdigest()[:12]
+    return CACHE_DIR_DEFAULT / f"{db_name}-{server}.sqlite"
+
+
+class ResultsCache:
+    """
+    Local, on-disk (SQLite) copy of flattened results of a task's runs.
+
+    `sync()` only fetches runs newer than the newest one already cached, and re-checks cached runs
+    that were not finished yet - completed runs never change, so they are downloaded only once.
+    One file per database (Study, on a given server) holds results of all its tasks. It is read through memory mapping,
+    so re-opening a large cache is fast.
+    """
+
+    def __init__(
+        self,
+        task: Task,
+        path: Union[str, Path, None] = None,
+        mmap_size: int = MMAP_SIZE_DEFAULT,
+    ):
+        """
+        :param task: task to cache results of
+        :param path: cache file, by default `~/.cache/hyperspace_explorer/<db_name>-<hash of mongo_uri>.sqlite`,
+            see `default_path()`
+        :param mmap_size: how many bytes of the cache file to access through memory mapping
+        """
+        self.task = task
+        if path is None:
+            path = default_path(task.db_name, task.mongo_uri)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.path, isolation_level=None)
+        self.con.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS results (
+            task TEXT NOT NULL,
+            _id INTEGER NOT NULL,
+            status TEXT,
+            result REAL,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (task, _id)
+        )""")
+
+    def sync(self, batch_size: int = 1000) -> int:
+        """
+        Fetches new runs, and updates unfinished ones.
+
+        :param batch_size: how many runs to fetch from the database at once
+        :return: number of runs fetched
+        """
+        last_id = self.con.execute(
+            "SELECT MAX(_id) FROM results WHERE task = ?", (self.task.name,)
+        ).fetchone()[0]
+        query = {}
+        if last_id is not None:
+            placeholders = ", ".join("?" * len(UNFINISHED_STATUSES))
+            unfinished = [
+                row[0]
+                for row in self.con.execute(
+                    f"SELECT _id FROM results WHERE task = ? AND status IN ({placeholders})",
+                    (self.task.name, *UNFINISHED_STATUSES),
+                )
+            ]
+            query = {"$or": [{"_id": {"$gt": last_id}}, {"_id": {"$in": unfinished}}]}
+        runs = self.task.iter_runs(
+            query,
+            completed_only=False,
+            batch_size=batch_size,
+            projection=PROJECTION_CACHED,
+        )
+        fetched = 0
+        self.con.execute("BEGIN")
+        try:
+            for run in runs:
+                self.con.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                    self._to_row(run),
+                )
+                fetched += 1
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+        self.con.execute("COMMIT")
+        return fetched
+
+    def _to_row(self, run: Dict) -> Tuple:
+        status = run.get("status")
+        result = run.get(RESULT_FIELD)
+        if not isinstance(result, (int, float)):
+            result = None  # only used for ordering
+        doc = {k: v for k, v in run.items() if k != "status"}
+        doc = json.dumps(flatten(doc), default=str)
+        return self.task.name, run["_id"], status, result, doc
+
+    def fetch_results(self) -> List[Dict]:
+        """
+        Cached results of completed runs, best first, as flat dicts - does not access MongoDB.
+        Call `sync()` first to include the latest runs.
+        """
+        rows = self.con.execute(
+            "SELECT doc FROM results WHERE task = ? AND status = ? ORDER BY result DESC",
+            (self.task.name, STATUS_COMPLETED),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    @requires_analysis_extra
+    def results_frame(self, hide_const_cols: bool = True) -> "pd.DataFrame":
+        """
+        Like `Task.results_frame()`, but using cached results. Requires Pandas.
+
+        :param hide_const_cols: hide all columns with only 1 unique value?
+        :return: a DataFrame indexed with run ids, comparing config params and results
+        """
+        df = pd.DataFrame(self.fetch_results())
+        return Task._comparison_frame(df, hide_const_cols)
+
+    def clear(self):
+        """Removes all cached results of the task"""
+        self.con.execute("DELETE FROM results WHERE task = ?", (self.task.name,))
+
+    def close(self):
+        self.con.close()
@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from typing import *
+from sacred import Experiment
+from sacred.dependencies import (
+    Source,
+    PackageDependency,
+    source_discovery_strategies,
+    dependency_discovery_strategies,
+    get_sources_from_modules,
+    get_dependencies_from_modules,
+)
+from sacred.observers import MongoObserver
+from sacred import optional as opt
+
+
+@dataclass
+class _Discovered:
+    main: Source
+    sources: Set[Source]
+    dependencies: Set[PackageDependency]
+    modules: Set[str]  # names of modules checked, with the 'sys' strategies
+    stats: Dict[str, Optional[Tuple[int, int]]]  # of source files
+
+
+class SourceDiscovery:
+    """
+    Sources and package dependencies of experiments, found with Sacred's discovery strategies once per process,
+    then reused while still up to date: if a source file changed (its modification time or size), discovery
+    is repeated. With the 'sys' strategies, modules imported since are checked too - only the new ones.
+
+    To be used with discovery in `sacred.SETTINGS` disabled ('none') - see `apply()`. Only strategies not depending
+    on globals of the main file are supported: 'sys', 'dir', 'pkg' or 'none'.
+    """
+
+    def __init__(
+        self,
+        sources_strategy: str = "sys",
+        dependencies_strategy: str = "sys",
+        save_git_info: bool = True,
+    ):
+        self.sources_strategy = sources_strategy
+        self.dependencies_strategy = dependencies_strategy
+        self.save_git_info = save_git_info
+        self.discoveries = 0
+        self._entries: Dict[Tuple[str, str], _Discovered] = {}
+        self._lock = threading.Lock()
+
+    def discover(
+        self, main_file: str, base_dir: str
+    ) -> Tuple[Source, Set[Source], Set[PackageDependency]]:
+        """
+        :param main_file: file defining the experiment
+        :param base_dir: sources are files of modules in this directory
+        :return: main file, sources and dependencies - new sets, which can be modified
+        """
+        key = (main_file, base_dir)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._files_unchanged(entry):
+                entry = self._discover(main_file, base_dir)
+                self._entries[key] = entry
+            else:
+                self._add_new_modules(entry, base_dir)
+        return entry.main, set(entry.sources), set(entry.dependencies)
+
+    def apply(self, ex: Experiment, main_file: str):
+        """Sets sources and dependencies of an experiment, created with discovery disabled"""
+        ex.mainfile, ex.sources, ex.dependencies = self.discover(main_file, ex.base_dir)
+        ex.save_git_info = self.save_git_info
+
+    def _discover(self, main_file: str, base_dir: str) -> _Discovered:
+        self.discoveries += 1
+        modules = set(sys.modules)
+        main = Source.create(main_file, self.save_git_info)
+        gather_sources = source_discovery_strategies[self.sources_strategy]
+        sources = gather_sources({}, base_dir, self.save_git_info)
+        sources.add(main)
+        gather_dependencies = dependency_discovery_strategies[
+            self.dependencies_strategy
+        ]
+        dependencies = gather_dependencies({}, base_dir)
+        if opt.has_numpy:
+            # as Sacred does - numpy might be used for randomness
+            dependencies.add(PackageDependency.create(opt.np))
+        stats = {s.filename: _stat(s.filename) for s in sources}
+        return _Discovered(main, sources, dependencies, modules, stats)
+
+    def _add_new_modules(self, entry: _Discovered, base_dir: str):
+        if len(sys.modules) == len(entry.modules) and not (
+            sys.modules.keys() - entry.modules
+        ):
+            return
+        new = [
+            (name, m)
+            for name, m in list(sys.modules.items())
+            if name not in entry.modules
+        ]
+        entry.modules.update(name for name, _ in new)
+        if self.sources_strategy == "sys":
+            sources = get_sources_from_modules(new, base_dir, self.save_git_info)
+            entry.sources |= sources
+            entry.stats.update((s.filename, _stat(s.filename)) for s in sources)
+        if self.dependencies_strategy == "sys":
+            entry.dependencies |= get_dependencies_from_modules(new, base_dir)
+
+    @staticmethod
+    def _files_unchanged(entry: _Discovered) -> bool:
+        return all(_stat(f) == stat for f, stat in entry.stats.items())
+
+
+def _stat(filename: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# ids of source files stored in GridFS, by (path, MD5), for each database (client, database name) - shared
+# by observers of the process, and inherited by forked ones. Clients are compared by the servers they connect to
+_stored_sources: Dict[Tuple[Any, str], Dict[Tuple[str, str], Any]] = {}
+
+
+class SourceCachingMongoObserver(MongoObserver):
+    """
+    MongoObserver uploading each source file (by path and MD5) to GridFS only once.
+
+    Files are stored with their MD5 - GridFS does not compute it anymore (since pymongo 4), so the stock observer
+    never finds files it uploaded before, and uploads all sources again for every run. Ids of stored files are also
+    remembered in the process, and by processes forked from it, saving a query per source file in subsequent runs.
+    """
+
+    def initialize(self, runs_collection, *args, **kwargs):
+        # called by both `__init__` and `create_from`
+        super().initialize(runs_collection, *args, **kwargs)
+        db = runs_collection.database
+        self._source_ids = _stored_sources.setdefault((db.client, db.name), {})
+
+    def save_sources(self, ex_info: Dict) -> List:
+        base_dir = ex_info["base_dir"]
+        source_info = []
+        for source_name, md5 in ex_info["sources"]:
+            abs_path = os.path.join(base_dir, source_name)
+            key = (abs_path, md5)
+            file_id = self._source_ids.get(key)
+            if file_id is None:
+                stored = self.fs.find_one({"filename": abs_path, "md5": md5})
+                if stored is not None:
+                    file_id = stored._id
+                else:
+                    with open(abs_path, "rb") as f:
+                        file_id = self.fs.put(f, filename=abs_path, md5=md5)
+                self._source_ids[key] = file_id
+            source_info.append([source_name, file_id])
+        return source_info
@@ -1,10 +1,94 @@
 import abc
+import numbers
+import time
+from array import array
 from typing import *
 from collections import defaultdict
 from hyperspace_explorer.configurables import Configurable, RegisteredAbstractMeta
+from hyperspace_explorer.early_stopping import ASHAPruner
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+class MetricBuffer:
+    """
+    Values of a single metric, with their steps, stored compactly in typed arrays - integer steps,
+    float values. Once a step or a value not fitting them is logged (e.g. a fractional step, or a value
+    which is not a number), they are stored in a list instead, as given.
+    Tracks how many of them were already forwarded elsewhere (flushed).
+    """
+
+    def __init__(self):
+        self.steps = array("q")
+        self.values = array("d")
+        self.max_step = -1
+        self.flushed = 0
+
+    def append(self, value: Any, step: Optional[int] = None) -> int:
+        """Stores the value at `step`, or at the step after the highest one so far. Returns the step"""
+        if step is None:
+            step = self.max_step + 1
+        elif (
+            isinstance(step, numbers.Real)
+            and not isinstance(step, numbers.Integral)
+            and float(step).is_integer()
+        ):
+            step = int(step)  # e.g. 3.0
+        self.steps = _append(self.steps, step)
+        self.values = _append(self.values, value)
+        if step > self.max_step:
+            self.max_step = step
+        return step
+
+    @property
+    def pending(self) -> int:
+        return len(self.values) - self.flushed
+
+    def take_pending(self) -> Iterator[Tuple[int, float]]:
+        start, self.flushed = self.flushed, len(self.values)
+        return zip(self.steps[start:], self.values[start:])
+
+
+def _append(items: Union[array, List], item: Any) -> Union[array, List]:
+    """Appends to a typed array, or to a list with its items if it cannot hold `item`. Returns the container"""
+    if isinstance(items, array):
+        try:
+            items.append(item)
+            return items
+        except (TypeError, OverflowError):
+            items = items.tolist()
+    items.append(item)
+    return items
+
+
+def _to_numpy(items: Union[array, List], dtype) -> "np.ndarray":
+    if isinstance(items, array):
+        # a copy - a view would prevent appending to the array while it exists
+        return np.frombuffer(items, dtype=dtype).copy()
+    converted = np.array(items)
+    if converted.dtype.kind in "biuf":
+        return converted
+    return np.array(items, dtype=object)  # not numbers - not converted to strings
 
 
 class Scenario(Configurable, metaclass=RegisteredAbstractMeta, is_registry=True):
+    reusable = False
+    """
+    Can one instance process multiple runs, one after another? If so, a worker in warm mode keeps
+    set up instances between runs of the same task. Run-independent state created in `setup()` is then
+    shared between runs - `single_run()` must not modify it.
+    """
+
+    metrics_flush_every = 1000
+    metrics_flush_interval = 10.0
+    """
+    When running with sacred, logged metrics are buffered and forwarded to it in batches - once
+    `metrics_flush_every` values are pending, or `metrics_flush_interval` seconds passed since the last batch.
+    """
+
     @abc.abstractmethod
     def single_run(self, params) -> Tuple[float, Dict, Any]:
         pass
@@ -14,8 +98,24 @@ class Scenario(Configurable, metaclass=RegisteredAbstractMeta, is_registry=True)
         return {}
 
     def __init__(self):
+        self.reset_run_state()
+
+    def setup(self):
+        """
+        Expensive, run-independent preparation, e.g. loading and pre-processing the dataset.
+
+        Called by the worker once per instance, before the first run. Does nothing by default.
+        """
+        pass
+
+    def reset_run_state(self):
+        """Clears state specific to a single run, called before reusing the instance for another run"""
         self._run = None
-        self._metrics = defaultdict(dict)
+        self._metrics = defaultdict(MetricBuffer)
+        self._pending_metrics = 0
+        self._last_flush = time.monotonic()
+        self._pruner = None
+        self._stop_requested = False
         self.info = dict()  # logged. Store all diagnostic info here
 
     def log_scalar(self, name: str, value: float, step: Optional[int] = None):
@@ -23,19 +123,63 @@ class Scenario(Configurable, metaclass=RegisteredAbstractMeta, is_registry=True)
         Store a single value of metric named `name`, at step `step` (or
         auto-increment).
 
-        If running with sacred, use Metrics API - `log_scalar`.
-        Otherwise log within the class, in `self._metrics`.
+        Values are stored within the class, in `self._metrics`. If running with sacred,
+        they are also forwarded to its Metrics API - in batches, see `metrics_flush_every`.
+        Integral float steps (e.g. 3.0) are stored as ints; other steps and values are stored as given.
+        """
+        step = self._metrics[name].append(value, step)
+        if self._pruner is not None and name == self._pruner.metric:
+            self._check_early_stopping(step, value)
+        if self._run:
+            self._pending_metrics += 1
+            if (
+                self._pending_metrics >= self.metrics_flush_every
+                or time.monotonic() - self._last_flush >= self.metrics_flush_interval
+            ):
+                self.flush_metrics()
+
+    def flush_metrics(self):
+        """
+        Forwards buffered metric values to sacred. Their timestamps in sacred will be those of the flush.
+        Called by the worker at the end of each run.
         """
         if self._run:
-            self._run.log_scalar(name, value, step)
+            for name, buffer in self._metrics.items():
+                for step, value in buffer.take_pending():
+                    self._run.log_scalar(name, value, step)
+        self._pending_metrics = 0
+        self._last_flush = time.monotonic()
+
+    def set_pruner(self, pruner: "ASHAPruner"):
+        """Enables early stopping of the current run, based on metrics it logs. Set by the worker"""
+        self._pruner = pruner
+
+    def should_stop(self) -> bool:
+        """
+        Should the current run stop early? Checked by the scenario, e.g. after each epoch - if True,
+        it should finish the run, returning results so far.
+
+        Always False, unless early stopping is configured for the task. See `early_stopping.ASHAPruner`.
+        """
+        return self._stop_requested
+
+    def _check_early_stopping(self, step: int, value: float):
+        if self._stop_requested or not self._pruner.report(step, value):
             return
-        metric_dict = self._metrics[name]
-        if step is None:
-            if len(metric_dict.keys()) == 0:
-                step = 0
-            else:
-                step = max(metric_dict.keys()) + 1
-        metric_dict[step] = value
+        self._stop_requested = True
+        self.info["early_stopping"] = {
+            "stopped": True,
+            "metric": self._pruner.metric,
+            "step": step,
+            "value": value,
+        }
+
+    def get_metric(self, name: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Returns arrays of steps and values of a metric logged during the current run. Requires NumPy"""
+        if np is None:
+            raise ModuleNotFoundError("NumPy is required to read metrics as arrays")
+        buffer = self._metrics[name]
+        return _to_numpy(buffer.steps, np.int64), _to_numpy(buffer.values, np.float64)
 
     def setup_sacred(self, run):
         self._run = run
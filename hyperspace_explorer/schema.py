@@ -0,0 +1,99 @@
+import datetime
+import threading
+from dataclasses import dataclass, field
+from typing import *
+from pymongo.database import Database
+
+SCHEMA_COLLECTION = "hyperspace_explorer_schema"
+
+
+@dataclass
+class IndexSpec:
+    collection: str
+    keys: List[Tuple[str, int]]
+    options: Dict = field(default_factory=dict)
+
+
+# components already checked in this process: (client id, db name, component)
+_checked: Set[Tuple[int, str, str]] = set()
+_lock = threading.Lock()
+
+
+def ensure_schema(
+    db: Database,
+    component: str,
+    version: int,
+    indexes: List[IndexSpec],
+    force: bool = False,
+) -> bool:
+    """
+    Creates indexes of a component (e.g. results, queue), unless the version recorded in the database
+    is already current. Checked at most once per process, unless `force` is given.
+
+    :param db: database to set up
+    :param component: name of the set of indexes, versioned separately
+    :param version: version of `indexes` - increase it when changing them
+    :param indexes: indexes the component needs
+    :param force: create indexes even if the recorded version is current
+    :return: whether indexes were created
+    """
+    key = (id(db.client), db.name, component)
+    with _lock:
+        if key in _checked and not force:
+            return False
+    recorded = db[SCHEMA_COLLECTION].find_one({"_id": component}) or {}
+    created = False
+    if force or recorded.get("version", 0) < version:
+        for spec in indexes:
+            db[spec.collection].create_index(spec.keys, **spec.options)
+        db[SCHEMA_COLLECTION].update_one(
+            {"_id": component},
+            {
+                "$set": {
+                    "version": version,
+                    "time_updated": datetime.datetime.utcnow(),
+                }
+            },
+            upsert=True,
+        )
+        created = True
+    with _lock:
+        _checked.add(key)
+    return created
+
+
+def schema_versions(db: Database) -> Dict[str, int]:
+    """Versions of all components recorded in the database"""
+    return {d["_id"]: d["version"] for d in db[SCHEMA_COLLECTION].find()}
+
+
+def explain_stats(explain_output: Dict) -> Dict:
+    """
+    Summarizes output of `Cursor.explain()`
+
+    :return: dict with keys: indexes (names of indexes used), collection_scan (bool),
+        keys_examined, docs_examined, returned
+    """
+    plan = explain_output.get("queryPlanner", {}).get("winningPlan", {})
+    stages = list(_plan_stages(plan))
+    indexes = {s["indexName"] for s in stages if "indexName" in s}
+    stats = explain_output.get("executionStats", {})
+    return {
+        "indexes": sorted(indexes),
+        "collection_scan": any(s["stage"] == "COLLSCAN" for s in stages),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+    }
+
+
+def _plan_stages(node: Any) -> Iterator[Dict]:
+    """All stages of a query plan, in any nested structure"""
+    if isinstance(node, dict):
+        if "stage" in node:
+            yield node
+        for v in node.values():
+            yield from _plan_stages(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from _plan_stages(v)
@@ -0,0 +1,351 @@
+import abc
+import itertools
+import math
+from dataclasses import dataclass
+from typing import *
+from .configurables import CLASS_NAME_FIELD, merge_config
+from .utils import flatten, unflatten
+
+try:
+    import numpy as np
+except ModuleNotFoundError as ex:
+    raise ModuleNotFoundError(
+        "NumPy module missing, needed by search spaces and sweeps. Install it, or install "
+        "hyperspace_explorer[search] extra dependency"
+    ) from ex
+
+SPACE_TYPE_FIELD = "type"
+
+
+class Dimension(abc.ABC):
+    """
+    One searched parameter. Values are encoded as floats: in [0, 1] for numeric dimensions
+    (linearly, or in log scale), as choice indices for categorical ones.
+    """
+
+    categorical = False
+
+    @abc.abstractmethod
+    def encode(self, values: Sequence) -> "np.ndarray":
+        """Encodes values, NaN for values outside of the dimension"""
+        pass
+
+    @abc.abstractmethod
+    def decode(self, encoded: "np.ndarray") -> List:
+        pass
+
+    @abc.abstractmethod
+    def sample(self, rng: "np.random.Generator", n: int) -> "np.ndarray":
+        """`n` encoded values, drawn uniformly"""
+        pass
+
+    def from_unit(self, u: "np.ndarray") -> List:
+        """Values for points of [0, 1], spread uniformly over the dimension"""
+        return self.decode(u)
+
+    def grid(self, n: int) -> List:
+        """Up to `n` values, evenly spread over the dimension"""
+        return self.from_unit(np.linspace(0, 1, n))
+
+
+@dataclass
+class Real(Dimension):
+    low: float
+    high: float
+    log: bool = False
+
+    def _scale(self, x):
+        return np.log(x) if self.log else x
+
+    def encode(self, values: Sequence) -> "np.ndarray":
+        x = np.array([_number_or_nan(v) for v in values], dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            low, high = self._scale(self.low), self._scale(self.high)
+            u = (self._scale(x) - low) / (high - low)
+        u[(u < 0) | (u > 1)] = np.nan
+        return u
+
+    def decode(self, encoded: "np.ndarray") -> List:
+        u = np.clip(encoded, 0, 1)
+        low, high = self._scale(self.low), self._scale(self.high)
+        x = low + u * (high - low)
+        return (np.exp(x) if self.log else x).tolist()
+
+    def sample(self, rng: "np.random.Generator", n: int) -> "np.ndarray":
+        return rng.random(n)
+
+
+@dataclass
+class Integer(Real):
+    def decode(self, encoded: "np.ndarray") -> List:
+        x = np.rint(super().decode(encoded)).astype(int)
+        return np.clip(x, self.low, self.high).tolist()
+
+    def from_unit(self, u: "np.ndarray") -> List:
+        if self.log:
+            return self.decode(u)
+        # equal-width bins, one per integer
+        x = self.low + np.floor(u * (self.high - self.low + 1)).astype(int)
+        return np.clip(x, self.low, self.high).tolist()
+
+    def grid(self, n: int) -> List:
+        return list(dict.fromkeys(super().grid(n)))
+
+
+@dataclass
+class Categorical(Dimension):
+    choices: List
+    categorical = True
+
+    def encode(self, values: Sequence) -> "np.ndarray":
+        index = {_hashable(c): i for i, c in enumerate(self.choices)}
+        return np.array([index.get(_hashable(v), np.nan) for v in values], dtype=float)
+
+    def decode(self, encoded: "np.ndarray") -> List:
+        return [self.choices[int(i)] for i in encoded]
+
+    def sample(self, rng: "np.random.Generator", n: int) -> "np.ndarray":
+        return rng.integers(len(self.choices), size=n).astype(float)
+
+    def from_unit(self, u: "np.ndarray") -> List:
+        k = len(self.choices)
+        return self.decode(np.minimum(np.floor(u * k), k - 1))
+
+    def grid(self, n: int) -> List:
+        return list(self.choices)
+
+
+class Conditional:
+    """
+    Choice of a Configurable subclass (`className`), with other searched params depending on the choice,
+    e.g. `Conditional({"CombustionEngine": {"displacement_liters": Real(1, 3)}, "ElectricMotor": {}})`.
+    Only for sweeps - it cannot be encoded for the optimizer.
+    """
+
+    def __init__(self, branches: Dict[str, Dict[str, "Axis"]]):
+        self.branches = branches
+        self.unit_size = 1 + sum(_unit_size(b) for b in branches.values())
+
+    def from_unit(self, u: "np.ndarray") -> List[Dict]:
+        """Flat fragments of configs for points of the unit cube, `u` of shape (n, unit_size)"""
+        names = list(self.branches)
+        chosen = np.minimum(np.floor(u[:, 0] * len(names)), len(names) - 1)
+        fragments = [None] * len(u)
+        offset = 1
+        for i, name in enumerate(names):
+            axes = self.branches[name]
+            size = _unit_size(axes)
+            rows = np.flatnonzero(chosen == i)
+            branch = _from_unit(axes, u[rows, offset : offset + size])
+            for row, fragment in zip(rows, branch):
+                fragments[row] = {CLASS_NAME_FIELD: name, **fragment}
+            offset += size
+        return fragments
+
+    def grid(self, n: int) -> List[Dict]:
+        return [
+            {CLASS_NAME_FIELD: name, **fragment}
+            for name, axes in self.branches.items()
+            for fragment in _grid(axes, n)
+        ]
+
+
+Axis = Union[Dimension, Conditional]
+
+
+DIMENSION_TYPES = {"real": Real, "int": Integer, "categorical": Categorical}
+CONDITIONAL_TYPE = "conditional"
+
+
+class Space:
+    """
+    Searched part of a config: dimensions keyed with flattened config keys, e.g. 'model.lr'.
+    Configs are encoded as rows of a float array, one column per dimension.
+    """
+
+    def __init__(self, dimensions: Dict[str, Dimension]):
+        self.dimensions = dimensions
+        self.keys = list(dimensions.keys())
+        self.categorical = np.array(
+            [d.categorical for d in dimensions.values()], dtype=bool
+        )
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Dict]) -> "Space":
+        """
+        Creates a space from a dict like
+        `{"model.lr": {"type": "real", "low": 1e-4, "high": 0.1, "log": true},
+        "model.layers": {"type": "int", "low": 1, "high": 8},
+        "optimizer.name": {"type": "categorical", "choices": ["adam", "sgd"]}}`
+        """
+        dimensions = _axes_from_config(config)
+        conditional = [k for k, d in dimensions.items() if isinstance(d, Conditional)]
+        if conditional:
+            raise ValueError(f"Conditional params not supported here: {conditional}")
+        return cls(dimensions)
+
+    def encode(self, configs: Sequence[Dict]) -> "np.ndarray":
+        """
+        :param configs: nested configs
+        :return: array of shape (len(configs), len(keys)), NaN where a value is missing or out of the space
+        """
+        flat = [flatten(c) for c in configs]
+        columns = [
+            dim.encode([f.get(key) for f in flat])
+            for key, dim in self.dimensions.items()
+        ]
+        return np.stack(columns, axis=1) if columns else np.empty((len(flat), 0))
+
+    def decode(self, encoded: "np.ndarray") -> List[Dict]:
+        """Nested configs, with only the searched params"""
+        columns = [
+            dim.decode(encoded[:, i]) for i, dim in enumerate(self.dimensions.values())
+        ]
+        return [unflatten(dict(zip(self.keys, row))) for row in zip(*columns)]
+
+    def sample(self, rng: "np.random.Generator", n: int) -> "np.ndarray":
+        """`n` encoded configs, drawn uniformly"""
+        columns = [dim.sample(rng, n) for dim in self.dimensions.values()]
+        return np.stack(columns, axis=1) if columns else np.empty((n, 0))
+
+
+class Sweep:
+    """
+    Lazily generated configs: a base config, with searched params (axes) set to points of a grid,
+    or sampled at random or from a low-discrepancy (Halton) sequence.
+
+    Axes are keyed with flattened config keys, e.g. 'model.lr', or keys of Configurable components
+    for `Conditional` axes. Generated configs share unchanged parts with the base config (and each other),
+    so they must not be modified in place. E.g. `queue.submit_grid(task_name, sweep.halton(1000))`
+    """
+
+    def __init__(self, base: Dict, axes: Dict[str, Axis]):
+        self.base = base
+        self.axes = axes
+        self.unit_size = _unit_size(axes)
+
+    @classmethod
+    def from_config(cls, base: Dict, config: Dict[str, Dict]) -> "Sweep":
+        """
+        Creates a sweep with axes described like in `Space.from_config()`, plus conditional ones, e.g.
+        `{"Engine": {"type": "conditional", "branches": {"CombustionEngine": {"displacement_liters":
+        {"type": "real", "low": 1, "high": 3}}, "ElectricMotor": {}}}}`
+        """
+        return cls(base, _axes_from_config(config))
+
+    def grid(self, points_per_axis: int = 5) -> Iterator[Dict]:
+        """Cartesian product of values of all axes - all choices, up to `points_per_axis` numeric values"""
+        for fragment in _grid(self.axes, points_per_axis):
+            yield self._config(fragment)
+
+    def random(
+        self, n: int, seed: Optional[int] = None, chunk_size: int = 1024
+    ) -> Iterator[Dict]:
+        """`n` configs drawn uniformly at random"""
+        rng = np.random.default_rng(seed)
+        for start in range(0, n, chunk_size):
+            size = min(chunk_size, n - start)
+            yield from self._configs(rng.random((size, self.unit_size)))
+
+    def halton(self, n: int, skip: int = 0, chunk_size: int = 1024) -> Iterator[Dict]:
+        """
+        `n` configs from the Halton sequence - covering the space more evenly than random ones.
+
+        :param skip: start at this point of the sequence, e.g. to continue an earlier sweep
+        """
+        for start in range(skip, skip + n, chunk_size):
+            indices = np.arange(start, min(start + chunk_size, skip + n))
+            yield from self._configs(halton_points(indices + 1, self.unit_size))
+
+    def _configs(self, u: "np.ndarray") -> Iterator[Dict]:
+        for fragment in _from_unit(self.axes, u):
+            yield self._config(fragment)
+
+    def _config(self, fragment: Dict) -> Dict:
+        return merge_config(self.base, unflatten(fragment))
+
+
+def halton_points(indices: "np.ndarray", dims: int) -> "np.ndarray":
+    """Points of the Halton sequence at `indices`, shape (len(indices), dims)"""
+    points = np.zeros((len(indices), dims))
+    for d, base in enumerate(_primes(dims)):
+        i = np.array(indices, dtype=np.int64)
+        scale = 1.0
+        while np.any(i > 0):
+            scale /= base
+            points[:, d] += scale * (i % base)
+            i //= base
+    return points
+
+
+def _primes(n: int) -> List[int]:
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def _axes_from_config(config: Dict[str, Dict]) -> Dict[str, Axis]:
+    axes = {}
+    for key, spec in config.items():
+        spec = dict(spec)
+        kind = spec.pop(SPACE_TYPE_FIELD)
+        if kind == CONDITIONAL_TYPE:
+            branches = spec["branches"]
+            axes[key] = Conditional(
+                {name: _axes_from_config(b) for name, b in branches.items()}
+            )
+        else:
+            axes[key] = DIMENSION_TYPES[kind](**spec)
+    return axes
+
+
+def _unit_size(axes: Dict[str, Axis]) -> int:
+    return sum(getattr(a, "unit_size", 1) for a in axes.values())
+
+
+def _from_unit(axes: Dict[str, Axis], u: "np.ndarray") -> List[Dict]:
+    """Flat config fragments for points of the unit cube, one column (or more, if conditional) per axis"""
+    fragments = [{} for _ in range(len(u))]
+    offset = 0
+    for key, axis in axes.items():
+        if isinstance(axis, Conditional):
+            values = axis.from_unit(u[:, offset : offset + axis.unit_size])
+            for fragment, value in zip(fragments, values):
+                fragment.update((f"{key}.{k}", v) for k, v in value.items())
+            offset += axis.unit_size
+        else:
+            for fragment, value in zip(fragments, axis.from_unit(u[:, offset])):
+                fragment[key] = value
+            offset += 1
+    return fragments
+
+
+def _grid(axes: Dict[str, Axis], n: int) -> Iterator[Dict]:
+    """Flat config fragments of the Cartesian product of axes"""
+    per_axis = []
+    for key, axis in axes.items():
+        if isinstance(axis, Conditional):
+            per_axis.append(
+                [{f"{key}.{k}": v for k, v in f.items()} for f in axis.grid(n)]
+            )
+        else:
+            per_axis.append([{key: v} for v in axis.grid(n)])
+    for combination in itertools.product(*per_axis):
+        fragment = {}
+        for part in combination:
+            fragment.update(part)
+        yield fragment
+
+
+def _number_or_nan(v: Any) -> float:
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return float(v)
+    return math.nan
+
+
+def _hashable(v: Any) -> Any:
+    return tuple(v) if isinstance(v, list) else v
@@ -0,0 +1,216 @@
+import abc
+import argparse
+import collections
+import datetime
+import json
+import os
+import socket
+import time
+import traceback
+from pathlib import Path
+from typing import *
+from .connections import get_client
+from .results import MONGO_URI_DEFAULT
+
+TIMINGS_COLLECTION = "timings"
+
+# records of the worker loop cover all of its time, records of runs - the phases of executing them
+KIND_LOOP = "loop"
+KIND_RUN = "run"
+IDLE_PHASE = "idle"
+RUN_PHASE = "run"
+
+
+class TimingSink(abc.ABC):
+    """Destination of timing records"""
+
+    @abc.abstractmethod
+    def write(self, record: Dict):
+        pass
+
+
+class JsonlSink(TimingSink):
+    """Appends records to a local file, one JSON object per line. Safe to share between processes"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def write(self, record: Dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self.path.open("a") as f:
+            f.write(line)
+
+
+class MongoSink(TimingSink):
+    """Inserts records into the `timings` collection of a study"""
+
+    def __init__(self, mongo_uri: str, db_name: str):
+        self.mongo_uri = mongo_uri
+        self.db_name = db_name
+
+    def write(self, record: Dict):
+        get_client(self.mongo_uri)[self.db_name][TIMINGS_COLLECTION].insert_one(record)
+
+
+class PhaseTimer:
+    """
+    Measures consecutive phases of the worker's work: each `lap(phase)` adds the time since the previous one
+    (or since `start()`) to the phase. `emit()` writes the phases as one record to all sinks, and starts
+    measuring again. Without sinks, only measures.
+    """
+
+    def __init__(self, sinks: Sequence[TimingSink] = (), kind: str = KIND_RUN):
+        self.sinks = list(sinks)
+        self.kind = kind
+        self.start()
+
+    def start(self):
+        self.phases: Dict[str, float] = collections.defaultdict(float)
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str) -> float:
+        """Adds the time since the previous lap to `phase`, returns it"""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.phases[phase] += elapsed
+        self._last = now
+        return elapsed
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def emit(self, **fields):
+        """
+        Writes a record with the phases measured so far, and other `fields` (e.g. task_name), then starts
+        measuring again. Errors of sinks are printed, not raised - timing must not stop the worker.
+        """
+        if self.sinks and self.phases:
+            record = {
+                "time": datetime.datetime.utcnow(),
+                "worker": f"{socket.gethostname()}:{os.getpid()}",
+                "kind": self.kind,
+                **fields,
+                "phases": dict(self.phases),
+            }
+            for sink in self.sinks:
+                try:
+                    sink.write(record)
+                except Exception as ex:
+                    traceback.print_exception(type(ex), ex, ex.__traceback__)
+        self.start()
+
+
+def read_jsonl(paths: Iterable[Union[str, Path]]) -> Iterator[Dict]:
+    for path in paths:
+        with Path(path).open() as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_mongo(
+    mongo_uri: str, db_name: str, since: Optional[datetime.datetime] = None
+) -> Iterator[Dict]:
+    query = {} if since is None else {"time": {"$gte": since}}
+    return get_client(mongo_uri)[db_name][TIMINGS_COLLECTION].find(query, {"_id": 0})
+
+
+def summarize(records: Iterable[Dict]) -> Dict:
+    """
+    Aggregates timing records.
+
+    :return: dict with keys:
+        tasks - per task name: number of runs, total time of each phase, and `overhead_ratio` - time of
+            phases other than `run`, relative to `run`;
+        workers - per worker (with records of the loop): total time, idle time and `idle_fraction`;
+        idle_fraction - of all workers together
+    """
+    tasks = collections.defaultdict(
+        lambda: {"runs": 0, "phases": collections.defaultdict(float)}
+    )
+    workers = collections.defaultdict(lambda: {"total": 0.0, "idle": 0.0})
+    for r in records:
+        phases = r.get("phases", {})
+        if r.get("kind") == KIND_LOOP:
+            w = workers[r["worker"]]
+            w["total"] += sum(phases.values())
+            w["idle"] += phases.get(IDLE_PHASE, 0.0)
+        else:
+            t = tasks[r.get("task_name")]
+            t["runs"] += 1
+            for phase, seconds in phases.items():
+                t["phases"][phase] += seconds
+    for t in tasks.values():
+        t["phases"] = dict(t["phases"])
+        run = t["phases"].get(RUN_PHASE, 0.0)
+        overhead = sum(t["phases"].values()) - run
+        t["overhead_ratio"] = overhead / run if run > 0 else None
+    for w in workers.values():
+        w["idle_fraction"] = w["idle"] / w["total"] if w["total"] > 0 else None
+    total = sum(w["total"] for w in workers.values())
+    idle = sum(w["idle"] for w in workers.values())
+    return {
+        "tasks": dict(tasks),
+        "workers": dict(workers),
+        "idle_fraction": idle / total if total > 0 else None,
+    }
+
+
+def format_summary(summary: Dict) -> str:
+    lines = []
+    for name, t in sorted(summary["tasks"].items(), key=lambda kv: str(kv[0])):
+        ratio = t["overhead_ratio"]
+        ratio = "n/a" if ratio is None else f"{ratio:.1%}"
+        lines.append(f"Task {name}: {t['runs']} runs, overhead {ratio} of run time")
+        for phase, seconds in sorted(t["phases"].items(), key=lambda kv: -kv[1]):
+            lines.append(
+                f"    {phase:<22}{seconds:>12.2f}s {seconds / t['runs']:>10.3f}s/run"
+            )
+    for name, w in sorted(summary["workers"].items()):
+        fraction = w["idle_fraction"]
+        fraction = "n/a" if fraction is None else f"{fraction:.1%}"
+        lines.append(f"Worker {name}: {w['total']:.0f}s in total, idle {fraction}")
+    if summary["idle_fraction"] is not None:
+        lines.append(f"All workers: idle {summary['idle_fraction']:.1%} of the time")
+    return "\n".join(lines)
+
+
+def main():
+    desc = (
+        "Summarize worker timings: per task, the time of each phase of runs and the overhead ratio - "
+        "time outside of the scenario's `single_run`, relative to it; per worker - the idle fraction. "
+        "Reads records from JSONL files, or from MongoDB"
+    )
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("files", help="JSONL files written by workers", nargs="*")
+    parser.add_argument("--db-name", help="MongoDB database name, to read records from")
+    parser.add_argument(
+        "--mongo-uri",
+        help="URI of the MongoDB server instance",
+        default=MONGO_URI_DEFAULT,
+    )
+    parser.add_argument(
+        "--hours", help="Only records from the last N hours", type=float, default=None
+    )
+    args = parser.parse_args()
+    if not args.files and args.db_name is None:
+        parser.error("give JSONL files, or --db-name")
+    since = None
+    if args.hours is not None:
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=args.hours)
+    if args.db_name is not None:
+        records = read_mongo(args.mongo_uri, args.db_name, since)
+    else:
+        records = read_jsonl(args.files)
+        if since is not None:
+            records = (
+                r
+                for r in records
+                if datetime.datetime.fromisoformat(r["time"]) >= since
+            )
+    print(format_summary(summarize(records)))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,11 @@ try:
 except ModuleNotFoundError:
     pd = None
 
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
 
 def flatten(nested: Dict) -> Dict:
     """
@@ -17,14 +22,34 @@ def flatten(nested: Dict) -> Dict:
     :return: flat dictionary
     """
     flat = {}
+    _flatten_into(nested, "", flat)
+    return flat
+
+
+def _flatten_into(nested: Dict, prefix: str, flat: Dict):
     for k, v in nested.items():
-        if isinstance(v, Dict):
-            for inner_k, inner_v in flatten(v).items():
-                full_key = ".".join([k, inner_k])
-                flat[full_key] = inner_v
+        if isinstance(v, dict):
+            _flatten_into(v, f"{prefix}{k}.", flat)
         else:
-            flat[k] = v
-    return flat
+            flat[f"{prefix}{k}"] = v
+
+
+def unflatten(flat: Dict, sep: str = ".") -> Dict:
+    """
+    Inverse of `flatten()` - nests values of dot-separated keys in dicts.
+
+    :param flat: flat dictionary
+    :param sep: separator character
+    :return: nested dictionary
+    """
+    nested = {}
+    for k, v in flat.items():
+        *outer, last = k.split(sep)
+        inner = nested
+        for part in outer:
+            inner = inner.setdefault(part, {})
+        inner[last] = v
+    return nested
 
 
 def unique_suffixes(keys: List[str], sep: str = ".") -> Dict[str, str]:
@@ -38,27 +63,41 @@ def unique_suffixes(keys: List[str], sep: str = ".") -> Dict[str, str]:
     :param sep: separator character
     :return: dictionary mapping original keys to shortened ones
     """
-    mapping = {k: k.split(sep)[-1] for k in keys}
-    parts_counts = {k: 1 for k in mapping.keys()}
-    suf_counter = cc.Counter(mapping.values())
-    while set(suf_counter.values()) != {1}:
-        duplicated = {k for k, v in suf_counter.items() if v > 1}
-        for k, v in mapping.items():
-            if v in duplicated:
-                parts_counts[k] += 1
-                mapping[k] = sep.join(k.split(sep)[-parts_counts[k] :])
-        suf_counter = cc.Counter(mapping.values())
+    parts = {k: k.split(sep) for k in keys}
+    depth = dict.fromkeys(keys, 1)
+    mapping = {k: p[-1] for k, p in parts.items()}
+    groups = cc.defaultdict(list)
+    for k, v in mapping.items():
+        groups[v].append(k)
+    duplicated = [ks for ks in groups.values() if len(ks) > 1]
+    # in each round, only keys with a duplicated suffix get a longer one
+    while duplicated:
+        extended = [k for ks in duplicated for k in ks]
+        for ks in duplicated:
+            del groups[mapping[ks[0]]]
+        for k in extended:
+            depth[k] += 1
+            mapping[k] = sep.join(parts[k][-depth[k] :])
+            groups[mapping[k]].append(k)
+        duplicated = [
+            groups[v] for v in {mapping[k] for k in extended} if len(groups[v]) > 1
+        ]
     return mapping
 
 
+def check_analysis_extra():
+    """Raises ModuleNotFoundError if Pandas is not installed"""
+    if pd is None:
+        raise ModuleNotFoundError(
+            "Pandas module missing. Install it, or install "
+            "hyperspace_explorer[analysis] extra dependency"
+        )
+
+
 def requires_analysis_extra(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        if pd is None:
-            raise ModuleNotFoundError(
-                "Pandas module missing. Install it, or install "
-                "hyperspace_explorer[analysis] extra dependency"
-            )
+        check_analysis_extra()
         return func(*args, **kwargs)
 
     return wrapper
@@ -66,10 +105,30 @@ def requires_analysis_extra(func):
 
 @requires_analysis_extra
 def drop_constant_columns(df: "pd.DataFrame") -> "pd.DataFrame":
-    to_keep = [c for c in df.columns if df[c].nunique(dropna=False) > 1]
-    return df[to_keep]
+    if len(df) == 0:
+        return df[[]]
+    # numeric columns compared with their first row all at once, others one by one
+    numeric = df.select_dtypes(include="number")
+    first = numeric.iloc[0]
+    differs = numeric.ne(first) & ~(numeric.isna() & first.isna())
+    varying = set(numeric.columns[differs.any().to_numpy()])
+    others = df.columns.difference(numeric.columns, sort=False)
+    varying.update(c for c in others if df[c].nunique(dropna=False) > 1)
+    return df[[c for c in df.columns if c in varying]]
 
 
 @requires_analysis_extra
 def lists_to_tuples(df: "pd.DataFrame") -> "pd.DataFrame":
-    return df.applymap(lambda x: x if not isinstance(x, list) else tuple(x))
+    """Replaces lists in cells with tuples, e.g. to make them hashable. Only object columns can hold lists"""
+    converted = {}
+    for c in df.columns[(df.dtypes == object).to_numpy()]:
+        column = df[c]
+        if any(isinstance(x, list) for x in column):
+            values = [tuple(x) if isinstance(x, list) else x for x in column]
+            converted[c] = pd.Series(values, index=column.index, dtype=object)
+    if not converted:
+        return df
+    df = df.copy()
+    for c, values in converted.items():
+        df[c] = values
+    return df
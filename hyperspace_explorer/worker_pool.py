@@ -0,0 +1,364 @@
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import *
+from multiprocessing.connection import Connection
+from .queue import RunQueue, QueuedRun, LeaseHeartbeat, Resources
+
+THREAD_COUNT_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+]
+
+STATUS_TIMEOUT = "TIMEOUT"
+STATUS_OUT_OF_MEMORY = "OUT_OF_MEMORY"
+STATUS_FAILED = "FAILED"
+
+# memory used by runs is read from here - there is no portable source of resident memory of a process tree
+PROC_DIR = Path("/proc")
+
+RunnerFactory = Callable[..., Callable[[QueuedRun], Any]]
+KilledRunCallback = Callable[[QueuedRun, Optional[Any], str, str], Any]
+
+
+def set_thread_count(n: int):
+    """
+    Limits thread pools of common numerical libraries. Only effective if called before they are imported.
+    """
+    for var in THREAD_COUNT_ENV_VARS:
+        os.environ[var] = str(n)
+
+
+def split_cpus(slots: int) -> List[List[int]]:
+    """Splits CPUs available to this process into `slots` disjoint, equal groups"""
+    if not hasattr(os, "sched_getaffinity"):
+        raise ValueError("CPU affinity is not supported on this platform")
+    cpus = sorted(os.sched_getaffinity(0))
+    per_slot = len(cpus) // slots
+    if per_slot == 0:
+        raise ValueError(f"Cannot split {len(cpus)} CPUs into {slots} slots")
+    return [cpus[i * per_slot : (i + 1) * per_slot] for i in range(slots)]
+
+
+def process_tree_rss_mb(pid: int) -> float:
+    """Resident memory of a process and all its descendants, in MB. Linux only"""
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        p = pending.pop()
+        try:
+            status = (PROC_DIR / str(p) / "status").read_text()
+            for tid_dir in (PROC_DIR / str(p) / "task").iterdir():
+                pending.extend(
+                    int(c) for c in (tid_dir / "children").read_text().split()
+                )
+        except (FileNotFoundError, ProcessLookupError):
+            continue  # already finished
+        for line in status.splitlines():
+            if line.startswith("VmRSS:"):
+                total_kb += int(line.split()[1])
+    return total_kb / 1024
+
+
+@dataclass
+class RunLimits:
+    max_rss_mb: Optional[float] = None
+    timeout: Optional[float] = None
+
+    def __post_init__(self):
+        if self.max_rss_mb is not None and not (PROC_DIR / "self" / "status").exists():
+            raise ValueError(
+                f"Memory of runs cannot be limited on this platform - {PROC_DIR} is not available"
+            )
+
+
+def _isolated_main(runner_factory: RunnerFactory, task: QueuedRun, conn):
+    os.setsid()  # own process group, to kill processes started by the run together with it
+    try:
+        run = runner_factory(on_start=conn.send)
+        run(task)
+    except Exception as ex:
+        traceback.print_exception(type(ex), ex, ex.__traceback__)
+
+
+class IsolatedRunner:
+    """
+    Executes each run in a fresh, forked child process - memory leaked by a run is freed when it ends.
+
+    The child runs a callable created by `runner_factory(on_start=...)`, which should call `on_start` with
+    the id of the run in the database, as soon as it is known. If the child (together with processes it
+    started) exceeds `limits`, it is killed - and `on_killed(task, run_id, status, message)` is called,
+    with status `TIMEOUT` or `OUT_OF_MEMORY`. Also called with status `FAILED` if the child dies on its own.
+
+    The child is forked while the run is in progress - so its lease must not be renewed by a thread, which
+    could hold a lock inherited by the child. Pass a `LeaseHeartbeat` to renew it while polling the child,
+    instead of entering it.
+    """
+
+    def __init__(
+        self,
+        runner_factory: RunnerFactory,
+        limits: RunLimits,
+        on_killed: KilledRunCallback,
+        poll_interval: float = 1,
+    ):
+        self.runner_factory = runner_factory
+        self.limits = limits
+        self.on_killed = on_killed
+        self.poll_interval = poll_interval
+        self.ctx = multiprocessing.get_context("fork")
+
+    def __call__(self, task: QueuedRun, heartbeat: Optional[LeaseHeartbeat] = None):
+        receiver, sender = self.ctx.Pipe(duplex=False)
+        process = self.ctx.Process(
+            target=_isolated_main, args=(self.runner_factory, task, sender)
+        )
+        start = time.monotonic()
+        process.start()
+        sender.close()
+        run_id = None
+        status, message = None, ""
+        try:
+            while process.exitcode is None:
+                process.join(self.poll_interval)
+                run_id = self._receive_run_id(receiver, run_id)
+                if heartbeat is not None:
+                    heartbeat.renew_if_due()
+                if process.exitcode is not None:
+                    break
+                status, message = self._check_limits(process.pid, start)
+                if status is not None:
+                    break
+        finally:
+            if process.exitcode is None:
+                self._kill(process)
+        run_id = self._receive_run_id(receiver, run_id)
+        if status is None and process.exitcode != 0:
+            status = STATUS_FAILED
+            message = f"Run process died with exit code {process.exitcode}"
+        if status is not None:
+            print(f"Run {task.id} ({task.task_name}): {message}")
+            self.on_killed(task, run_id, status, message)
+
+    @staticmethod
+    def _receive_run_id(receiver: Connection, run_id: Optional[Any]) -> Optional[Any]:
+        try:
+            while run_id is None and receiver.poll():
+                run_id = receiver.recv()
+        except EOFError:  # the child ended without sending it
+            pass
+        return run_id
+
+    @staticmethod
+    def _kill(process: multiprocessing.Process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:  # the child did not create its process group yet
+            process.kill()
+        process.join()
+
+    def _check_limits(self, pid: int, start: float) -> Tuple[Optional[str], str]:
+        elapsed = time.monotonic() - start
+        if self.limits.timeout is not None and elapsed > self.limits.timeout:
+            return (
+                STATUS_TIMEOUT,
+                f"Killed after exceeding time limit of {self.limits.timeout}s",
+            )
+        if self.limits.max_rss_mb is not None:
+            rss = process_tree_rss_mb(pid)
+            if rss > self.limits.max_rss_mb:
+                return (
+                    STATUS_OUT_OF_MEMORY,
+                    f"Killed after using {rss:.0f}MB, over the limit of {self.limits.max_rss_mb}MB",
+                )
+        return None, ""
+
+
+def _slot_main(
+    conn: Connection,
+    runner_factory: RunnerFactory,
+    cpus: Optional[List[int]],
+):
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    run = runner_factory()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:  # the supervisor is gone
+            return
+        if task is None:
+            return
+        try:
+            run(task)
+        except Exception as ex:
+            traceback.print_exception(type(ex), ex, ex.__traceback__)
+        conn.send(task.id)
+
+
+class Slot:
+    """
+    A child process executing runs one by one, and the run it is currently processing. Runs are sent to
+    the child, and their ids back when done, through a pipe - no threads are started to do it
+    """
+
+    def __init__(
+        self,
+        index: int,
+        ctx,
+        runner_factory: RunnerFactory,
+        cpus: Optional[List[int]] = None,
+    ):
+        self.index = index
+        self.ctx = ctx
+        self.runner_factory = runner_factory
+        self.cpus = cpus
+        self.current: Optional[QueuedRun] = None
+        self.heartbeat: Optional[LeaseHeartbeat] = None
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_slot_main,
+            args=(child_conn, self.runner_factory, self.cpus),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()  # for `recv` to fail when the child dies
+
+    def assign(self, task: QueuedRun, q: RunQueue):
+        self.current = task
+        # renewed by the supervisor loop, see `WorkerPool`
+        self.heartbeat = LeaseHeartbeat(q, task)
+        try:
+            self.conn.send(task)
+        except OSError:
+            pass  # the child died - restarted, and the run released, by the supervisor
+
+    def finish(self) -> QueuedRun:
+        task = self.current
+        self.current = None
+        self.heartbeat = None
+        return task
+
+
+class WorkerPool:
+    """
+    Processes runs from the queue in `slots` child processes at once.
+
+    Only the supervisor (the parent process) talks to the queue: it claims runs, renews their leases
+    and removes them when done. Children just execute them, using a callable created by `runner_factory`
+    in each child. A child that dies is restarted, and its run put back in the queue.
+    If `capacity` is given, runs are only fetched if they fit in what is left of it by the runs in progress.
+
+    Children are forked, so they share everything imported by the parent, e.g. the `scenarios` module.
+    A child could inherit a lock held by another thread of the parent at the time of the fork - so
+    the supervisor starts no threads: leases are renewed from its loop, and children are talked to through
+    pipes. Only threads of MongoDB clients of the supervisor may run, and children do not use these
+    clients (see `connections`).
+    """
+
+    def __init__(
+        self,
+        q: RunQueue,
+        runner_factory: RunnerFactory,
+        slots: int,
+        cpu_affinity: bool = False,
+        sleep_time: float = 30,
+        capacity: Optional[Resources] = None,
+    ):
+        self.q = q
+        self.capacity = capacity
+        self.runner_factory = runner_factory
+        self.sleep_time = sleep_time
+        self.ctx = multiprocessing.get_context("fork")
+        cpus = split_cpus(slots) if cpu_affinity else [None] * slots
+        self.slots = [Slot(i, self.ctx, runner_factory, cpus[i]) for i in range(slots)]
+
+    def run(self):
+        try:
+            while True:
+                self.q.reclaim_expired()
+                self._restart_crashed()
+                self._fill_idle_slots()
+                busy = [s for s in self.slots if s.current is not None]
+                if not busy:
+                    self.q.wait_for_ready(self.sleep_time, self.capacity)
+                    continue
+                # with idle slots, check the queue again soon - otherwise just wait for a run to finish.
+                # Leases are renewed at least twice as often as needed
+                idle = len(busy) < len(self.slots)
+                timeout = min(
+                    self.q.backoff.next() if idle else 1, busy[0].heartbeat.interval / 2
+                )
+                self._collect_finished(timeout)
+                self._renew_leases()
+        finally:
+            self.shutdown()
+
+    def _fill_idle_slots(self):
+        for slot in self.slots:
+            if slot.current is not None:
+                continue
+            task = self.q.fetch_one(self._remaining_capacity())
+            if task is None:
+                return
+            slot.assign(task, self.q)
+
+    def _remaining_capacity(self) -> Optional[Resources]:
+        if self.capacity is None:
+            return None
+        remaining = self.capacity
+        for slot in self.slots:
+            if slot.current is not None:
+                remaining = remaining - slot.current.requirements
+        return remaining
+
+    def _collect_finished(self, timeout: float):
+        ready = multiprocessing.connection.wait([s.conn for s in self.slots], timeout)
+        for slot in self.slots:
+            if slot.conn not in ready:
+                continue
+            try:
+                run_id = slot.conn.recv()
+            except EOFError:  # the child died
+                slot.process.join()
+                continue
+            if slot.current is not None and slot.current.id == run_id:
+                task = slot.finish()
+                if not self.q.remove(task):
+                    print(f"Run {task.id} lost its lease and was left in the queue")
+
+    def _renew_leases(self):
+        for slot in self.slots:
+            if slot.current is not None:
+                slot.heartbeat.renew_if_due()
+
+    def _restart_crashed(self):
+        for slot in self.slots:
+            if slot.process.is_alive():
+                continue
+            print(
+                f"Slot {slot.index} died with exit code {slot.process.exitcode}, restarting"
+            )
+            if slot.current is not None:
+                self.q.release(slot.finish())
+            slot.conn.close()
+            slot.start()
+
+    def shutdown(self):
+        for slot in self.slots:
+            if slot.current is not None:
+                self.q.release(slot.finish())
+            if slot.process.is_alive():
+                slot.process.terminate()
+            slot.process.join()
+            slot.conn.close()
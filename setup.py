@@ -21,14 +21,19 @@ setup(name="hyperspace_explorer",
       ],
       tests_require=[
           'pytest',
+          'mongomock',
       ],
       extras_require={
           'dev': [
               'commitizen>=1.16.4',
               'pytest',
+              'mongomock',
           ],
           'analysis': [
               'pandas>=1.0.1',
           ],
+          'search': [
+              'numpy>=1.17',
+          ],
       },
       )
@@ -0,0 +1,12 @@
+import pytest
+from hyperspace_explorer import connections
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    """A mongomock client, used in place of every MongoClient the package creates"""
+    mongomock = pytest.importorskip("mongomock")
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(connections, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.setattr(connections, "_clients", {})
+    return client
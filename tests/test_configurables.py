@@ -15,11 +15,12 @@ Warning: in dataclasses, do not add default values to fields of parent classes -
 children will be required to only have default-value fields. This is a limitation of dataclasses
 themselves.
 """
+from copy import deepcopy
 from dataclasses import dataclass
 from abc import abstractmethod
 from typing import *
 from hyperspace_explorer.configurables import Configurable, ConfigurableDataclass, RegisteredAbstractMeta, factories, \
-    fill_in_defaults, update_config
+    fill_in_defaults, update_config, validate_config, merge_config
 
 
 class Vehicle(Configurable, metaclass=RegisteredAbstractMeta, is_registry=True):
@@ -124,6 +125,20 @@ class ContainerTrailer(Trailer):
         return self.height * self.length / 10  # nonsense as usual
 
 
+class Convoy(Vehicle):
+    def __init__(self, Vehicle: List[Dict], spacing_m: float, name: Optional[str] = None):
+        """Contains a list of other Configurables"""
+        self.vehicles = [factories['Vehicle'].from_config(v) for v in Vehicle]
+        self.spacing_m = spacing_m
+
+    @classmethod
+    def get_default_config(cls) -> Dict:
+        return {'spacing_m': 50.}
+
+    def get_mpge(self) -> float:
+        return min(v.get_mpge() for v in self.vehicles)
+
+
 car1 = {
     'className': 'Car',
     'Engine': {
@@ -225,3 +240,66 @@ def test_update_config_change_class():
     t1_to_combustion = {'Engine': {'className': 'CombustionEngine', 'displacement_liters': 1.5}}
     t1 = update_config(truck1, t1_to_combustion)
     assert t1['Engine'] == {'className': 'CombustionEngine', 'displacement_liters': 1.5}
+
+
+def test_merge_config_shares_unchanged():
+    original = deepcopy(car2)
+    c1 = merge_config(car2, {'num_doors': 4})
+    assert c1['num_doors'] == 4
+    assert c1['Engine'] is car2['Engine']
+    c2 = merge_config(car2, {'Engine': {'strokes_per_cycle': 4}})
+    assert c2['Engine'] is not car2['Engine']
+    assert c2 == update_config(car2, {'Engine': {'strokes_per_cycle': 4}})
+    assert car2 == original
+
+
+convoy1 = {
+    'className': 'Convoy',
+    'Vehicle': [car1, truck1],
+}
+
+
+def test_list_of_configurables():
+    filled = fill_in_defaults(convoy1, 'Vehicle')
+    assert filled['spacing_m'] == 50.
+    assert filled['Vehicle'][0]['num_doors'] == 4
+    assert filled['Vehicle'][1]['Trailer']['height'] == 3
+    assert convoy1['Vehicle'][0] == car1  # not modified
+    assert Vehicle.from_config(convoy1).get_mpge() is not None
+
+
+def test_validate_config():
+    assert validate_config(car1, 'Vehicle') == []
+    assert validate_config(fill_in_defaults(convoy1, 'Vehicle'), 'Vehicle') == []
+    assert validate_config(car1full) == []
+
+    bad = {
+        'className': 'Convoy',
+        'spacing_m': 'far',
+        'color': 'red',
+        'Vehicle': [
+            {'className': 'Car', 'Engine': {'className': 'CombustionEngine', 'displacement_liters': 2, 'strokes_per_cycle': 2.5}},
+            {'className': 'Bicycle'},
+        ],
+    }
+    assert validate_config(bad, 'Vehicle') == [
+        'color: unknown key for Convoy',
+        'Vehicle[0].Engine.strokes_per_cycle: expected int, got float',
+        'Vehicle[1]: unknown Vehicle class Bicycle',
+        'spacing_m: expected float, got str',
+    ]
+    assert validate_config({'className': 'Car'}, 'Vehicle') == ['Engine: missing value for Car']
+    trailer = {'className': 'ContainerTrailer', 'length': 'long'}
+    assert validate_config(trailer, 'Trailer') == ['length: expected float, got str']
+
+
+def test_schema_cached(caplog):
+    assert ContainerTrailer.config_schema() is ContainerTrailer.config_schema()
+    assert Trailer.config_schema() is not ContainerTrailer.config_schema()
+    defaults = ContainerTrailer.get_default_config()
+    defaults['height'] = 100.
+    assert ContainerTrailer.get_default_config()['height'] == 3.
+
+    with caplog.at_level('DEBUG', logger='hyperspace_explorer.configurables'):
+        fill_in_defaults(truck1, 'Vehicle')
+    assert 'ContainerTrailer: setting height=3.0' in caplog.messages
@@ -0,0 +1,36 @@
+import importlib
+import multiprocessing
+import os
+from hyperspace_explorer import connections
+
+URI = "mongodb://localhost:27017"
+
+
+def test_shared_client():
+    client = connections.get_client(URI)
+    assert connections.get_client(URI) is client
+    assert connections.get_client(URI, maxPoolSize=2) is not client
+    connections.close_all()
+    assert connections.get_client(URI) is not client
+
+
+def _child_client_id(parent_id, results):
+    results.put(id(connections.get_client(URI)) != parent_id)
+
+
+def test_new_client_after_fork():
+    parent = connections.get_client(URI)
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    p = ctx.Process(target=_child_client_id, args=(id(parent), results))
+    p.start()
+    assert results.get(timeout=30)
+    p.join()
+    assert connections.get_client(URI) is parent
+
+
+def test_import_without_fork(monkeypatch):
+    # as on Windows
+    monkeypatch.delattr(os, "register_at_fork")
+    importlib.reload(connections)
+    assert connections.get_client(URI) is connections.get_client(URI)
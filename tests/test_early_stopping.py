@@ -0,0 +1,44 @@
+import pytest
+from hyperspace_explorer.early_stopping import ASHAPruner, MemoryRungStore
+
+
+def make_pruner(store, run_id, **kwargs):
+    return ASHAPruner(store, "task_a", run_id, "acc", eta=2, **kwargs)
+
+
+def test_rungs():
+    pruner = make_pruner(MemoryRungStore(), 1, min_step=3, max_step=30)
+    assert [pruner.rung_step(k) for k in range(4)] == [3, 6, 12, 24]
+    with pytest.raises(ValueError):
+        ASHAPruner(MemoryRungStore(), "task_a", 1, "acc", eta=1)
+
+
+def test_stops_worse_half():
+    store = MemoryRungStore()
+    assert not make_pruner(store, 0).report(1, 0.9)  # too few peers to compare
+    for run_id, acc in enumerate([0.8, 0.7], 1):
+        store.record("task_a", 1, run_id, acc)
+    # 4 values at the rung - continues only if among the best 2
+    assert make_pruner(store, 10).report(1, 0.6)
+    assert not make_pruner(store, 11).report(1, 0.85)
+
+
+def test_records_each_crossed_rung_once():
+    store = MemoryRungStore()
+    pruner = make_pruner(store, 1, max_step=8)
+    pruner.report(0, 0.1)
+    pruner.report(5, 0.5)  # reaches rungs 1, 2 and 4 at once
+    pruner.report(6, 0.6)
+    pruner.report(100, 0.7)  # no rung at 8 or later
+    assert dict(store.values) == {
+        ("task_a", 1): {1: 0.5},
+        ("task_a", 2): {1: 0.5},
+        ("task_a", 4): {1: 0.5},
+    }
+
+
+def test_min_mode():
+    store = MemoryRungStore()
+    for run_id, loss in enumerate([0.1, 0.2, 0.3]):
+        make_pruner(store, run_id, mode="min").report(1, loss)
+    assert make_pruner(store, 10, mode="min").report(1, 0.4)
@@ -0,0 +1,61 @@
+from abc import abstractmethod
+from dataclasses import dataclass
+import numpy as np
+from hyperspace_explorer.configurables import (
+    ConfigurableDataclass,
+    RegisteredAbstractMeta,
+)
+from hyperspace_explorer.fingerprint import canonical, config_fingerprint
+
+
+@dataclass
+class Schedule(
+    ConfigurableDataclass, metaclass=RegisteredAbstractMeta, is_registry=True
+):
+    @abstractmethod
+    def get_lr(self, step: int) -> float:
+        pass
+
+
+@dataclass
+class ConstantSchedule(Schedule):
+    lr: float = 0.1
+    warmup: int = 0
+
+    def get_lr(self, step: int) -> float:
+        return self.lr
+
+
+def test_canonical():
+    assert canonical({"b": (1, 2.0), "a": np.float64(0.5)}) == {"b": [1, 2], "a": 0.5}
+    assert canonical([np.arange(2), float("nan")]) == [[0, 1], "nan"]
+    assert canonical(True) is True
+
+
+def test_equivalent_configs():
+    base = config_fingerprint(
+        "task", {"Schedule": {"className": "ConstantSchedule"}, "layers": [2, 3]}
+    )
+    equivalent = [
+        {"layers": (2, 3), "Schedule": {"className": "ConstantSchedule"}},
+        {
+            "layers": [2.0, 3],
+            "Schedule": {"warmup": 0, "className": "ConstantSchedule", "lr": 0.1},
+        },
+    ]
+    assert all(config_fingerprint("task", c) == base for c in equivalent)
+    different = [
+        (
+            "task",
+            {
+                "Schedule": {"className": "ConstantSchedule", "lr": 0.2},
+                "layers": [2, 3],
+            },
+        ),
+        ("task", {"Schedule": {"className": "ConstantSchedule"}, "layers": [3, 2]}),
+        (
+            "other_task",
+            {"Schedule": {"className": "ConstantSchedule"}, "layers": [2, 3]},
+        ),
+    ]
+    assert all(config_fingerprint(*c) != base for c in different)
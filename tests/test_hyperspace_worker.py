@@ -0,0 +1,110 @@
+import os
+import types
+from typing import *
+import pytest
+from hyperspace_explorer import hyperspace_worker
+from hyperspace_explorer.hyperspace_worker import ScenarioCache, mark_killed_run
+from hyperspace_explorer.results import RUNS_COLLECTION
+from hyperspace_explorer.worker_pool import STATUS_TIMEOUT
+from hyperspace_explorer.scenario_base import Scenario
+
+
+class CachedScenario(Scenario):
+    reusable = True
+    setups = 0
+
+    def setup(self):
+        CachedScenario.setups += 1
+
+    def single_run(self, params) -> Tuple[float, Dict, Any]:
+        return 0.0, {}, None
+
+
+class UncachedScenario(CachedScenario):
+    reusable = False
+
+
+@pytest.fixture
+def tasks(tmp_path, monkeypatch):
+    # the worker builds scenarios from the `scenarios` module, normally imported from the working directory
+    monkeypatch.setattr(
+        hyperspace_worker,
+        "scenarios",
+        types.SimpleNamespace(Scenario=Scenario),
+        raising=False,
+    )
+    files = {}
+    for name in ["a", "b", "c"]:
+        files[name] = tmp_path / f"{name}.json"
+        files[name].write_text("{}")
+    task = {"Scenario": {"className": "CachedScenario"}}
+    return files, task
+
+
+def test_scenario_cache_lru(tasks):
+    files, task = tasks
+    cache = ScenarioCache(max_size=2)
+    a = cache.get(files["a"], task)
+    b = cache.get(files["b"], task)
+    assert cache.get(files["a"], task) is a
+    cache.get(files["c"], task)  # evicts b, the least recently used
+    assert cache.get(files["a"], task) is a
+    assert cache.get(files["b"], task) is not b
+
+
+def test_scenario_cache_invalidation(tasks):
+    files, task = tasks
+    cache = ScenarioCache(max_size=2)
+    first = cache.get(files["a"], task)
+    files["a"].write_text('{"changed": 1}')
+    second = cache.get(files["a"], task)
+    assert second is not first
+    stat = files["a"].stat()
+    os.utime(files["a"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(files["a"], task) is not second
+
+
+def test_scenario_cache_reuse(tasks):
+    files, task = tasks
+    cache = ScenarioCache(max_size=2)
+    setups = CachedScenario.setups
+    scenario = cache.get(files["a"], task)
+    scenario.log_scalar("loss", 0.5)
+    scenario.info["note"] = "from the previous run"
+    assert cache.get(files["a"], task) is scenario
+    assert CachedScenario.setups == setups + 1
+    # state of the previous run is cleared
+    assert "loss" not in scenario._metrics
+    assert scenario.info == {}
+
+    uncached = {"Scenario": {"className": "UncachedScenario"}}
+    first = cache.get(files["b"], uncached)
+    assert cache.get(files["b"], uncached) is not first
+    assert CachedScenario.setups == setups + 3
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.updates = []
+
+    def update_one(self, query, update):
+        self.updates.append((query, update))
+
+
+def test_mark_killed_run(monkeypatch):
+    runs = RecordingCollection()
+    clients = []
+
+    def get_client(uri):
+        clients.append(uri)
+        return {"test_db": {RUNS_COLLECTION: runs}}
+
+    monkeypatch.setattr(hyperspace_worker, "get_client", get_client)
+    mark_killed_run("mongodb://db", "test_db", None, None, STATUS_TIMEOUT, "too slow")
+    assert clients == []  # not stored yet, nothing to mark
+
+    mark_killed_run("mongodb://db", "test_db", None, 5, STATUS_TIMEOUT, "too slow")
+    [(query, update)] = runs.updates
+    assert query == {"_id": 5}
+    assert update["$set"]["status"] == STATUS_TIMEOUT
+    assert update["$set"]["fail_trace"] == ["too slow"]
@@ -0,0 +1,134 @@
+import time
+import pytest
+from pymongo.errors import OperationFailure
+from hyperspace_explorer.queue import RunQueue, LeaseHeartbeat, Backoff
+
+
+@pytest.fixture
+def queue(tmp_path, mongo_client):
+    tasks_dir = tmp_path / "tasks"
+    tasks_dir.mkdir()
+    for name in ["task_a", "task_b"]:
+        (tasks_dir / f"{name}.json").write_text("{}")
+    return RunQueue("mongodb://localhost", "test_db", tasks_dir)
+
+
+def test_fetch_and_remove(queue):
+    queued = queue.submit("task_a", {"i": 0})
+    queue.submit("task_c", {})  # not available locally
+    run = queue.fetch_one()
+    assert run.id == queued and run.params == {"i": 0}
+    assert run.attempts == 1 and run.lease_token
+    assert queue.fetch_one() is None
+    assert queue.remove(run) == 1
+
+
+def test_lease_reclaim(queue):
+    queue.lease_duration = -1  # every lease expires right away
+    queue.max_attempts = 2
+    queue.submit("task_a", {})
+
+    run = queue.fetch_one()
+    assert queue.heartbeat(run)
+    assert queue.reclaim_expired() == 1
+    assert not queue.heartbeat(run)  # reclaimed, the token is not valid anymore
+
+    run = queue.fetch_one()
+    assert run.attempts == 2
+    assert queue.reclaim_expired() == 0  # max attempts reached - marked as failed
+    assert queue.fetch_one() is None
+    assert (
+        queue.backend.queue.find_one({"_id": run.id})["status"]
+        == queue.backend.status_failed
+    )
+
+
+def test_heartbeat_renews_lease(queue):
+    queue.lease_duration = 0.5
+    queue.submit("task_a", {})
+    run = queue.fetch_one()
+    with LeaseHeartbeat(queue, run, interval=0.1) as heartbeat:
+        time.sleep(1)
+        assert queue.reclaim_expired() == 0
+        assert not heartbeat.lost
+        queue.remove(run)
+        time.sleep(0.3)
+    assert heartbeat.lost
+
+
+def test_fetch_order(queue):
+    queue.submit("task_a", {"i": 0})
+    queue.submit("task_b", {"i": 1})
+    urgent = queue.submit("task_a", {"i": 2}, priority=5)
+    queue.submit("task_a", {"i": 3}, priority=1)
+    assert queue.fetch_one().id == urgent
+    assert [queue.fetch_one().params["i"] for _ in range(3)] == [3, 0, 1]
+
+
+def test_set_priority(queue):
+    queue.submit("task_a", {"i": 0})
+    last = queue.submit("task_a", {"i": 1})
+    assert queue.set_priority([last], 2) == 1
+    assert queue.fetch_one().id == last
+
+
+def test_indexes(queue):
+    keys = [
+        [field for field, _ in index["key"]]
+        for index in queue.backend.queue.index_information().values()
+    ]
+    assert ["status", "task_name", "priority", "time_inserted"] in keys
+    assert ["status", "lease_expires"] in keys
+
+
+def test_backoff():
+    backoff = Backoff(initial=1, maximum=8, factor=2)
+    for delay in [1, 2, 4, 8, 8]:
+        assert delay / 2 <= backoff.next() <= delay
+    backoff.reset()
+    assert 0.5 <= backoff.next() <= 1
+    assert len({Backoff().next() for _ in range(10)}) > 1  # jittered
+
+
+def test_wait_without_change_streams(queue, monkeypatch):
+    def watch(*args, **kwargs):
+        raise OperationFailure(
+            "The $changeStream stage is only supported on replica sets"
+        )
+
+    monkeypatch.setattr(queue.backend.queue, "watch", watch)
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    queue.backoff = Backoff(initial=1, maximum=8)
+    for _ in range(4):
+        queue.wait_for_ready(timeout=3)
+    assert not queue.backend.change_streams  # polling from now on
+    assert 0.5 <= sleeps[0] <= 1 and 1 <= sleeps[1] <= 2
+    assert all(s <= 3 for s in sleeps)
+
+    queue.submit("task_a", {})
+    assert queue.fetch_one() is not None
+    queue.wait_for_ready(timeout=3)
+    assert sleeps[-1] <= 1  # reset by a successful fetch
+
+
+def test_submit_many(queue):
+    runs = ((["task_a", "task_b"][i % 2], {"i": i}) for i in range(25))
+    summary = queue.submit_many(runs, priority=1, chunk_size=10)
+    assert summary.count == 25
+    assert len(set(summary.ids)) == 25
+    assert summary.per_task == {"task_a": 13, "task_b": 12}
+
+    queue.submit("task_a", {"i": 25})
+    grid = queue.submit_grid("task_b", ({"i": i} for i in range(26, 30)), priority=2)
+    assert grid.per_task == {"task_b": 4}
+    assert [queue.fetch_one().params["i"] for _ in range(6)] == [26, 27, 28, 29, 0, 1]
+
+
+def test_submit_many_unknown_task(queue):
+    runs = [("task_a", {"i": i}) for i in range(5)] + [("task_c", {})]
+    with pytest.raises(ValueError, match="task_c"):
+        queue.submit_many(runs, chunk_size=3)
+    assert (
+        queue.backend.queue.count_documents({}) == 3
+    )  # chunks before the unknown task
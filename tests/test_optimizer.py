@@ -0,0 +1,66 @@
+import numpy as np
+from hyperspace_explorer.optimizer import TPE, Optimizer
+from hyperspace_explorer.queue import RunQueue
+from hyperspace_explorer.space import Space
+
+SPACE = {
+    "x": {"type": "real", "low": -5, "high": 5},
+    "kind": {"type": "categorical", "choices": ["bad", "good"]},
+}
+
+
+def objective(config):
+    return -((config["x"] - 1) ** 2) + (2 if config["kind"] == "good" else 0)
+
+
+def test_tpe_finds_optimum():
+    space = Space.from_config(SPACE)
+    tpe = TPE(space, seed=0)
+    X = np.empty((0, 2))
+    y = np.empty(0)
+    for _ in range(15):
+        suggested = tpe.suggest(X, y, 4)
+        X = np.concatenate([X, suggested])
+        y = np.concatenate([y, [objective(c) for c in space.decode(suggested)]])
+    best = space.decode(X[np.argmax(y)][None])[0]
+    assert best["kind"] == "good"
+    assert abs(best["x"] - 1) < 0.5
+    late = space.decode(X[-20:])
+    assert np.mean([c["kind"] == "good" for c in late]) > 0.7
+
+
+def test_constant_liar_spreads_batch():
+    space = Space.from_config({"x": {"type": "real", "low": 0, "high": 1}})
+    X = np.linspace(0, 1, 20)[:, None]
+    y = -np.abs(X[:, 0] - 0.5)
+    batch = TPE(space, seed=0).suggest(X, y, 8)
+    assert len(np.unique(np.round(batch, 6))) == 8
+
+
+class FakeTask:
+    name = "task_a"
+
+    def __init__(self):
+        self.results = []
+
+    def iter_results(self, config_keys=None):
+        return iter(self.results)
+
+
+def test_optimizer_keeps_queue_topped_up(tmp_path):
+    tasks_dir = tmp_path / "tasks"
+    tasks_dir.mkdir()
+    (tasks_dir / "task_a.json").write_text("{}")
+    queue = RunQueue(f"sqlite://{tmp_path / 'queue.db'}", "test_db", tasks_dir)
+    task = FakeTask()
+    space = Space.from_config(SPACE)
+    optimizer = Optimizer(task, queue, space, queue_depth=3, sampler=TPE(space, seed=0))
+
+    assert optimizer.step() == 3
+    assert optimizer.step() == 0
+    for _ in range(2):
+        run = queue.fetch_one()
+        task.results.append({"config": run.params, "result": objective(run.params)})
+        queue.remove(run)
+    assert optimizer.step() == 2
+    assert len(queue.pending("task_a")) == 3
@@ -0,0 +1,221 @@
+import math
+import multiprocessing
+import os
+import pytest
+from hyperspace_explorer.queue import RunQueue, Resources, LeaseHeartbeat
+
+
+@pytest.fixture
+def queue(tmp_path):
+    tasks_dir = tmp_path / "tasks"
+    tasks_dir.mkdir()
+    for name in ["task_a", "task_b"]:
+        (tasks_dir / f"{name}.json").write_text("{}")
+    return RunQueue(f"sqlite://{tmp_path / 'queue.db'}", "test_db", tasks_dir)
+
+
+def test_fetch_order(queue):
+    queue.submit("task_a", {"i": 0})
+    queue.submit("task_b", {"i": 1})
+    urgent = queue.submit("task_a", {"i": 2}, priority=5)
+    queue.submit("task_a", {"i": 3}, priority=1)
+
+    first = queue.fetch_one()
+    assert first.id == urgent
+    assert first.params == {"i": 2}
+    assert first.attempts == 1
+    assert [queue.fetch_one().params["i"] for _ in range(3)] == [3, 0, 1]
+    assert queue.fetch_one() is None
+
+
+def test_only_available_tasks(queue):
+    queue.submit("task_c", {})
+    assert queue.fetch_one() is None
+    with pytest.raises(ValueError):
+        queue.submit_many([("task_a", {}), ("task_c", {})])
+
+
+def test_remove(queue):
+    queue.submit("task_a", {})
+    run = queue.fetch_one()
+    assert queue.remove(run) == 1
+    assert queue.remove(run) == 0
+
+
+def test_pause_resume(queue):
+    queue.submit_grid("task_a", ({"i": i} for i in range(3)))
+    assert queue.pause_all() == 3
+    assert queue.fetch_one() is None
+    assert queue.resume_all() == 3
+    assert queue.fetch_one() is not None
+
+
+def test_lease_reclaim(queue):
+    queue.lease_duration = -1  # every lease expires right away
+    queue.max_attempts = 2
+    queue.submit("task_a", {})
+
+    run = queue.fetch_one()
+    assert queue.heartbeat(run)
+    assert queue.reclaim_expired() == 1
+    assert not queue.heartbeat(run)
+
+    run = queue.fetch_one()
+    assert run.attempts == 2
+    assert queue.reclaim_expired() == 0  # max attempts reached - marked as failed
+    assert queue.fetch_one() is None
+
+
+def test_submit_many(queue):
+    runs = ((["task_a", "task_b"][i % 2], {"i": i}) for i in range(25))
+    summary = queue.submit_many(runs, chunk_size=10)
+    assert summary.count == 25
+    assert len(set(summary.ids)) == 25
+    assert summary.per_task == {"task_a": 13, "task_b": 12}
+
+
+def _claim_all(uri, tasks_dir, results):
+    q = RunQueue(uri, "test_db", tasks_dir)
+    claimed = []
+    while True:
+        run = q.fetch_one()
+        if run is None:
+            break
+        claimed.append(run.params["i"])
+    results.put(claimed)
+
+
+def test_concurrent_claims(queue):
+    n = 200
+    queue.submit_grid("task_a", ({"i": i} for i in range(n)))
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=_claim_all, args=(queue.mongo_uri, queue.tasks_dir, results))
+        for _ in range(4)
+    ]
+    for w in workers:
+        w.start()
+    claimed = [i for _ in workers for i in results.get(timeout=60)]
+    for w in workers:
+        w.join()
+    assert sorted(claimed) == list(range(n))
+
+
+def test_release(queue):
+    queue.max_attempts = 2
+    queue.submit("task_a", {})
+    run = queue.fetch_one()
+    assert queue.release(run)
+    assert not queue.release(run)  # not taken anymore
+
+    run = queue.fetch_one()
+    assert run.attempts == 2
+    assert not queue.release(run)  # max attempts reached - marked as failed
+    assert queue.fetch_one() is None
+
+
+def test_resource_matching(queue):
+    queue.submit("task_a", {"n": "none"})
+    queue.submit("task_a", {"n": "big"}, requirements=Resources(cores=8, memory_gb=64))
+    queue.submit("task_a", {"n": "mid"}, requirements=Resources(cores=4, memory_gb=8))
+    queue.submit("task_a", {"n": "gpu"}, requirements=Resources(cores=1, tags=["gpu"]))
+
+    small = Resources(cores=4, memory_gb=16, tags=["ssd"])
+    run = queue.fetch_one(small)
+    assert run.params["n"] == "mid"  # best fit first
+    assert run.requirements.fits(small)
+    assert queue.fetch_one(small).params["n"] == "none"
+    assert queue.fetch_one(small) is None
+
+    big = Resources(cores=8, memory_gb=64, tags=["gpu"])
+    assert queue.fetch_one(big).params["n"] == "big"
+    assert queue.fetch_one(big).params["n"] == "gpu"
+
+
+def test_pending(queue):
+    queue.submit_grid("task_a", ({"i": i} for i in range(3)))
+    queue.submit("task_b", {"i": 3})
+    queue.fetch_one()
+    assert sorted(p["i"] for p in queue.pending("task_a")) == [0, 1, 2]
+    queue.remove(queue.fetch_one())
+    assert len(queue.pending("task_a")) == 2
+
+
+def test_submit_duplicates(queue):
+    first = queue.submit("task_a", {"i": 0, "lr": 0.5}, on_duplicate="skip")
+    assert queue.submit("task_a", {"lr": 0.5, "i": 0.0}, on_duplicate="skip") is None
+    assert queue.submit("task_a", {"lr": 0.5, "i": 0}, on_duplicate="attach") == first
+    assert queue.submit("task_b", {"i": 0, "lr": 0.5}, on_duplicate="skip") is not None
+
+    configs = [{"i": i % 3, "lr": 0.5} for i in range(6)]
+    skipped = queue.submit_grid("task_a", configs, on_duplicate="skip", chunk_size=4)
+    assert (skipped.count, skipped.skipped) == (2, 4)
+    attached = queue.submit_grid("task_a", configs, on_duplicate="attach")
+    assert attached.skipped == 6 and attached.ids[0] == attached.ids[3] == first
+    assert len(queue.pending("task_a")) == 3
+
+    # a taken run is still a duplicate, a removed one - not anymore
+    queue.remove(queue.fetch_one())
+    assert queue.submit_grid("task_a", configs, on_duplicate="skip").count == 1
+    with pytest.raises(ValueError):
+        queue.submit("task_a", {}, on_duplicate="ignore")
+
+
+def test_duplicates_code_version(queue):
+    queue.submit("task_a", {"i": 0}, on_duplicate="skip")
+    queue.code_version = "v2"
+    assert queue.submit("task_a", {"i": 0}, on_duplicate="skip") is not None
+    assert queue.submit("task_a", {"i": 0}, on_duplicate="skip") is None
+
+
+def test_remove_after_lease_lost(queue):
+    queue.lease_duration = -1
+    queue.submit("task_a", {})
+    lost = queue.fetch_one()
+    queue.reclaim_expired()
+    queue.lease_duration = 300
+    current = queue.fetch_one()
+    assert queue.remove(lost) == 0  # taken by someone else by now
+    assert queue.remove(current) == 1
+
+
+def test_heartbeat_without_thread(queue):
+    queue.submit("task_a", {})
+    run = queue.fetch_one()
+    heartbeat = LeaseHeartbeat(queue, run, interval=0)
+    heartbeat.renew_if_due()
+    assert not heartbeat.lost
+    queue.remove(run)
+    heartbeat.renew_if_due()
+    assert heartbeat.lost
+
+
+def test_has_ready_with_capacity(queue):
+    queue.submit("task_a", {}, requirements=Resources(cores=8, tags=["gpu"]))
+    small = Resources(cores=4, memory_gb=16, tags=["gpu"])
+    tasks = queue.get_available_tasks()
+    assert queue.backend.has_ready(tasks)
+    assert not queue.backend.has_ready(tasks, small)
+    assert queue.fetch_one(small) is None
+    assert queue.backend.has_ready(tasks, Resources(cores=8, tags=["gpu", "ssd"]))
+
+
+def test_resources_of_this_machine(monkeypatch):
+    assert Resources.of_this_machine().cores >= 1
+    # as on platforms other than Linux
+    monkeypatch.delattr(os, "sched_getaffinity", raising=False)
+    monkeypatch.delattr(os, "sysconf", raising=False)
+    machine = Resources.of_this_machine(["gpu"])
+    assert machine.cores == os.cpu_count()
+    assert machine.memory_gb == math.inf
+    assert Resources(cores=1, memory_gb=1024).fits(machine)
+
+
+def test_submit_config_of_class_not_imported(queue):
+    import hyperspace_explorer.scenario_base  # registers Scenario classes
+
+    config = {"Scenario": {"className": "NotImportedScenario"}}
+    assert queue.submit("task_a", config) is not None  # not fingerprinted
+    with pytest.raises(ValueError, match="NotImportedScenario"):
+        queue.submit("task_a", config, on_duplicate="skip")
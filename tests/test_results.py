@@ -0,0 +1,295 @@
+import collections as cc
+import random
+import statistics
+import pytest
+from hyperspace_explorer import utils
+from hyperspace_explorer.results import Task
+from hyperspace_explorer.utils import flatten, unique_suffixes, pd
+
+
+def unique_suffixes_reference(keys, sep="."):
+    """The original, quadratic implementation"""
+    mapping = {k: k.split(sep)[-1] for k in keys}
+    parts_counts = {k: 1 for k in mapping.keys()}
+    suf_counter = cc.Counter(mapping.values())
+    while set(suf_counter.values()) != {1}:
+        duplicated = {k for k, v in suf_counter.items() if v > 1}
+        for k, v in mapping.items():
+            if v in duplicated:
+                parts_counts[k] += 1
+                mapping[k] = sep.join(k.split(sep)[-parts_counts[k] :])
+        suf_counter = cc.Counter(mapping.values())
+    return mapping
+
+
+def results_comparison_reference(results, hide_const_cols=True):
+    df = pd.DataFrame([flatten(r) for r in results])
+    df = df.set_index("_id")
+    df.index.name = "id"
+    df = df.rename(columns=unique_suffixes_reference(df.columns))
+    df = df.astype(object).map(lambda x: x if not isinstance(x, list) else tuple(x))
+    df = df.infer_objects()
+    if hide_const_cols:
+        df = df[[c for c in df.columns if df[c].nunique(dropna=False) > 1]]
+    return df
+
+
+def random_keys(rng, n):
+    names = ["a", "b", "c", "lr", "model", "layers"]
+    keys = set()
+    while len(keys) < n:
+        keys.add(".".join(rng.choice(names) for _ in range(rng.randint(1, 4))))
+    return sorted(keys)
+
+
+def test_unique_suffixes_matches_reference():
+    rng = random.Random(0)
+    for _ in range(50):
+        keys = random_keys(rng, rng.randint(1, 40))
+        assert unique_suffixes(keys) == unique_suffixes_reference(keys)
+
+
+def test_results_comparison_matches_reference():
+    rng = random.Random(0)
+    results = [
+        {
+            "_id": i,
+            "result": rng.random(),
+            "config": {
+                "model": {
+                    "lr": rng.choice([0.1, 0.01]),
+                    "layers": [8, rng.randint(1, 3)],
+                },
+                "optimizer": {"name": "adam", "lr": None if i % 3 else 0.5},
+                "seed": 1,
+                "name": rng.choice(["x", "y"]),
+            },
+        }
+        for i in range(30)
+    ]
+    for hide_const_cols in [True, False]:
+        expected = results_comparison_reference(results, hide_const_cols)
+        actual = Task.results_comparison(results, hide_const_cols)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+class AggregatingCollection:
+    """Returns given documents from `aggregate`, recording the pipeline"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.docs)
+
+
+def test_aggregate_results_without_grouping():
+    task = Task("task_a", "test_db")
+    task.c = AggregatingCollection([{"_id": None, "m0_mean": 0.5, "m0_count": 4}])
+    df = task.aggregate_results(group_by=[], stats=["mean", "count"])
+    assert len(df) == 1
+    assert df.loc[0, ("result", "mean")] == 0.5
+    [pipeline] = task.c.pipelines
+    assert [list(stage) for stage in pipeline] == [["$match"], ["$group"]]
+    assert pipeline[1]["$group"]["_id"] is None
+
+
+@pytest.fixture
+def task(mongo_client):
+    db = mongo_client["test_db"]
+    db["runs"].insert_many(
+        [
+            {"_id": 1, "experiment": {"name": "task_a"}, "status": "COMPLETED"},
+            {"_id": 2, "experiment": {"name": "task_a"}, "status": "FAILED"},
+            {"_id": 3, "experiment": {"name": "task_b"}, "status": "COMPLETED"},
+        ]
+    )
+    db["metrics"].insert_many(
+        [
+            {
+                "run_id": 1,
+                "name": "loss",
+                "steps": list(range(10)),
+                "values": [0.1 * i for i in range(10)],
+            },
+            {"run_id": 1, "name": "lr", "steps": [0.5, 1.5], "values": [1, 2]},
+            {
+                "run_id": 2,
+                "name": "loss",
+                "steps": [0, 1, 2],
+                "values": [3.0, 2.0, 1.0],
+            },
+            {"run_id": 3, "name": "loss", "steps": [0], "values": [5.0]},
+        ]
+    )
+    return Task("task_a", "test_db")
+
+
+def test_metrics_for_runs(task):
+    df = task.metrics_for_runs()
+    assert len(df) == 15
+    assert list(df.columns) == ["run_id", "name", "step", "value"]
+    lr = df[df["name"] == "lr"]
+    assert list(lr["step"]) == [0.5, 1.5]  # not truncated to integers
+    assert list(lr["value"]) == [1, 2]
+
+    arrays = task.metrics_for_runs({"status": "FAILED"}, as_frame=False)
+    assert list(arrays["run_id"]) == [2, 2, 2]
+    assert arrays["step"].dtype.kind == "i"
+    assert list(arrays["value"]) == [3.0, 2.0, 1.0]
+
+
+def test_metrics_for_runs_last_only(task):
+    df = task.metrics_for_runs(names=["loss"], last_only=True)
+    assert df.set_index("run_id")["value"].to_dict() == {1: pytest.approx(0.9), 2: 1.0}
+    assert list(df["step"]) == [9, 2]
+
+
+@pytest.fixture
+def range_operator(monkeypatch):
+    """Adds $range, used to downsample metrics, to the aggregation operators mongomock implements"""
+    from mongomock.aggregate import _Parser
+
+    handle_array_operator = _Parser._handle_array_operator
+
+    def handle(parser, operator, value):
+        if operator == "$range":
+            return list(range(*parser.parse_many(value)))
+        return handle_array_operator(parser, operator, value)
+
+    monkeypatch.setattr(_Parser, "_handle_array_operator", handle)
+
+
+def test_metrics_for_runs_downsampled(task, range_operator):
+    df = task.metrics_for_runs([1], names=["loss"], max_points=4)
+    assert list(df["step"]) == [0, 3, 6, 9]
+    assert list(task.metrics_for_runs([1], ["loss"], max_points=3)["step"]) == [0, 5, 9]
+    assert list(task.metrics_for_runs([1], ["loss"], max_points=1)["step"]) == [9]
+    assert list(task.metrics_for_runs([2], ["loss"], max_points=5)["step"]) == [0, 1, 2]
+
+
+def test_metrics_of_any_type(task):
+    task._client["test_db"]["metrics"].insert_one(
+        {"run_id": 1, "name": "note", "steps": [0, 1], "values": ["ok", None]}
+    )
+    arrays = task.metrics_for_runs([1], names=["note"], as_frame=False)
+    assert arrays["value"].dtype == object
+    assert list(arrays["value"]) == ["ok", None]
+
+
+def test_metrics_for_runs_without_pandas(task, monkeypatch):
+    monkeypatch.setattr(utils, "pd", None)
+    with pytest.raises(ModuleNotFoundError, match="analysis"):
+        task.metrics_for_runs()
+    assert len(task.metrics_for_runs(as_frame=False)["value"]) == 15
+
+
+@pytest.fixture
+def results_task(mongo_client):
+    runs = [
+        {
+            "_id": i,
+            "experiment": {"name": "task_a"},
+            "status": "COMPLETED",
+            "result": 0.1 * i,
+            "info": {"epochs": 10},
+            "config": {
+                "model": {"lr": 0.1 if i % 2 else 0.01, "layers": [8, i]},
+                "seed": 1,
+                "name": "x",
+            },
+        }
+        for i in range(1, 6)
+    ]
+    runs[-1]["config"]["dropout"] = 0.5  # only in the last batch
+    runs.append(dict(runs[0], _id=6, status="FAILED"))
+    runs.append(dict(runs[0], _id=7, experiment={"name": "task_b"}))
+    mongo_client["test_db"]["runs"].insert_many(runs)
+    return Task("task_a", "test_db")
+
+
+def test_fetch_results_config_keys(results_task):
+    results = results_task.fetch_results(config_keys=["model.lr", "seed"])
+    assert [r["_id"] for r in results] == [5, 4, 3, 2, 1]  # best result first
+    assert results[0] == {
+        "_id": 5,
+        "result": pytest.approx(0.5),
+        "config": {"model": {"lr": 0.1}, "seed": 1},
+    }
+    assert all(set(r["config"]) == {"model", "seed"} for r in results)
+
+    [result] = results_task.fetch_results({"_id": 1}, projection_extra={"info": 1})
+    assert set(result) == {"_id", "result", "config", "info"}
+    assert set(result["config"]) == {"model", "seed", "name"}
+
+
+def test_iter_results_batches(results_task):
+    everything = results_task.fetch_results()
+    for batch_size in [1, 2, 5, 10]:
+        runs = results_task.iter_results(batch_size=batch_size)
+        assert list(runs) == everything
+    best = results_task.iter_results(limit=3, batch_size=2)
+    assert [r["_id"] for r in best] == [5, 4, 3]
+
+
+def test_results_frame_matches_results_comparison(results_task):
+    for config_keys in [None, ["model.lr", "dropout"]]:
+        results = results_task.fetch_results(config_keys=config_keys)
+        for hide_const_cols in [True, False]:
+            expected = Task.results_comparison(results, hide_const_cols)
+            for batch_size in [2, 5]:
+                actual = results_task.results_frame(
+                    config_keys=config_keys,
+                    hide_const_cols=hide_const_cols,
+                    batch_size=batch_size,
+                )
+                pd.testing.assert_frame_equal(actual, expected)
+    df = results_task.results_frame(batch_size=2, hide_const_cols=False)
+    assert df.loc[5, "dropout"] == 0.5 and df["dropout"].isna().sum() == 4
+
+
+@pytest.fixture
+def std_dev_operator(monkeypatch):
+    """Adds $stdDevSamp, used by `aggregate_results()`, to the group operators mongomock implements"""
+    from mongomock import aggregate
+
+    def std_dev(values):
+        values = [v for v in values if isinstance(v, (int, float))]
+        if len(values) < 2:
+            return None
+        return statistics.stdev(values)
+
+    monkeypatch.setitem(aggregate._GROUPING_OPERATOR_MAP, "$stdDevSamp", std_dev)
+
+
+def test_aggregate_results_grouped(results_task, std_dev_operator):
+    # a run of another seed, missing a result, only included in the count of `model.lr`
+    results_task.c.insert_one(
+        {
+            "_id": 8,
+            "experiment": {"name": "task_a"},
+            "status": "COMPLETED",
+            "config": {"model": {"lr": 0.1}, "seed": 2},
+        }
+    )
+    df = results_task.aggregate_results(
+        ["model.lr"], metrics=["result", "info.epochs"], stats=["count", "mean", "std"]
+    )
+    assert list(df.index) == [0.01, 0.1]
+    assert df.index.name == "model.lr"
+    assert list(df[("result", "count")]) == [2, 3]
+    assert list(df[("info.epochs", "count")]) == [2, 3]
+    assert df.loc[0.01, ("result", "mean")] == pytest.approx(0.3)
+    assert df.loc[0.1, ("result", "mean")] == pytest.approx(0.3)
+    assert df.loc[0.01, ("result", "std")] == pytest.approx(0.1 * 2**0.5)
+    assert df.loc[0.1, ("result", "std")] == pytest.approx(0.2)
+    assert df.loc[0.1, ("info.epochs", "std")] == 0
+
+    by_two = results_task.aggregate_results(["model.lr", "seed"], stats=["count"])
+    assert by_two[("result", "count")].to_dict() == {
+        (0.01, 1): 2,
+        (0.1, 1): 3,
+        (0.1, 2): 0,
+    }
@@ -0,0 +1,63 @@
+from hyperspace_explorer.results_cache import ResultsCache, default_path
+
+
+class FakeTask:
+    """Serves runs from a dict, understanding only the queries ResultsCache makes"""
+
+    def __init__(self):
+        self.name = "task_a"
+        self.db_name = "test_db"
+        self.runs = {}
+        self.fetched = []
+
+    def add(self, run_id, status, result=None):
+        self.runs[run_id] = {
+            "_id": run_id,
+            "status": status,
+            "result": result,
+            "config": {"model": {"lr": run_id / 10}},
+        }
+
+    def iter_runs(self, query, completed_only=True, batch_size=1000, **kwargs):
+        if query:
+            newer, unfinished = query["$or"]
+            ids = [
+                i
+                for i in self.runs
+                if i > newer["_id"]["$gt"] or i in unfinished["_id"]["$in"]
+            ]
+        else:
+            ids = list(self.runs)
+        self.fetched.extend(ids)
+        return (dict(self.runs[i]) for i in ids)
+
+
+def test_incremental_sync(tmp_path):
+    task = FakeTask()
+    task.add(1, "COMPLETED", 0.5)
+    task.add(2, "RUNNING")
+    task.add(3, "COMPLETED", 0.7)
+    cache = ResultsCache(task, tmp_path / "cache.sqlite")
+    assert cache.sync() == 3
+    assert [r["_id"] for r in cache.fetch_results()] == [3, 1]
+    assert cache.fetch_results()[0]["config.model.lr"] == 0.3
+
+    task.fetched.clear()
+    task.runs[2]["status"] = "COMPLETED"
+    task.runs[2]["result"] = 0.9
+    task.add(4, "FAILED")
+    assert cache.sync() == 2
+    assert sorted(task.fetched) == [2, 4]  # the running one and the new one
+    assert [r["_id"] for r in cache.fetch_results()] == [2, 3, 1]
+
+    reopened = ResultsCache(task, tmp_path / "cache.sqlite")
+    task.fetched.clear()
+    assert reopened.sync() == 0
+    assert len(reopened.fetch_results()) == 3
+
+
+def test_default_path_per_server():
+    local = default_path("test_db", "mongodb://localhost:27017")
+    assert local == default_path("test_db", "mongodb://localhost:27017")
+    assert local != default_path("test_db", "mongodb://other-host:27017")
+    assert local.name.startswith("test_db-")
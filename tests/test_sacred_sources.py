@@ -0,0 +1,68 @@
+import importlib
+import sys
+import types
+from hyperspace_explorer.sacred_sources import (
+    SourceDiscovery,
+    SourceCachingMongoObserver,
+)
+
+
+def test_source_discovery(tmp_path, monkeypatch):
+    main = tmp_path / "main.py"
+    main.write_text("")
+    (tmp_path / "local_module_a.py").write_text("x = 1\n")
+    (tmp_path / "local_module_b.py").write_text("y = 2\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.import_module("local_module_a")
+    try:
+        discovery = SourceDiscovery(save_git_info=False)
+        _, sources, dependencies = discovery.discover(str(main), str(tmp_path))
+        names = {s.filename.rsplit("/", 1)[-1] for s in sources}
+        assert names == {"main.py", "local_module_a.py"}
+        assert "sacred" in {d.name for d in dependencies}
+
+        sources.clear()  # returned sets are copies
+        assert len(discovery.discover(str(main), str(tmp_path))[1]) == 2
+        # modules imported later are added, without discovering everything again
+        importlib.import_module("local_module_b")
+        assert len(discovery.discover(str(main), str(tmp_path))[1]) == 3
+        assert discovery.discoveries == 1
+
+        (tmp_path / "local_module_a.py").write_text("x = 10\n")
+        discovery.discover(str(main), str(tmp_path))
+        assert discovery.discoveries == 2
+    finally:
+        sys.modules.pop("local_module_a", None)
+        sys.modules.pop("local_module_b", None)
+
+
+class FakeGridFS:
+    def __init__(self):
+        self.queries = 0
+        self.files = []
+
+    def find_one(self, query):
+        self.queries += 1
+        return None
+
+    def put(self, f, filename, md5):
+        self.files.append((filename, md5))
+        return len(self.files)
+
+
+def test_sources_stored_once(tmp_path):
+    (tmp_path / "model.py").write_text("x = 1\n")
+    ex_info = {"base_dir": str(tmp_path), "sources": [("model.py", "abc")]}
+
+    def observer(db_name, fs):
+        database = types.SimpleNamespace(client="client", name=db_name)
+        runs = types.SimpleNamespace(database=database)
+        return SourceCachingMongoObserver.create_from(runs, fs)
+
+    fs = FakeGridFS()
+    assert observer("test_db_a", fs).save_sources(ex_info) == [["model.py", 1]]
+    # ids are shared by observers of the same database, e.g. created in processes forked after the first run
+    assert observer("test_db_a", fs).save_sources(ex_info) == [["model.py", 1]]
+    assert (fs.queries, len(fs.files)) == (1, 1)
+    observer("test_db_b", fs).save_sources(ex_info)
+    assert (fs.queries, len(fs.files)) == (2, 2)
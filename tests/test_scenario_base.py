@@ -0,0 +1,84 @@
+from typing import *
+from hyperspace_explorer.early_stopping import ASHAPruner, MemoryRungStore
+from hyperspace_explorer.scenario_base import Scenario
+
+
+class Counting(Scenario):
+    def single_run(self, params) -> Tuple[float, Dict, Any]:
+        for i in range(params["steps"]):
+            self.log_scalar("loss", 1 / (i + 1))
+        return 0.0, {}, None
+
+
+class FakeRun:
+    def __init__(self):
+        self.info = {}
+        self.logged = []
+
+    def log_scalar(self, name, value, step):
+        self.logged.append((name, step, value))
+
+
+def test_log_scalar_steps():
+    s = Counting()
+    s.log_scalar("acc", 0.5)
+    s.log_scalar("acc", 0.6, step=10)
+    s.log_scalar("acc", 0.7)
+    s.log_scalar("acc", 0.8, step=3)
+    steps, values = s.get_metric("acc")
+    assert list(steps) == [0, 10, 11, 3]
+    assert list(values) == [0.5, 0.6, 0.7, 0.8]
+    s.log_scalar("acc", 0.9)  # still possible after reading
+    assert s.get_metric("acc")[0][-1] == 12
+
+
+def test_log_scalar_types():
+    s = Counting()
+    s.log_scalar("acc", 0.5, step=3.0)
+    s.log_scalar("acc", 1)
+    assert s._metrics["acc"].max_step == 4
+    assert list(s.get_metric("acc")[0]) == [3, 4]
+    # not fitting typed arrays - kept as given
+    s.log_scalar("acc", 0.6, step=4.5)
+    s.log_scalar("acc", "n/a")
+    steps, values = s.get_metric("acc")
+    assert list(steps) == [3, 4, 4.5, 5.5]
+    assert list(values) == [0.5, 1.0, 0.6, "n/a"]
+    run = FakeRun()
+    s.setup_sacred(run)
+    s.flush_metrics()
+    assert run.logged[2:] == [("acc", 4.5, 0.6), ("acc", 5.5, "n/a")]
+
+
+def test_flush_to_sacred():
+    s = Counting()
+    run = FakeRun()
+    s.setup_sacred(run)
+    s.metrics_flush_every = 4
+    s.metrics_flush_interval = float("inf")
+    s.single_run({"steps": 10})
+    assert len(run.logged) == 8
+    s.flush_metrics()
+    assert len(run.logged) == 10
+    assert run.logged[-1] == ("loss", 9, 0.1)
+    s.flush_metrics()
+    assert len(run.logged) == 10
+
+    s.reset_run_state()
+    assert len(s.get_metric("loss")[0]) == 0
+
+
+def test_should_stop():
+    store = MemoryRungStore()
+    for run_id in range(3):
+        store.record("task_a", 4, run_id, 0.01)
+    s = Counting()
+    s.set_pruner(ASHAPruner(store, "task_a", 10, "loss", mode="min", eta=2))
+    for i in range(8):
+        s.log_scalar("loss", 1 / (i + 1))
+        if s.should_stop():
+            break
+    assert i == 4
+    assert s.info["early_stopping"]["step"] == 4
+    s.reset_run_state()
+    assert not s.should_stop()
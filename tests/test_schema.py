@@ -0,0 +1,98 @@
+import pytest
+from hyperspace_explorer import schema
+from hyperspace_explorer.results import Study
+from hyperspace_explorer.schema import (
+    IndexSpec,
+    SCHEMA_COLLECTION,
+    ensure_schema,
+    explain_stats,
+    schema_versions,
+)
+
+
+def test_explain_stats():
+    explained = {
+        "queryPlanner": {
+            "winningPlan": {
+                "queryPlan": {
+                    "stage": "LIMIT",
+                    "inputStage": {
+                        "stage": "FETCH",
+                        "inputStage": {"stage": "IXSCAN", "indexName": "status_1"},
+                    },
+                }
+            }
+        },
+        "executionStats": {
+            "totalKeysExamined": 3,
+            "totalDocsExamined": 2,
+            "nReturned": 1,
+        },
+    }
+    assert explain_stats(explained) == {
+        "indexes": ["status_1"],
+        "collection_scan": False,
+        "keys_examined": 3,
+        "docs_examined": 2,
+        "returned": 1,
+    }
+    scan = {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+    assert explain_stats(scan)["collection_scan"]
+
+
+@pytest.fixture
+def db(mongo_client, monkeypatch):
+    monkeypatch.setattr(schema, "_checked", set())
+    return mongo_client["test_db"]
+
+
+def has_status_index(collection):
+    return "status_1" in collection.index_information()
+
+
+def test_ensure_schema_versions(db):
+    indexes = [IndexSpec("runs", [("status", 1)])]
+    assert ensure_schema(db, "results", 2, indexes)
+    assert has_status_index(db["runs"])
+    assert schema_versions(db) == {"results": 2}
+
+    # checked once per process
+    db["runs"].drop_index("status_1")
+    assert not ensure_schema(db, "results", 2, indexes)
+    assert not has_status_index(db["runs"])
+
+    # already current in the database
+    schema._checked.clear()
+    assert not ensure_schema(db, "results", 2, indexes)
+    assert not has_status_index(db["runs"])
+
+    # recorded by an older version of the package
+    schema._checked.clear()
+    db[SCHEMA_COLLECTION].update_one({"_id": "results"}, {"$set": {"version": 1}})
+    assert ensure_schema(db, "results", 2, indexes)
+    assert has_status_index(db["runs"])
+    assert schema_versions(db) == {"results": 2}
+
+    db["runs"].drop_index("status_1")
+    assert ensure_schema(db, "results", 2, indexes, force=True)
+    assert has_status_index(db["runs"])
+
+
+@pytest.fixture
+def explainable(monkeypatch):
+    """mongomock cursors cannot be explained - every query is reported as a collection scan"""
+    from mongomock.collection import Cursor
+
+    explain = lambda cursor: {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+    monkeypatch.setattr(Cursor, "explain", explain, raising=False)
+
+
+def test_explain_queries_without_runs(db, explainable):
+    study = Study("test_db")
+    with pytest.raises(ValueError, match="No runs"):
+        study.explain_queries()
+    stats = study.explain_queries("task_a")
+    assert sorted(stats) == ["fetch_results", "metrics_for_run", "queue_claim"]
+    assert all(s["collection_scan"] for s in stats.values())
+    # a diagnostic - it does not set up the database
+    assert db.list_collection_names() == []
@@ -0,0 +1,113 @@
+import importlib
+import sys
+import numpy as np
+import pytest
+from hyperspace_explorer.space import Space, Sweep, halton_points
+
+SPACE = {
+    "model.lr": {"type": "real", "low": 1e-4, "high": 1e-1, "log": True},
+    "model.layers": {"type": "int", "low": 1, "high": 8},
+    "optimizer": {"type": "categorical", "choices": ["adam", "sgd", [1, 2]]},
+}
+
+
+def test_encode_decode():
+    space = Space.from_config(SPACE)
+    configs = [
+        {"model": {"lr": 0.01, "layers": 3}, "optimizer": "sgd"},
+        {"model": {"lr": 1e-4, "layers": 8}, "optimizer": [1, 2]},
+    ]
+    encoded = space.encode(configs)
+    assert encoded.shape == (2, 3)
+    assert np.allclose(encoded[:, 2], [1, 2])
+    decoded = space.decode(encoded)
+    assert np.isclose(decoded[0]["model"]["lr"], 0.01)
+    assert decoded[1]["model"]["layers"] == 8
+    assert [d["optimizer"] for d in decoded] == ["sgd", [1, 2]]
+
+
+def test_outside_of_space():
+    space = Space.from_config(SPACE)
+    encoded = space.encode(
+        [{"model": {"lr": 1.0, "layers": 3}, "optimizer": "rmsprop"}]
+    )
+    assert np.isnan(encoded[0, 0]) and np.isnan(encoded[0, 2])
+    assert not np.isnan(encoded[0, 1])
+
+
+def test_sample():
+    space = Space.from_config(SPACE)
+    for config in space.decode(space.sample(np.random.default_rng(0), 50)):
+        assert 1e-4 <= config["model"]["lr"] <= 1e-1
+        assert config["model"]["layers"] in range(1, 9)
+
+
+BASE = {"model": {"lr": 0.01, "layers": 2, "dropout": 0.5}, "optimizer": "adam"}
+SWEEP = {
+    "model.layers": {"type": "int", "low": 1, "high": 3},
+    "Engine": {
+        "type": "conditional",
+        "branches": {
+            "CombustionEngine": {
+                "displacement_liters": {"type": "real", "low": 1, "high": 3}
+            },
+            "ElectricMotor": {},
+        },
+    },
+}
+
+
+def test_sweep_grid():
+    configs = list(Sweep.from_config(BASE, SWEEP).grid(points_per_axis=3))
+    assert len(configs) == 3 * (3 + 1)
+    assert {c["model"]["layers"] for c in configs} == {1, 2, 3}
+    electric = [c for c in configs if c["Engine"]["className"] == "ElectricMotor"]
+    assert len(electric) == 3 and all(
+        c["Engine"] == {"className": "ElectricMotor"} for c in electric
+    )
+    combustion = {
+        c["Engine"]["displacement_liters"]
+        for c in configs
+        if c["Engine"]["className"] == "CombustionEngine"
+    }
+    assert combustion == {1.0, 2.0, 3.0}
+    # unchanged parts are shared with the base config
+    assert all(
+        c["model"]["dropout"] == 0.5 and c["optimizer"] == "adam" for c in configs
+    )
+    assert BASE["model"]["layers"] == 2 and "Engine" not in BASE
+
+
+@pytest.mark.parametrize("method", ["random", "halton"])
+def test_sweep_sampled(method):
+    sweep = Sweep.from_config(BASE, SWEEP)
+    configs = list(getattr(sweep, method)(200, chunk_size=64))
+    assert len(configs) == 200
+    assert {c["model"]["layers"] for c in configs} == {1, 2, 3}
+    classes = [c["Engine"]["className"] for c in configs]
+    assert 60 < classes.count("ElectricMotor") < 140
+    for c in configs:
+        if c["Engine"]["className"] == "CombustionEngine":
+            assert 1 <= c["Engine"]["displacement_liters"] <= 3
+
+
+def test_halton():
+    points = halton_points(np.arange(1, 5), 2)
+    assert np.allclose(points[:, 0], [1 / 2, 1 / 4, 3 / 4, 1 / 8])
+    assert np.allclose(points[:, 1], [1 / 3, 2 / 3, 1 / 9, 4 / 9])
+    sweep = Sweep.from_config(BASE, SWEEP)
+    assert list(sweep.halton(10)) == list(sweep.halton(4)) + list(
+        sweep.halton(6, skip=4)
+    )
+
+
+def test_space_rejects_conditional():
+    with pytest.raises(ValueError):
+        Space.from_config(SWEEP)
+
+
+def test_clear_error_without_numpy(monkeypatch):
+    monkeypatch.setitem(sys.modules, "numpy", None)  # makes importing it fail
+    monkeypatch.delitem(sys.modules, "hyperspace_explorer.space")
+    with pytest.raises(ModuleNotFoundError, match=r"hyperspace_explorer\[search\]"):
+        importlib.import_module("hyperspace_explorer.space")
@@ -0,0 +1,49 @@
+import time
+from hyperspace_explorer.timing import (
+    PhaseTimer,
+    JsonlSink,
+    read_jsonl,
+    summarize,
+    format_summary,
+    KIND_LOOP,
+)
+
+
+def test_phase_timer(tmp_path):
+    path = tmp_path / "timings.jsonl"
+    timer = PhaseTimer([JsonlSink(path)])
+    time.sleep(0.01)
+    timer.lap("setup")
+    timer.lap("run")
+    time.sleep(0.01)
+    timer.lap("run")
+    timer.emit(task_name="task_a", run_id=1)
+    assert timer.total == 0
+    timer.emit(task_name="task_a")  # nothing measured - nothing written
+
+    records = list(read_jsonl([path]))
+    assert len(records) == 1
+    assert records[0]["task_name"] == "task_a" and records[0]["kind"] == "run"
+    assert set(records[0]["phases"]) == {"setup", "run"}
+    assert all(v >= 0.01 for v in records[0]["phases"].values())
+
+
+def test_summarize():
+    records = [
+        {"kind": "run", "task_name": "a", "phases": {"fill_defaults": 1.0, "run": 8.0}},
+        {
+            "kind": "run",
+            "task_name": "a",
+            "phases": {"fill_defaults": 1.0, "run": 12.0},
+        },
+        {"kind": "run", "task_name": "b", "phases": {"experiment_setup": 2.0}},
+        {"kind": KIND_LOOP, "worker": "w1", "phases": {"idle": 5.0, "run": 15.0}},
+        {"kind": KIND_LOOP, "worker": "w2", "phases": {"idle": 0.0, "run": 20.0}},
+    ]
+    summary = summarize(records)
+    assert summary["tasks"]["a"]["runs"] == 2
+    assert summary["tasks"]["a"]["overhead_ratio"] == 0.1
+    assert summary["tasks"]["b"]["overhead_ratio"] is None
+    assert summary["workers"]["w1"]["idle_fraction"] == 0.25
+    assert summary["idle_fraction"] == 5 / 40
+    assert "idle 12.5%" in format_summary(summary)
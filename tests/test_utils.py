@@ -41,3 +41,8 @@ def test_drop_constant_columns():
     )
     r = drop_constant_columns(df)
     assert set(r.columns) == {"A", "D", "E"}
+
+
+def test_unflatten():
+    nested = {"a1": 123, "a2": {"b1": 234, "b2": {"c": [1, 2]}}}
+    assert unflatten(flatten(nested)) == nested
@@ -0,0 +1,123 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+import pytest
+from hyperspace_explorer import worker_pool
+from hyperspace_explorer.queue import RunQueue, QueuedRun
+from hyperspace_explorer.worker_pool import (
+    WorkerPool,
+    IsolatedRunner,
+    RunLimits,
+    process_tree_rss_mb,
+    STATUS_TIMEOUT,
+    STATUS_OUT_OF_MEMORY,
+    STATUS_FAILED,
+)
+
+linux_only = pytest.mark.skipif(
+    not Path("/proc/self/status").exists(), reason="reads /proc"
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    tasks_dir = tmp_path / "tasks"
+    tasks_dir.mkdir()
+    (tasks_dir / "task_a.json").write_text("{}")
+    return RunQueue(f"sqlite://{tmp_path / 'queue.db'}", "test_db", tasks_dir)
+
+
+def fake_runner(on_start=None):
+    """Runner of runs described by their params - no scenarios, nor a database involved"""
+
+    def run(task):
+        if on_start is not None and "run_id" in task.params:
+            on_start(task.params["run_id"])
+        if task.params.get("exit_code") is not None:
+            os._exit(task.params["exit_code"])
+        if task.params.get("allocate_mb"):
+            data = b"x" * (task.params["allocate_mb"] * 2**20)
+            time.sleep(30)
+        time.sleep(task.params.get("sleep", 0))
+
+    return run
+
+
+def test_pool_restarts_crashed_slot(queue):
+    queue.max_attempts = 2
+    crashing = queue.submit("task_a", {"exit_code": 1})
+    pool = WorkerPool(queue, fake_runner, slots=1)
+    try:
+        slot = pool.slots[0]
+        first_pid = slot.process.pid
+        pool._fill_idle_slots()
+        assert slot.current.id == crashing
+        pool._collect_finished(timeout=10)
+        pool._restart_crashed()
+        assert slot.current is None
+        assert slot.process.is_alive() and slot.process.pid != first_pid
+
+        # the run of the crashed slot is back in the queue
+        queue.submit("task_a", {})
+        pool._fill_idle_slots()
+        assert slot.current.id == crashing and slot.current.attempts == 2
+        pool._collect_finished(timeout=10)
+        pool._restart_crashed()  # failed for good, after 2 attempts
+
+        pool._fill_idle_slots()
+        assert slot.current.params == {}
+        pool._collect_finished(timeout=10)
+        assert slot.current is None
+        assert queue.pending("task_a") == []
+    finally:
+        pool.shutdown()
+
+
+def run_isolated(params, limits):
+    """Executes a run of `fake_runner` with `params` in a child process, returns calls of `on_killed`"""
+    killed = []
+    runner = IsolatedRunner(
+        fake_runner, limits, lambda *args: killed.append(args), poll_interval=0.05
+    )
+    task = QueuedRun(0, "task_a", params, Path("task_a.json"))
+    runner(task)
+    return [(run_id, status) for _, run_id, status, _ in killed]
+
+
+@linux_only
+def test_isolated_runner_limits():
+    limits = RunLimits(max_rss_mb=100, timeout=2)
+    assert run_isolated({"run_id": 1}, limits) == []
+    assert run_isolated({"run_id": 2, "sleep": 30}, limits) == [(2, STATUS_TIMEOUT)]
+    assert run_isolated({"run_id": 3, "allocate_mb": 200}, limits) == [
+        (3, STATUS_OUT_OF_MEMORY)
+    ]
+    assert run_isolated({"run_id": 4, "exit_code": 3}, limits) == [(4, STATUS_FAILED)]
+    # dying before the run was stored in the database
+    assert run_isolated({"exit_code": 3}, RunLimits()) == [(None, STATUS_FAILED)]
+
+
+@linux_only
+def test_process_tree_rss():
+    before = process_tree_rss_mb(os.getpid())
+    assert before > 0
+    child = subprocess.Popen(
+        [sys.executable, "-c", "import time; data = b'x' * 100 * 2**20; time.sleep(30)"]
+    )
+    try:
+        deadline = time.monotonic() + 20
+        while process_tree_rss_mb(os.getpid()) < before + 90:
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_rss_limit_without_proc(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker_pool, "PROC_DIR", tmp_path / "missing")
+    with pytest.raises(ValueError, match="cannot be limited"):
+        RunLimits(max_rss_mb=100)
+    assert RunLimits(timeout=10).timeout == 10